@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from bhealthapp.models import City, User, Type, Service, Result, Appointment, Lab, UserRating, Notification
+from bhealthapp.pagination import EstimatedCountPaginator
 
 
 @admin.register(City)
@@ -114,6 +115,10 @@ class ServiceAdmin(admin.ModelAdmin):
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
+    # Estimated counts above PAGINATION_EXACT_COUNT_THRESHOLD, and no second count of the unfiltered table.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
     fieldsets = (
         (None, {
             'fields': ['lab_appointment', 'service_appointment', 'date', 'patient', 'status']
@@ -146,6 +151,9 @@ class ResultAdmin(admin.ModelAdmin):
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
     fieldsets = (
         (None, {
             'fields': ['notification_appointment', 'message', 'is_confirmed',
@@ -0,0 +1,246 @@
+"""
+Search as you type over lab, service, type and city names, without the database.
+
+Every process keeps a PrefixIndex in memory: each word suffix of each folded name
+("Hormone Lab Mostar" gives "hormone lab mostar", "lab mostar" and "mostar") in one
+sorted list, with the rank of its suggestion in a parallel array. Suggestions are
+ranked by popularity when the index is built, so a lookup bisects to the keys
+starting with the typed text and returns the best ranks among them. Prefixes shared
+by more than SCAN_LIMIT keys, the first letter or two typed, have their best ranks
+precomputed, so no lookup looks at more keys than that.
+
+Popularity is one plus the number of appointments of a lab, service, type or city,
+a lab's scaled up to double by its average rating. The index is built by a daemon
+thread started with the web worker, lookups before it is ready suggest nothing
+rather than query. Catalog renames, creations and deletes bump a version in the
+cache once they commit; the thread checks it every AUTOCOMPLETE_CHECK_SECONDS and
+rebuilds the index when it changed, or when the index is older than
+AUTOCOMPLETE_MAX_AGE so popularity follows new appointments and ratings. Lookups
+keep using the old index until the new one is swapped in.
+"""
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+
+from bhealthapp.models import Appointment, City, Lab, Service, Type
+
+logger = logging.getLogger(__name__)
+
+KIND_LAB = 'lab'
+KIND_SERVICE = 'service'
+KIND_TYPE = 'type'
+KIND_CITY = 'city'
+
+VERSION_KEY = 'autocomplete:version'
+# Most keys a lookup scans, prefixes of more keys have their suggestions precomputed.
+SCAN_LIMIT = 256
+# Keys are cut to this many characters, nobody types that far before picking a suggestion.
+KEY_LENGTH = 40
+# Sorts after every character a key can hold.
+LAST_CHAR = '\U0010ffff'
+# Letters NFKD does not take apart.
+LETTERS = str.maketrans({'đ': 'd', 'ł': 'l', 'ø': 'o'})
+NOT_WORD = re.compile(r'[\W_]+')
+
+
+def fold(text) -> str:
+    """Lowercase words of text without diacritics, separated by single spaces: "Đurić-Ćenić" gives "duric cenic"."""
+    text = unicodedata.normalize('NFKD', text.lower().translate(LETTERS))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NOT_WORD.sub(' ', text).strip()
+
+
+class PrefixIndex:
+    """Suggestions found by the start of any of their words, built from (popularity, kind, id, name) entries."""
+
+    def __init__(self, entries, limit=None):
+        self.limit = limit or settings.AUTOCOMPLETE_MAX_RESULTS
+        entries = sorted(entries, key=lambda entry: (-entry[0], entry[3], entry[1], entry[2]))
+        # The position of a suggestion is its rank, the most popular first.
+        self.suggestions = [(kind, pk, name) for _, kind, pk, name in entries]
+
+        pairs = set()
+        for rank, (_, _, name) in enumerate(self.suggestions):
+            words = fold(name).split()
+            for start in range(len(words)):
+                pairs.add((' '.join(words[start:])[:KEY_LENGTH], rank))
+        pairs = sorted(pairs)
+        self.keys = [key for key, _ in pairs]
+        self.ranks = array('I', (rank for _, rank in pairs))
+        self.top = self._crowded_prefixes()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, text, limit=None) -> list:
+        """The (kind, id, name) of the most popular suggestions with a word starting with text."""
+        prefix = fold(text)[:KEY_LENGTH]
+        if not prefix:
+            return []
+        limit = min(limit or self.limit, self.limit)
+        ranks = self.top.get(prefix)
+        if ranks is None:
+            ranks = self._best(*self._range(prefix), limit)
+        return [self.suggestions[rank] for rank in ranks[:limit]]
+
+    def _range(self, prefix):
+        start = bisect_left(self.keys, prefix)
+        return start, bisect_left(self.keys, prefix + LAST_CHAR, start)
+
+    def _best(self, start, end, limit):
+        # A suggestion has a key per word, several can start with the prefix.
+        return heapq.nsmallest(limit, set(self.ranks[start:end]))
+
+    def _crowded_prefixes(self) -> dict:
+        """Best ranks of every prefix of more than SCAN_LIMIT keys, found by walking down from the empty one."""
+        top = {}
+        prefixes = ['']
+        while prefixes:
+            prefix = prefixes.pop()
+            start, end = self._range(prefix)
+            if end - start <= SCAN_LIMIT:
+                continue
+            if prefix:
+                top[prefix] = self._best(start, end, self.limit)
+            position = start
+            while position < end:
+                key = self.keys[position]
+                if len(key) == len(prefix):
+                    position += 1
+                    continue
+                child = key[:len(prefix) + 1]
+                prefixes.append(child)
+                position = bisect_left(self.keys, child + LAST_CHAR, position, end)
+        return top
+
+
+def popularity_entries():
+    """(popularity, kind, id, name) of every lab, service, type and city with a lab, read with eight queries."""
+    booked = Appointment.objects.exclude(status=Appointment.STATUS_CANCELED).order_by()
+
+    def appointments(field):
+        return dict(booked.values_list(field).annotate(count=Count('id')))
+
+    labs = appointments('lab_appointment')
+    for pk, name, rating in Lab.objects.values_list('id', 'name', 'average_rating'):
+        yield (1 + labs.get(pk, 0)) * (1 + (rating or 0) / 5), KIND_LAB, pk, name
+    services = appointments('service_appointment')
+    for pk, name in Service.objects.values_list('id', 'name'):
+        yield 1 + services.get(pk, 0), KIND_SERVICE, pk, name
+    types = appointments('service_appointment__type')
+    for pk, name in Type.objects.values_list('id', 'name'):
+        yield 1 + types.get(pk, 0), KIND_TYPE, pk, name
+    cities = appointments('lab_appointment__city')
+    for pk, name in City.objects.filter(lab_city__isnull=False).distinct().values_list('id', 'name'):
+        yield 1 + cities.get(pk, 0), KIND_CITY, pk, name
+
+
+class Autocomplete:
+    """The index of this process, built and then kept current from a daemon thread."""
+
+    def __init__(self, index=None, built_at=0.0, version=None):
+        self.index = index
+        self.built_at = built_at
+        self.version = version
+        self.lock = threading.Lock()
+        # Separate from lock, so a lookup never waits for a build to start the thread.
+        self.thread_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def suggest(self, text, limit=None) -> list:
+        index = self.index
+        if index is None:
+            # Still being built, a lookup never waits for the catalog queries.
+            self.start()
+            return []
+        return index.lookup(text, limit)
+
+    def rebuild(self) -> PrefixIndex:
+        with self.lock:
+            self._build()
+            return self.index
+
+    def _build(self):
+        # Read before the catalog, a change committed meanwhile makes the next check rebuild again.
+        version = cache.get(VERSION_KEY)
+        started = time.monotonic()
+        index = PrefixIndex(popularity_entries())
+        self.index, self.built_at, self.version = index, started, version
+        logger.info('Built the autocomplete index, %s keys in %.2fs', len(index), time.monotonic() - started)
+
+    def start(self):
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='autocomplete', daemon=True)
+                self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stale(self) -> bool:
+        return cache.get(VERSION_KEY) != self.version or time.monotonic() - self.built_at > settings.AUTOCOMPLETE_MAX_AGE
+
+    def _run(self):
+        while True:
+            try:
+                if self.index is None or self.stale():
+                    close_old_connections()
+                    self.rebuild()
+            except Exception:
+                logger.exception('Could not rebuild the autocomplete index, lookups keep the old one')
+            finally:
+                connection.close()
+            if self.stopped.wait(settings.AUTOCOMPLETE_CHECK_SECONDS):
+                return
+
+
+_lock = threading.Lock()
+_instance = None
+
+
+def get_autocomplete() -> Autocomplete:
+    global _instance
+    with _lock:
+        if _instance is None:
+            _instance = Autocomplete()
+        elif _instance.pid != os.getpid():
+            # A forked worker inherits the index but not the thread keeping it current.
+            _instance = Autocomplete(_instance.index, _instance.built_at, _instance.version)
+            _instance.start()
+        return _instance
+
+
+def suggest(text, limit=None) -> list:
+    return get_autocomplete().suggest(text, limit)
+
+
+def warm_up():
+    """Start building the index of this process before its first lookup."""
+    get_autocomplete().start()
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def catalog_changed():
+    """Have every process rebuild its index once the saving transaction commits."""
+    transaction.on_commit(bump_version)
@@ -0,0 +1,155 @@
+"""
+Free appointment slots of a lab.
+
+A lab takes one appointment at a time, each one keeping it busy for the duration
+of its service. The busy intervals of a lab-day are fetched for all requested days
+with one range query, merged, and cached per lab-day as epoch seconds; free slots
+for a service are the gaps between them within opening hours, long enough for the
+service and starting on an AVAILABILITY_SLOT_MINUTES boundary. Cache keys carry
+Lab.availability_version, which appointment saves and deletes bump in their own
+transaction, so once a change commits no process reads the days it cached before,
+whether or not the processes share a cache.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from bhealthapp.models import BOOKING_FIELDS, Appointment, Lab
+
+CACHE_PREFIX = 'availability'
+
+
+def cache_key(lab_id, version, day: date) -> str:
+    return f'{CACHE_PREFIX}:{lab_id}:{version}:{day.isoformat()}'
+
+
+def slot_step() -> int:
+    return settings.AVAILABILITY_SLOT_MINUTES * 60
+
+
+def occupied_seconds(duration: timedelta) -> int:
+    # Services without a sensible duration still take one slot.
+    return max(int(duration.total_seconds()), slot_step()) if duration else slot_step()
+
+
+def day_bounds(day: date):
+    """Epoch seconds of midnight starting and ending day in the current time zone."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+
+def opening_hours(day: date):
+    if day.weekday() not in settings.LAB_WORKING_DAYS:
+        return None
+    midnight = day_bounds(day)[0]
+    return midnight + settings.LAB_OPENING_HOUR * 3600, midnight + settings.LAB_CLOSING_HOUR * 3600
+
+
+def merge_intervals(intervals) -> list:
+    """Merge overlapping and touching [start, end) intervals, sorting them first."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def free_starts(busy, opens, closes, length, step, not_before=None):
+    """Slot starts between opens and closes that fit length seconds between the merged busy intervals."""
+    earliest = opens if not_before is None else max(opens, not_before)
+    gap_start = opens
+    for busy_start, busy_end in busy + [[closes, closes]]:
+        gap_end = min(busy_start, closes)
+        start = max(gap_start, earliest)
+        # Round up to the next step counted from opening time.
+        start = opens + -(-(start - opens) // step) * step
+        while start + length <= gap_end:
+            yield start
+            start += step
+        gap_start = max(gap_start, busy_end)
+        if gap_start >= closes:
+            return
+
+
+def lab_version(lab_id) -> int:
+    return Lab.objects.filter(pk=lab_id).values_list('availability_version', flat=True).first() or 0
+
+
+def busy_intervals(lab_id, days, version=None) -> dict:
+    """Merged busy intervals of every day, from the cache or one query for all the days it lacks."""
+    version = lab_version(lab_id) if version is None else version
+    keys = {cache_key(lab_id, version, day): day for day in days}
+    cached = cache.get_many(keys)
+    busy = {keys[key]: intervals for key, intervals in cached.items()}
+
+    missing = [day for day in days if day not in busy]
+    if missing:
+        # From the day before, whose late appointments can run into the first day.
+        first, last = day_bounds(min(missing) - timedelta(days=1))[0], day_bounds(max(missing))[1]
+        booked = Appointment.objects.filter(
+            lab_appointment_id=lab_id, date__gte=datetime.fromtimestamp(first, timezone.utc),
+            date__lt=datetime.fromtimestamp(last, timezone.utc)
+        ).exclude(status=Appointment.STATUS_CANCELED).values_list('date', 'service_appointment__duration')
+
+        by_day = {day: [] for day in missing}
+        for start, duration in booked:
+            begins = int(start.timestamp())
+            ends = begins + occupied_seconds(duration)
+            # Every day the booking keeps the lab busy on, the next one too when it runs past midnight.
+            day = timezone.localtime(start).date()
+            last = timezone.localtime(start + timedelta(seconds=ends - begins - 1)).date()
+            while day <= last:
+                if day in by_day:
+                    by_day[day].append((begins, ends))
+                day += timedelta(days=1)
+
+        fetched = {day: merge_intervals(intervals) for day, intervals in by_day.items()}
+        cache.set_many({cache_key(lab_id, version, day): intervals for day, intervals in fetched.items()},
+                       settings.AVAILABILITY_CACHE_SECONDS)
+        busy.update(fetched)
+
+    return busy
+
+
+def available_slots(lab_id, duration: timedelta, start: date, end: date, version=None) -> list:
+    """(start, end) datetimes of every free slot of the lab from day start through day end, version read if not given."""
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    busy = busy_intervals(lab_id, days, version)
+    length = occupied_seconds(duration)
+    now = int(timezone.now().timestamp())
+
+    slots = []
+    for day in days:
+        hours = opening_hours(day)
+        if hours is None:
+            continue
+        for begins in free_starts(busy[day], hours[0], hours[1], length, slot_step(), not_before=now):
+            slots.append((datetime.fromtimestamp(begins, timezone.utc),
+                          datetime.fromtimestamp(begins + length, timezone.utc)))
+    return slots
+
+
+def as_datetime(value):
+    # Views hand the date over as the client sent it, it is only parsed on its way to the database.
+    value = Appointment._meta.get_field('date').to_python(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def invalidate(*lab_ids):
+    """Move the labs to a new availability version, their cached days are not read again once this commits."""
+    Lab.objects.filter(pk__in=lab_ids).update(availability_version=F('availability_version') + 1)
+
+
+def appointment_changed(appointment, created=False, deleted=False):
+    """Invalidate the lab the appointment was and is now with, in the transaction saving it."""
+    was = getattr(appointment, '_booked_was', (None,) * len(BOOKING_FIELDS))
+    if not created and not deleted and was == tuple(getattr(appointment, field) for field in BOOKING_FIELDS):
+        return
+    invalidate(*{lab_id for lab_id in (appointment.lab_appointment_id, was[0]) if lab_id is not None})
@@ -0,0 +1,203 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from bhealthapp.backpressure import DELAY, SHED
+from bhealthapp.envelope import Envelope, encode
+from bhealthapp.rmq_send_message import Publisher
+from bhealthapp.spool import get_spool
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+OVERFLOW_SPILL = 'spill'
+
+# Most published outbox rows deleted with one query.
+OUTBOX_DELETE_BATCH = 100
+
+_STOP = object()
+_lock = threading.Lock()
+_instance = None
+
+
+class BackgroundPublisher:
+    """
+    Publishes broker messages from a daemon thread so request threads only pay for
+    a queue put. When the queue is full the overflow policy decides what happens:
+    block waits up to block_timeout for room and then spills, drop discards, spill
+    appends the message to the spool for the drainer to publish later. Messages that
+    fail to publish are spooled as well, and for SPOOL_RETRY_SECONDS after a failure
+    everything goes straight to the spool instead of waiting on a dead broker.
+    Messages that came from the outbox are never spooled, their row outlives a lost
+    message. While a subscribed queue is backed up, events the publisher delays are
+    left to the spool or the outbox relay and events it sheds are dropped. A message
+    that can neither be published nor spooled is logged and dropped, the thread goes
+    on with the next one.
+    """
+
+    def __init__(self, max_size=None, overflow=None, block_timeout=None, spool=None, publisher=None):
+        self.queue = queue.Queue(maxsize=max_size if max_size is not None else settings.PUBLISH_QUEUE_SIZE)
+        self.overflow = overflow or settings.PUBLISH_OVERFLOW
+        self.block_timeout = block_timeout if block_timeout is not None else settings.PUBLISH_BLOCK_TIMEOUT_MS / 1000
+        self.spool = spool or get_spool()
+        self.publisher = publisher or Publisher(confirm_delivery=settings.RABBITMQ_PUBLISHER_CONFIRMS)
+        self.broker_down_until = 0.0
+        self.dropped = 0
+        self.spilled = 0
+        self.shed = 0
+        self.thread = None
+        self.pid = os.getpid()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='background-publisher', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, envelope: Envelope, outbox_id=None) -> bool:
+        """Hand a message to the publisher thread, returns False if it had to be dropped or spilled."""
+        message = (envelope, outbox_id)
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self.queue.put(message, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self._overflow(message)
+            return False
+
+    def stop(self, timeout=None):
+        """Publish everything already queued, waiting at most timeout seconds, and spill the rest."""
+        timeout = timeout if timeout is not None else settings.PUBLISH_SHUTDOWN_TIMEOUT
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout)
+
+        leftover = []
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is not _STOP:
+                leftover.append(message)
+        for message in leftover:
+            self._spill(message)
+
+        self.publisher.close()
+
+    def _run(self):
+        try:
+            running = True
+            while running:
+                # Take whatever else is already queued, so its outbox rows go in one delete.
+                messages = [self.queue.get()]
+                while len(messages) < OUTBOX_DELETE_BATCH:
+                    try:
+                        messages.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                published = []
+                for message in messages:
+                    if message is _STOP:
+                        running = False
+                        continue
+                    try:
+                        if self._publish(message) and message[1] is not None:
+                            published.append(message[1])
+                    except Exception:
+                        # Whatever one message runs into, the thread lives on for the next.
+                        logger.exception('Could not publish or spool a message for %s', message[0].event_type)
+                self._delete_outbox_rows(published)
+        finally:
+            connection.close()
+
+    def _publish(self, message) -> bool:
+        envelope, outbox_id = message
+        if time.monotonic() < self.broker_down_until:
+            self._spill(message)
+            return False
+
+        try:
+            decision = self.publisher.admit(envelope.event_type)
+            if decision == SHED:
+                # Nothing to relay later either, its outbox row goes with the published ones.
+                self.shed += 1
+                return True
+            if decision == DELAY:
+                self._spill(message)
+                return False
+            self.publisher.publish(envelope.event_type, encode(envelope))
+        except Exception:
+            logger.exception('Could not publish to %s, spooling until the broker is back', envelope.event_type)
+            self.broker_down_until = time.monotonic() + settings.SPOOL_RETRY_SECONDS
+            self._spill(message)
+            return False
+        return True
+
+    def _delete_outbox_rows(self, outbox_ids):
+        if not outbox_ids:
+            return
+        from bhealthapp.models import Outbox
+
+        close_old_connections()
+        try:
+            Outbox.objects.filter(pk__in=outbox_ids).delete()
+        except Exception:
+            # The relay publishes these again later, consumers drop the duplicates by message id.
+            logger.exception('Could not delete %s published outbox rows', len(outbox_ids))
+
+    def _overflow(self, message):
+        if self.overflow == OVERFLOW_SPILL or self.overflow == OVERFLOW_BLOCK:
+            self._spill(message)
+        else:
+            self.dropped += 1
+            logger.warning('Publish queue full, dropped message for %s', message[0].event_type)
+
+    def _spill(self, message):
+        envelope, outbox_id = message
+        if outbox_id is not None:
+            # Still in the outbox, relay_outbox publishes it once the row is old enough.
+            return
+
+        try:
+            self.spool.append(envelope.event_type, encode(envelope))
+        except OSError:
+            self.dropped += 1
+            logger.exception('Could not spool a message for %s, dropped it', envelope.event_type)
+            return
+        self.spilled += 1
+
+
+def get_background_publisher() -> BackgroundPublisher:
+    global _instance
+    with _lock:
+        # A forked worker inherits the object but not the thread, start a fresh one.
+        if _instance is None or _instance.pid != os.getpid():
+            _instance = BackgroundPublisher()
+            _instance.start()
+        elif not _instance.thread.is_alive():
+            # Keeps the messages already queued.
+            logger.error('The background publisher thread died, restarting it')
+            _instance.start()
+        return _instance
+
+
+def enqueue(envelope: Envelope, outbox_id=None) -> bool:
+    return get_background_publisher().enqueue(envelope, outbox_id)
+
+
+@atexit.register
+def _flush_on_exit():
+    if _instance is not None and _instance.pid == os.getpid():
+        _instance.stop()
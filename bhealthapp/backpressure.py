@@ -0,0 +1,79 @@
+import time
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge
+
+from bhealthapp.rmq_topology import subscribers
+
+PUBLISH = 'publish'
+DELAY = 'delay'
+SHED = 'shed'
+
+# What happens to an event while one of its queues is over the high watermark. Events not
+# listed are critical and always published, delayed events wait in the spool and shed
+# events are dropped.
+EVENT_POLICIES = {
+    'appointment.updated': DELAY,
+}
+
+THROTTLED = Gauge('bhealth_publisher_throttled', 'Whether publishing to a queue is throttled.', ['queue'])
+BLOCKED = Gauge('bhealth_publisher_blocked', 'Whether the broker has blocked this connection.')
+PUBLISHER_QUEUE_DEPTH = Gauge('bhealth_publisher_queue_depth', 'Queue depth as last seen by the publisher.', ['queue'])
+DECISIONS = Counter('bhealth_publisher_events_total', 'Events by backpressure decision.', ['event', 'decision'])
+
+
+def event_policy(routing_key):
+    return settings.PUBLISH_EVENT_POLICIES.get(routing_key, EVENT_POLICIES.get(routing_key, PUBLISH))
+
+
+class Backpressure:
+    """
+    Decides per event whether to publish it now. Queue depths come from passive
+    declares cached for depth_ttl seconds. A queue is throttled from the high
+    watermark until it drains below the low one, and everything is throttled while
+    the broker has blocked the connection through flow control.
+    """
+
+    def __init__(self, high_watermark=None, low_watermark=None, depth_ttl=None):
+        self.high_watermark = settings.BACKPRESSURE_HIGH_WATERMARK if high_watermark is None else high_watermark
+        self.low_watermark = settings.BACKPRESSURE_LOW_WATERMARK if low_watermark is None else low_watermark
+        self.depth_ttl = settings.BACKPRESSURE_DEPTH_TTL_SECONDS if depth_ttl is None else depth_ttl
+        self.depths = {}
+        self.throttled = set()
+        self.blocked = False
+
+    def decide(self, channel, routing_key) -> str:
+        policy = event_policy(routing_key)
+        decision = PUBLISH
+        if policy != PUBLISH and self.high_watermark and (self.blocked or self._throttled(channel, routing_key)):
+            decision = policy
+        DECISIONS.labels(routing_key, decision).inc()
+        return decision
+
+    def on_blocked(self, *args):
+        self.blocked = True
+        BLOCKED.set(1)
+
+    def on_unblocked(self, *args):
+        self.blocked = False
+        BLOCKED.set(0)
+
+    def _throttled(self, channel, routing_key):
+        return any([self._queue_throttled(channel, queue) for queue in subscribers(routing_key)])
+
+    def _queue_throttled(self, channel, queue):
+        depth = self._depth(channel, queue)
+        if depth >= self.high_watermark:
+            self.throttled.add(queue)
+        elif depth <= self.low_watermark:
+            self.throttled.discard(queue)
+        THROTTLED.labels(queue).set(queue in self.throttled)
+        return queue in self.throttled
+
+    def _depth(self, channel, queue):
+        depth, checked_at = self.depths.get(queue, (0, None))
+        if checked_at is None or time.monotonic() - checked_at >= self.depth_ttl:
+            depth = channel.queue_declare(queue=queue, durable=True, passive=True).method.message_count
+            self.depths[queue] = (depth, time.monotonic())
+            PUBLISHER_QUEUE_DEPTH.labels(queue).set(depth)
+        return depth
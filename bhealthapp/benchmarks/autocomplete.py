@@ -0,0 +1,84 @@
+"""
+Autocomplete lookups from the in-memory prefix index, against ranked lab search.
+
+Labs, cities, types, services and appointments are bulk loaded into a throwaway
+test database, then the index is built once. Lookups type the first one to six
+letters of words the labs were named from, as a client sends them key by key;
+the baseline is a ranked search_labs page for the same text.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from bhealthapp.autocomplete import Autocomplete
+from bhealthapp.models import Appointment, City, Country, Lab, Service, Type, User
+from bhealthapp.search import search_labs
+
+SYLLABLES = ['ka', 'lo', 'me', 'di', 'ra', 'no', 'vi', 'ta', 'se', 'bo', 'ze', 'ni', 'ko', 'gra', 'dno', 'mar']
+WORDS = sorted({a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES})
+
+
+def add_arguments(parser):
+    parser.add_argument('--labs', type=int, default=100000)
+    parser.add_argument('--appointments', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs.')
+
+
+def run(labs, appointments, lookups, keepdb=False, **options):
+    old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+    try:
+        return _run(labs, appointments, lookups)
+    finally:
+        teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+
+def _run(labs, appointments, lookups):
+    rng = random.Random(13)
+    country = Country.objects.create(name='Bosnia and Herzegovina')
+    cities = City.objects.bulk_create([City(name=f'{rng.choice(WORDS).title()} {i}', country=country, postal_code=71000 + i)
+                                       for i in range(50)])
+    types = Type.objects.bulk_create([Type(name=f'{rng.choice(WORDS).title()} {i}') for i in range(20)])
+    services = Service.objects.bulk_create([
+        Service(name=f'{rng.choice(WORDS)} panel {i}', duration=timedelta(minutes=30), type=rng.choice(types)) for i in range(200)
+    ])
+    # bulk_create skips the signals, like a data import would.
+    created = Lab.objects.bulk_create([
+        Lab(city=rng.choice(cities), name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}',
+            address='Titova 1', email=f'lab{i}@example.com', average_rating=rng.choice([0, 3.5, 4.5, 5]))
+        for i in range(labs)
+    ], batch_size=5000)
+    patient = User.objects.create(username='patient', email='patient@example.com', city=cities[0])
+    now = timezone.now()
+    Appointment.objects.bulk_create([
+        Appointment(lab_appointment=rng.choice(created), service_appointment=rng.choice(services), patient=patient,
+                    date=now + timedelta(minutes=i))
+        for i in range(appointments)
+    ], batch_size=10000)
+
+    autocomplete = Autocomplete()
+    started = time.perf_counter()
+    index = autocomplete.rebuild()
+    build_seconds = time.perf_counter() - started
+
+    texts = [rng.choice(WORDS)[:1 + i % 6] for i in range(lookups)]
+    started = time.perf_counter()
+    for text in texts:
+        autocomplete.suggest(text)
+    lookup_us = (time.perf_counter() - started) / lookups * 1000000
+    started = time.perf_counter()
+    for text in texts[:100]:
+        list(search_labs(text)[:10])
+    search_us = (time.perf_counter() - started) / 100 * 1000000
+
+    return [
+        ('labs', labs),
+        ('index keys', len(index)),
+        ('precomputed prefixes', len(index.top)),
+        ('index build s', build_seconds),
+        ('autocomplete lookup us', lookup_us),
+        ('ranked search us', search_us),
+    ]
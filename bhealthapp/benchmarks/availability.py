@@ -0,0 +1,96 @@
+"""
+Free slot lookups for a month of a busy lab, cold and from the lab-day cache.
+
+The lab gets the given number of bookings spread over the month, a fifth of them
+canceled, in a throwaway test database. The naive lookup, one overlap query per
+candidate slot, is measured as the baseline on the first day only.
+"""
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.utils import timezone
+
+from bhealthapp.availability import available_slots, opening_hours, slot_step
+from bhealthapp.benchmarks.data import create_lab, create_patient, create_service
+from bhealthapp.models import Appointment
+
+
+def add_arguments(parser):
+    parser.add_argument('--bookings', type=int, default=5000, help='Bookings in the month.')
+    parser.add_argument('--lookups', type=int, default=50)
+    parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs.')
+
+
+def run(bookings, lookups, keepdb=False, **options):
+    # A 24 hour lab, so thousands of bookings still leave gaps to find.
+    with override_settings(LAB_OPENING_HOUR=0, LAB_CLOSING_HOUR=24, LAB_WORKING_DAYS=list(range(7)),
+                           AVAILABILITY_SLOT_MINUTES=5):
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+        try:
+            return _run(bookings, lookups)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+
+def _timed(count, func):
+    started = time.perf_counter()
+    for _ in range(count):
+        result = func()
+    return (time.perf_counter() - started) / count * 1000, result
+
+
+def naive_slots(lab, duration, day):
+    """Check every candidate slot with its own overlap query."""
+    opens, closes = opening_hours(day)
+    slots = []
+    for begins in range(opens, closes - int(duration.total_seconds()) + 1, slot_step()):
+        start = datetime.fromtimestamp(begins, timezone.utc)
+        overlapping = Appointment.objects.filter(
+            lab_appointment=lab, date__lt=start + duration, date__gt=start - duration
+        ).exclude(status=Appointment.STATUS_CANCELED)
+        if not overlapping.exists():
+            slots.append(start)
+    return slots
+
+
+def _run(bookings, lookups):
+    lab = create_lab()
+    service = create_service(lab=lab, duration=timedelta(minutes=15))
+    patient = create_patient(city=lab.city)
+
+    first = date(2030, 1, 1)
+    month_start = timezone.make_aware(datetime.combine(first, datetime.min.time()))
+    rng = random.Random(42)
+    Appointment.objects.bulk_create([
+        Appointment(lab_appointment=lab, service_appointment=service, patient=patient,
+                    date=month_start + timedelta(minutes=5 * rng.randrange(30 * 288)),
+                    status=Appointment.STATUS_CANCELED if rng.random() < 0.2 else Appointment.STATUS_PENDING)
+        for _ in range(bookings)
+    ], batch_size=1000)
+    last = first + timedelta(days=29)
+
+    def cold():
+        cache.clear()
+        return available_slots(lab.id, service.duration, first, last)
+
+    with CaptureQueriesContext(connection) as cold_queries:
+        cold_ms, slots = _timed(1, cold)
+    cold_ms, _ = _timed(lookups, cold)
+    warm_ms, _ = _timed(lookups, lambda: available_slots(lab.id, service.duration, first, last))
+
+    with CaptureQueriesContext(connection) as naive_queries:
+        naive_ms, _ = _timed(1, lambda: naive_slots(lab, service.duration, first))
+
+    return [
+        ('bookings in month', bookings),
+        ('free slots in month', len(slots)),
+        ('cold month lookup ms', cold_ms),
+        ('cold month lookup queries', len(cold_queries)),
+        ('cached month lookup ms', warm_ms),
+        ('naive single day lookup ms', naive_ms),
+        ('naive single day lookup queries', len(naive_queries)),
+    ]
@@ -0,0 +1,116 @@
+"""
+Concurrent booking clients racing for the slots of one lab.
+
+Every client posts to AppointmentAddView through the API test client, picking
+random 15 minute slots of the lab's working days, so most requests collide. At
+most --workers requests are in flight at once, like the worker pool of a web
+server, each on its own database connection. Afterwards the lab's appointments
+are checked for overlaps; --no-lock skips the advisory lock to show what it
+prevents.
+"""
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from bhealthapp import memory_broker
+from bhealthapp.background_publisher import get_background_publisher
+from bhealthapp.benchmarks.data import create_lab, create_patient, create_service
+from bhealthapp.benchmarks.messaging import percentile
+from bhealthapp.models import Appointment
+
+
+def add_arguments(parser):
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=20, help='Booking attempts per client.')
+    parser.add_argument('--workers', type=int, default=40, help='Requests in flight at once.')
+    parser.add_argument('--days', type=int, default=5, help='Working days the clients pick slots from.')
+    parser.add_argument('--no-lock', action='store_true', help='Book without the per lab-day advisory lock.')
+    parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs.')
+
+
+def run(clients, requests, workers, days, no_lock=False, keepdb=False, **options):
+    with override_settings(RABBITMQ_TRANSPORT='memory', BACKPRESSURE_HIGH_WATERMARK=0):
+        memory_broker.reset()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+        try:
+            if no_lock:
+                with mock.patch('bhealthapp.booking.lock_lab_day'):
+                    return _run(clients, requests, workers, days)
+            return _run(clients, requests, workers, days)
+        finally:
+            get_background_publisher().stop()
+            teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+
+def overlaps(appointments):
+    """Pairs of consecutive appointments where the first one ends after the next one starts."""
+    count = 0
+    for (start, duration), (next_start, _) in zip(appointments, appointments[1:]):
+        if start + duration > next_start:
+            count += 1
+    return count
+
+
+def _run(clients, requests, workers, days):
+    lab = create_lab()
+    service = create_service(lab=lab, duration=timedelta(minutes=30))
+    patients = [create_patient(city=lab.city, username=f'patient{i}', email=f'patient{i}@example.com')
+                for i in range(clients)]
+
+    first = date(2030, 1, 7)
+    # Every quarter hour from 8:00 to 15:45.
+    slots = [
+        timezone.make_aware(datetime.combine(first + timedelta(days=day), datetime.min.time()))
+        + timedelta(hours=8, minutes=15 * i)
+        for day in range(days) for i in range(32)
+    ]
+    in_flight = threading.BoundedSemaphore(workers)
+    start_line = threading.Barrier(clients)
+    latencies = []
+    statuses = []
+
+    def client(patient, seed):
+        rng = random.Random(seed)
+        # Its own address, so the anonymous rate limit applies per client as it would in production.
+        api = APIClient(REMOTE_ADDR=f'10.0.{seed // 256}.{seed % 256}')
+        start_line.wait()
+        for _ in range(requests):
+            payload = {'lab_appointment': lab.id, 'service_appointment': service.id, 'patient': patient.id,
+                       'date': rng.choice(slots).isoformat()}
+            with in_flight:
+                started = time.perf_counter()
+                # Each request closes its connection when it finishes, like it would under a web server.
+                response = api.post(reverse('add_appointment'), payload, format='json')
+                latencies.append(time.perf_counter() - started)
+            statuses.append(response.status_code)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(patient, i)) for i, patient in enumerate(patients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    booked = list(Appointment.objects.filter(lab_appointment=lab).exclude(status=Appointment.STATUS_CANCELED)
+                  .order_by('date').values_list('date', 'service_appointment__duration'))
+    return [
+        ('booking requests', len(statuses)),
+        ('booked (201)', statuses.count(201)),
+        ('refused (409)', statuses.count(409)),
+        ('other responses', len(statuses) - statuses.count(201) - statuses.count(409)),
+        ('slots in range', len(slots)),
+        ('overlapping appointments', overlaps(booked)),
+        ('requests/s', len(statuses) / elapsed),
+        ('p50 latency ms', percentile(latencies, 0.50) * 1000),
+        ('p99 latency ms', percentile(latencies, 0.99) * 1000),
+    ]
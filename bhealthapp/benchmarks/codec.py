@@ -0,0 +1,47 @@
+"""
+Encode/decode cost and size on the wire of each message envelope codec.
+
+Bare JSON, the format used before envelopes, is measured as the baseline.
+"""
+import json
+import time
+
+from bhealthapp import envelope
+from bhealthapp.envelope import Envelope, decode, encode
+
+
+def add_arguments(parser):
+    parser.add_argument('--messages', type=int, default=100000)
+
+
+def _per_second(count, func):
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - started)
+
+
+def run(messages, **options):
+    payload = {'appointment_id': 123456}
+    message = Envelope.new('appointment.created', payload)
+
+    bare = json.dumps(payload).encode()
+    results = [
+        ('bare json encode/s', _per_second(messages, lambda: json.dumps(payload).encode())),
+        ('bare json decode/s', _per_second(messages, lambda: json.loads(bare))),
+        ('bare json bytes', len(bare)),
+    ]
+
+    codecs = [envelope.JsonCodec.name]
+    if envelope.msgpack is not None:
+        codecs.append(envelope.MsgpackCodec.name)
+
+    for codec in codecs:
+        body = encode(message, codec)
+        view = memoryview(body)
+        results += [
+            (f'{codec} envelope encode/s', _per_second(messages, lambda: encode(message, codec))),
+            (f'{codec} envelope decode/s', _per_second(messages, lambda: decode(view))),
+            (f'{codec} envelope bytes', len(body)),
+        ]
+    return results
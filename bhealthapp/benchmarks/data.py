@@ -0,0 +1,38 @@
+"""Builders of the cities, patients, labs, services and appointments benchmarks and tests start from."""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from bhealthapp.models import Country, City, User, Lab, Type, Service, LabService, Appointment
+
+
+def create_city(name='Sarajevo', postal_code=71000):
+    country, _ = Country.objects.get_or_create(name='Bosnia and Herzegovina')
+    return City.objects.create(name=name, country=country, postal_code=postal_code)
+
+
+def create_patient(city=None, username='patient', email='patient@example.com'):
+    return User.objects.create(username=username, email=email, password='password', city=city or create_city())
+
+
+def create_lab(city=None, name='Test Lab', address='Titova 1', email='lab@example.com'):
+    return Lab.objects.create(city=city or create_city(), name=name, address=address, email=email)
+
+
+def create_service(name='Blood test', duration=timedelta(minutes=30), lab=None):
+    service_type, _ = Type.objects.get_or_create(name='Laboratory', defaults={'description': 'Laboratory tests'})
+    service = Service.objects.create(name=name, duration=duration, type=service_type)
+    if lab is not None:
+        LabService.objects.create(lab_service=lab, service=service)
+    return service
+
+
+def create_appointment(lab=None, service=None, patient=None, date=None, status=Appointment.STATUS_PENDING):
+    lab = lab or create_lab()
+    return Appointment.objects.create(
+        lab_appointment=lab,
+        service_appointment=service or create_service(),
+        patient=patient or create_patient(city=lab.city),
+        date=date or timezone.now(),
+        status=status,
+    )
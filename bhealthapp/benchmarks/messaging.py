@@ -0,0 +1,126 @@
+"""
+End-to-end booking-to-notification throughput over the in-memory broker.
+
+Producer threads book appointments the way AppointmentAddView does: the appointment
+and its outbox event are written in one transaction and the background publisher
+sends the event once it commits. A Consumer with the given number of workers turns
+the events into notifications. Everything runs in this process against a throwaway
+test database, so the benchmark needs neither RabbitMQ nor network access.
+"""
+import threading
+import time
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.utils import timezone
+
+from bhealthapp import memory_broker, metrics
+from bhealthapp.background_publisher import get_background_publisher
+from bhealthapp.benchmarks.data import create_lab, create_patient, create_service
+from bhealthapp.consumer import Consumer
+from bhealthapp.metrics import QueryTimer
+from bhealthapp.models import Appointment
+from bhealthapp.outbox import record_event
+
+
+def add_arguments(parser):
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4, help='Consumer worker threads.')
+    parser.add_argument('--batch-size', type=int, default=0, help='Consumer batch size, 0 handles messages one by one.')
+    parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs.')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def recording_timer(timers):
+    """QueryTimer subclass that keeps every instance, so queries of all consumer threads can be added up."""
+
+    class RecordingTimer(metrics.QueryTimer):
+        def __init__(self):
+            super().__init__()
+            timers.append(self)
+
+    return RecordingTimer
+
+
+def book(lab, service, patient, count, queries):
+    # Not metrics.QueryTimer, that one is patched to count the consumer's queries.
+    timer = QueryTimer()
+    try:
+        with connection.execute_wrapper(timer):
+            for _ in range(count):
+                with transaction.atomic():
+                    appointment = Appointment.objects.create(
+                        lab_appointment=lab, service_appointment=service, patient=patient, date=timezone.now(),
+                        status=Appointment.STATUS_PENDING
+                    )
+                    record_event('appointment.created', {'appointment_id': appointment.id})
+    finally:
+        queries.append(timer.queries)
+        connection.close()
+
+
+def run(bookings, producers, workers, batch_size, keepdb=False, **options):
+    with override_settings(RABBITMQ_TRANSPORT='memory', CONSUMER_DEPTH_POLL_SECONDS=0, PUBLISH_OVERFLOW='block',
+                           PUBLISH_BLOCK_TIMEOUT_MS=60000):
+        memory_broker.reset()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+        try:
+            return _run(bookings, producers, workers, batch_size)
+        finally:
+            get_background_publisher().stop()
+            teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+
+def _run(bookings, producers, workers, batch_size):
+    lab = create_lab()
+    service = create_service(lab=lab)
+    patient = create_patient(city=lab.city)
+
+    latencies = []
+    timers = []
+    apt_consumer = Consumer(queues=['requests'], concurrency=workers, batch_size=batch_size, prefetch_count=workers * 10)
+    consumer_thread = threading.Thread(target=apt_consumer.start)
+
+    def record_latency(queue, produced_at):
+        latencies.append(time.time() - produced_at)
+
+    with mock.patch.object(metrics, 'observe_latency', record_latency), \
+            mock.patch.object(metrics, 'QueryTimer', recording_timer(timers)):
+        consumer_thread.start()
+        started = time.perf_counter()
+
+        producer_queries = []
+        threads = [
+            threading.Thread(target=book, args=(lab, service, patient, bookings // producers, producer_queries))
+            for _ in range(producers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = bookings // producers * producers
+        deadline = time.monotonic() + 120
+        while apt_consumer.processed < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        apt_consumer.stop()
+        consumer_thread.join()
+
+    handled = max(apt_consumer.processed, 1)
+    return [
+        ('bookings', expected),
+        ('notifications written', apt_consumer.processed),
+        ('end to end bookings/s', apt_consumer.processed / elapsed),
+        ('p50 latency ms', percentile(latencies, 0.50) * 1000),
+        ('p99 latency ms', percentile(latencies, 0.99) * 1000),
+        ('producer queries/booking', sum(producer_queries) / max(expected, 1)),
+        ('consumer queries/message', sum(timer.queries for timer in timers) / handled),
+    ]
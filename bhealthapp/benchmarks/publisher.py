@@ -0,0 +1,116 @@
+"""
+Messages/sec of the per-call connection publisher against the pooled Publisher.
+
+The broker is replaced by a stand-in that charges a simulated network round trip
+for every AMQP method that waits on the broker, so the numbers reflect handshakes
+saved rather than the speed of a local RabbitMQ.
+"""
+import time
+from unittest import mock
+
+import pika
+
+from bhealthapp import rmq_send_message
+from bhealthapp.rmq_send_message import Publisher, dict_to_json_string
+from bhealthapp.rmq_topology import declare_queue
+
+# Connection.Start/Tune/Open plus Channel.Open, roughly four round trips before the first publish.
+HANDSHAKE_ROUND_TRIPS = 4
+
+
+class StandInChannel:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open = True
+        self.confirming = False
+        self.published = 0
+
+    def confirm_delivery(self):
+        self.connection.round_trip()
+        self.confirming = True
+
+    def exchange_declare(self, exchange, exchange_type='direct', durable=False, **kwargs):
+        self.connection.round_trip()
+
+    def queue_declare(self, queue, durable=False, **kwargs):
+        self.connection.round_trip()
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        self.connection.round_trip()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if self.confirming:
+            # Basic.Publish waits for the broker's Basic.Ack in confirm mode.
+            self.connection.round_trip()
+        self.published += 1
+
+
+class StandInConnection:
+
+    def __init__(self, round_trip_ms):
+        self.round_trip_ms = round_trip_ms
+        self.is_open = True
+        for _ in range(HANDSHAKE_ROUND_TRIPS):
+            self.round_trip()
+
+    def round_trip(self):
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+
+    def channel(self):
+        return StandInChannel(self)
+
+    def add_on_connection_blocked_callback(self, callback):
+        pass
+
+    def add_on_connection_unblocked_callback(self, callback):
+        pass
+
+    def close(self):
+        self.round_trip()
+        self.is_open = False
+
+
+def send_messages_per_call(queue_name, message):
+    """The original send_messages: one connection per message."""
+    connection = rmq_send_message.open_connection()
+    channel = connection.channel()
+    declare_queue(channel, queue_name)
+    channel.basic_publish(
+        exchange='',
+        routing_key=queue_name,
+        body=dict_to_json_string(message),
+        properties=pika.BasicProperties(delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE))
+    connection.close()
+
+
+def _rate(publish, messages):
+    started = time.perf_counter()
+    for i in range(messages):
+        publish('requests', {'appointment_id': i})
+    return messages / (time.perf_counter() - started)
+
+
+def add_arguments(parser):
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--round-trip-ms', type=float, default=0.5, help='Simulated broker round trip.')
+    parser.add_argument('--confirm', dest='confirm_delivery', action='store_true', help='Enable publisher confirms.')
+
+
+def run(messages=500, round_trip_ms=0.5, confirm_delivery=False, **options):
+    def connect():
+        return StandInConnection(round_trip_ms)
+
+    with mock.patch.object(rmq_send_message, 'open_connection', connect):
+        before = _rate(send_messages_per_call, messages)
+
+        publisher = Publisher(confirm_delivery=confirm_delivery)
+        after = _rate(lambda queue, message: publisher.publish(queue, dict_to_json_string(message)), messages)
+        publisher.close()
+
+    return [
+        ('per-call connection', before),
+        ('pooled publisher', after),
+        ('speedup', after / before),
+    ]
@@ -0,0 +1,107 @@
+"""
+Ranked lab search over 100k labs, against the LIKE scans it replaces.
+
+Labs, their cities and services are bulk loaded into a throwaway test database
+with signals bypassed, then every document is built with one rebuild. Searches
+pick words from the same vocabulary the labs were named from; the baseline is
+the old name/address contains filter, which scans the table for each search.
+Typo searches drop a letter from a word, prefix searches type its first four.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import setup_databases, teardown_databases
+
+from bhealthapp.models import City, Country, Lab, LabService, Service, Type
+from bhealthapp.search import refresh, search_labs
+
+SYLLABLES = ['ka', 'lo', 'me', 'di', 'ra', 'no', 'vi', 'ta', 'se', 'bo', 'ze', 'ni', 'ko', 'gra', 'dno', 'mar']
+# A few thousand made up words, so a word matches hundreds of labs like a real name or street would.
+WORDS = sorted({a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES})
+STREETS = ['Titova', 'Ferhadija', 'Maršala', 'Zmaja od Bosne', 'Obala', 'Bulevar', 'Mostarska', 'Tuzlanska']
+
+
+def add_arguments(parser):
+    parser.add_argument('--labs', type=int, default=100000)
+    parser.add_argument('--services-per-lab', type=int, default=3)
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs.')
+
+
+def run(labs, services_per_lab, searches, keepdb=False, **options):
+    old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+    try:
+        return _run(labs, services_per_lab, searches)
+    finally:
+        teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+
+def _timed(texts, search):
+    started = time.perf_counter()
+    for text in texts:
+        list(search(text))
+    return (time.perf_counter() - started) / len(texts) * 1000
+
+
+def _run(labs, services_per_lab, searches):
+    rng = random.Random(11)
+    country = Country.objects.create(name='Bosnia and Herzegovina')
+    cities = City.objects.bulk_create([City(name=f'Grad {i}', country=country, postal_code=71000 + i) for i in range(50)])
+    service_type = Type.objects.create(name='Laboratory')
+    services = Service.objects.bulk_create([
+        Service(name=f'{rng.choice(WORDS)} panel {i}', duration=timedelta(minutes=30), type=service_type) for i in range(200)
+    ])
+
+    # bulk_create skips the signals, like a data import would.
+    created = Lab.objects.bulk_create([
+        Lab(city=rng.choice(cities), name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}',
+            address=f'{rng.choice(STREETS)} {rng.randint(1, 200)}', email=f'lab{i}@example.com',
+            description=' '.join(rng.choice(WORDS) for _ in range(12)))
+        for i in range(labs)
+    ], batch_size=5000)
+    LabService.objects.bulk_create([
+        LabService(lab_service=lab, service=service)
+        for lab in created for service in rng.sample(services, services_per_lab)
+    ], batch_size=10000)
+
+    started = time.perf_counter()
+    refresh()
+    rebuild_seconds = time.perf_counter() - started
+    with connection.cursor() as cursor:
+        # Also merges the GIN pending list the bulk update left behind, as autovacuum would.
+        cursor.execute('VACUUM ANALYZE bhealthapp_lab')
+
+    texts = [rng.choice(WORDS) if i % 2 else f'{rng.choice(WORDS)} {rng.choice(WORDS)}' for i in range(searches)]
+    ranked_ms = _timed(texts, lambda text: search_labs(text)[:12])
+    like_ms = _timed(texts[:max(searches // 10, 1)], lambda text: Lab.objects.filter(
+        Q(name__contains=text) | Q(address__contains=text)).order_by('id')[:12])
+    miss_ms = _timed(['xyz'] * 10, lambda text: search_labs(text)[:12])
+    typo_ms = _timed([word[:2] + word[3:] for word in texts], lambda text: search_labs(text)[:12])
+    prefix_ms = _timed([word[:4] for word in texts], lambda text: search_labs(text)[:12])
+
+    lab = created[rng.randrange(labs)]
+    started = time.perf_counter()
+    for i in range(50):
+        lab.name = f'{rng.choice(WORDS).title()} {i}'
+        lab.save(update_fields=['name'])
+    save_ms = (time.perf_counter() - started) / 50 * 1000
+
+    with connection.cursor() as cursor:
+        sql, params = search_labs(WORDS[0])[:12].query.sql_with_params()
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+    return [
+        ('labs', labs),
+        ('document rebuild s', rebuild_seconds),
+        ('ranked search ms', ranked_ms),
+        ('ranked search, no match ms', miss_ms),
+        ('typo search ms', typo_ms),
+        ('prefix search ms', prefix_ms),
+        ('LIKE contains ms', like_ms),
+        ('lab save with document ms', save_ms),
+        ('search uses lab_search_idx', float('lab_search_idx' in plan)),
+    ]
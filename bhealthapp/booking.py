@@ -0,0 +1,71 @@
+"""
+Booking appointments without double-booking a lab.
+
+Every booking runs in one transaction holding a Postgres advisory lock keyed by
+lab and day for each day it covers, so bookings that could overlap, also across
+midnight, are serialised while other labs and days book in parallel. Under the
+locks the lab's non-canceled appointments are checked for one overlapping the new
+one, which then either commits together with its outbox event or is refused with
+SlotTaken.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import Greatest
+
+from bhealthapp.availability import as_datetime, occupied_seconds, slot_step
+from bhealthapp.models import Appointment
+from bhealthapp.occupancy import day_of
+from bhealthapp.outbox import record_event
+
+
+class SlotTaken(Exception):
+    pass
+
+
+def lock_lab_day(lab_id, day):
+    """Block until no other transaction books the lab on day, released when the transaction ends."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [lab_id, day.toordinal()])
+
+
+def lock_lab_days(lab_id, start, duration: timedelta):
+    """Lock every day from the one start falls on through the one the booking ends on."""
+    # Overlapping bookings share an instant, so they share the lock of its day. Taking the
+    # locks in ascending order keeps two bookings waiting on each other from deadlocking.
+    day, last = day_of(start), day_of(start + timedelta(seconds=occupied_seconds(duration)))
+    while day <= last:
+        lock_lab_day(lab_id, day)
+        day += timedelta(days=1)
+
+
+def overlapping(lab_id, start, duration: timedelta):
+    end = start + timedelta(seconds=occupied_seconds(duration))
+    # Durations below one slot take a whole slot, as in availability.
+    ends = ExpressionWrapper(
+        F('date') + Greatest(F('service_appointment__duration'), Value(timedelta(seconds=slot_step()))),
+        output_field=DateTimeField())
+    return Appointment.objects.filter(
+        lab_appointment_id=lab_id, date__lt=end, date__gte=start - timedelta(days=1)
+    ).exclude(status=Appointment.STATUS_CANCELED).alias(ends=ends).filter(ends__gt=start)
+
+
+def book_appointment(lab, service, patient, date) -> Appointment:
+    """Create a pending appointment and its appointment.created event, raises SlotTaken if it overlaps another."""
+    date = as_datetime(date)
+    with transaction.atomic():
+        if date is not None:
+            lock_lab_days(lab.id, date, service.duration)
+            if overlapping(lab.id, date, service.duration).exists():
+                raise SlotTaken(f'Lab {lab.id} is booked at {date.isoformat()}')
+
+        appointment = Appointment.objects.create(
+            lab_appointment=lab,
+            service_appointment=service,
+            patient=patient,
+            date=date,
+            status=Appointment.STATUS_PENDING
+        )
+        record_event('appointment.created', {'appointment_id': appointment.id})
+    return appointment
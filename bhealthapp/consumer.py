@@ -1,144 +1,347 @@
-import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 
-import pika
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.db import close_old_connections, transaction, DatabaseError
+from pika.exceptions import ChannelClosed
 
-from bhealthapp.models import Appointment, Notification, Lab
-from rmq_send_message import json_string_to_dict
+from bhealthapp import metrics
+from bhealthapp.dedupe import DedupeStore, DuplicateMessage
+from bhealthapp.envelope import decode
+from bhealthapp.models import Appointment, Notification
+from bhealthapp.rmq_send_message import open_connection
+from bhealthapp.rmq_topology import declare_queue, next_retry_queue, parking_queue, with_attempts, attempts
+
+logger = logging.getLogger(__name__)
+
+# Notification written for each queue: (message, is_confirmed).
+NOTIFICATION_TEMPLATES = {
+    'results': ('Result added for appointment {appointment_id}', True),
+    'requests': ('New request for appointment with id {appointment_id} has been made.', False),
+    'appointment_updates': ('Appointment request updated, please confirm or decline: {appointment}', False),
+    'appointment': ('New appointment has been confirmed.', False),
+    'appointment_canceled': ('Your appointment has been canceled.', False),
+}
+
+
+def build_notification(queue, appointment):
+    message, is_confirmed = NOTIFICATION_TEMPLATES[queue]
+    return Notification(
+        notification_appointment=appointment,
+        message=message.format(appointment=appointment, appointment_id=appointment.pk),
+        is_confirmed=is_confirmed,
+        notification_date=datetime.now()
+    )
+
+
+class MalformedMessage(ValueError):
+    pass
+
+
+def parse_message(body):
+    """Return the envelope and the appointment id of a delivery."""
+    try:
+        message = decode(body)
+        return message, int(message.payload['appointment_id'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise MalformedMessage(f'Malformed message {body!r}') from e
+
+
+class ThreadSafeChannel:
+    """
+    Channel handed to handlers running on a worker thread. pika channels are not
+    thread-safe, so acks and nacks are scheduled onto the connection's thread.
+    """
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.connection.add_callback_threadsafe(
+            partial(self.channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.connection.add_callback_threadsafe(
+            partial(self.channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.connection.add_callback_threadsafe(
+            partial(self.channel.basic_publish, exchange=exchange, routing_key=routing_key, body=body,
+                    properties=properties))
 
 
 class Consumer:
+    QUEUES = tuple(NOTIFICATION_TEMPLATES)
+
+    def __init__(self, queues=None, prefetch_count=None, concurrency=None, queue_concurrency=None, batch_size=None,
+                 batch_timeout_ms=None):
+        self.queues = list(queues or self.QUEUES)
+        self.prefetch_count = settings.CONSUMER_PREFETCH_COUNT if prefetch_count is None else prefetch_count
+        self.concurrency = settings.CONSUMER_CONCURRENCY if concurrency is None else concurrency
+        self.queue_concurrency = {**settings.CONSUMER_QUEUE_CONCURRENCY, **(queue_concurrency or {})}
+        self.batch_size = settings.CONSUMER_BATCH_SIZE if batch_size is None else batch_size
+        self.batch_timeout = (settings.CONSUMER_BATCH_TIMEOUT_MS if batch_timeout_ms is None else batch_timeout_ms) / 1000
+        self.batches = {}
+        self.batch_timers = {}
+        self.executors = {}
+        self.channels = {}
+        self.consumer_tags = {}
+        # Deliveries acked, duplicates included, and the ones retried, parked or lost to an unhandled error.
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self._processed_lock = threading.Lock()
+        self.dedupe = DedupeStore()
+        self.depth_interval = settings.CONSUMER_DEPTH_POLL_SECONDS
+        self.depth_channel = None
+        self._consuming = False
+
+        self.connection = open_connection()
+        for queue in self.queues:
+            self.channels[queue] = self._consume(queue)
+        if self.depth_interval:
+            self.connection.call_later(self.depth_interval, self._poll_depth)
+
+    def _consume(self, queue):
+        # One channel per queue so prefetch and acks of one queue never interfere with another.
+        channel = self.connection.channel()
+        declare_queue(channel, queue)
+        workers = self.queue_concurrency.get(queue, self.concurrency)
+
+        if self.batch_size > 1:
+            # Batches are written by a single thread so they are acked in delivery order,
+            # which basic_ack(multiple=True) relies on.
+            self.executors[queue] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'consumer-{queue}')
+            self.batches[queue] = []
+            handler = partial(self._collect, queue)
+            workers = self.batch_size
+        elif workers:
+            self.executors[queue] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'consumer-{queue}')
+            handler = partial(self._submit, queue)
+        else:
+            handler = partial(self._run, queue)
+
+        channel.basic_qos(prefetch_count=max(self.prefetch_count, workers))
+        self.consumer_tags[queue] = channel.basic_consume(queue=queue, on_message_callback=handler)
+
+        return channel
 
-    def __init__(self):
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
-        self.channel = self.connection.channel()
-        self.channel.basic_consume(queue='results', on_message_callback=self.result_added)
-        self.channel.basic_consume(queue='requests', on_message_callback=self.process_request)
-        self.channel.basic_consume(queue='appointment_updates', on_message_callback=self.process_appointment)
-        self.channel.basic_consume(queue='appointment', on_message_callback=self.notification_confirmed)
-        self.channel.basic_consume(queue='appointment_canceled', on_message_callback=self.cancel_appointment)
+    def _submit(self, queue, channel, method, properties, body):
+        self.executors[queue].submit(
+            self._run, queue, ThreadSafeChannel(self.connection, channel), method, properties, body)
 
-    def result_added(self, channel, method, properties, body):
+    def _run(self, queue, channel, method, properties, body):
+        close_old_connections()
+        metrics.count(queue, 'consumed')
         try:
-            appointment_id = json_string_to_dict(body).get('appointment_id')
-            appointment = Appointment.objects.get(id=appointment_id)
-
-            notification_message = f'Result added for appointment {appointment_id}'
-
-            Notification.objects.create(
-                notification_appointment=appointment,
-                message=notification_message,
-                is_confirmed=True,
-                notification_date=datetime.now()
-            )
-        except Appointment.DoesNotExist:
-
-            notification_message = f'Result added for non-existent appointment with ID {appointment_id}'
-
-            Notification.objects.create(
-                message=notification_message,
-                is_confirmed=True,
-                notification_date=datetime.now()
-            )
+            with metrics.timed_handler(queue):
+                self.process_message(queue, channel, method, properties, body)
+        except Exception:
+            logger.exception('Unhandled error in %s for delivery %s', queue, method.delivery_tag)
+            self._tally(failed=1)
         finally:
+            close_old_connections()
 
+    def process_message(self, queue, channel, method, properties, body):
+        try:
+            message, appointment_id = parse_message(body)
+            if self.dedupe.seen(queue, message.message_id):
+                raise DuplicateMessage(message.message_id)
+
+            with transaction.atomic():
+                self.dedupe.claim(queue, message.message_id)
+                appointment = Appointment.objects.get(pk=appointment_id)
+                build_notification(queue, appointment).save()
+            self.dedupe.remember(queue, [message.message_id])
+        except DuplicateMessage:
+            self._count_duplicates(queue, 1)
             channel.basic_ack(delivery_tag=method.delivery_tag)
+            self._tally(processed=1)
+        except MalformedMessage as e:
+            logger.error('%s: %s', queue, e)
+            self.reject(channel, queue, method, properties, body, retry=False)
+            self._tally(failed=1)
+        except Exception:
+            logger.exception('Could not process delivery %s from %s', method.delivery_tag, queue)
+            self.reject(channel, queue, method, properties, body)
+            self._tally(failed=1)
+        else:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            metrics.count(queue, 'acked')
+            metrics.observe_latency(queue, message.produced_at)
+            self._tally(processed=1)
 
-    def process_request(self, channel, method, properties, body):
-        try:
+    def reject(self, channel, queue, method, properties, body, retry=True):
+        """
+        Send a failed message to its next retry tier, or park it once it is out of
+        attempts or can never succeed.
+        """
+        target = next_retry_queue(queue, properties) if retry else None
 
-            appointment_id = json_string_to_dict(body).get('appointment_id')
-            appointment = Appointment.objects.get(pk=appointment_id)
+        if target is None:
+            # Dead-letters into the parking queue through the queue's x-dead-letter-exchange.
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            metrics.count(queue, 'dead_lettered')
+        else:
+            channel.basic_publish(
+                exchange='', routing_key=target, body=body, properties=with_attempts(properties, attempts(properties) + 1))
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            metrics.count(queue, 'retried')
 
-            notification_message = f'New request for appointment with id {appointment_id} has been made.'
-            Notification.objects.create(
-                notification_appointment=appointment,
-                message=notification_message,
-                is_confirmed=False,
-                notification_date=datetime.now()
-            )
+    def _collect(self, queue, channel, method, properties, body):
+        batch = self.batches[queue]
+        batch.append((method, properties, body))
 
-        except (KeyError, json.decoder.JSONDecodeError, ValueError) as e:
-            error_message = str(e)
-            Notification.objects.create(message=error_message)
-            channel.basic_nack(delivery_tag=method.delivery_tag)
+        if len(batch) >= self.batch_size:
+            self._flush(queue)
+        elif len(batch) == 1:
+            self.batch_timers[queue] = self.connection.call_later(self.batch_timeout, partial(self._flush, queue))
 
-        except Exception as e:
-            error_message = f"An error occurred while processing the request: {str(e)}"
-            Notification.objects.create(message=error_message, notification_date=datetime.now())
-            channel.basic_nack(delivery_tag=method.delivery_tag)
+    def _flush(self, queue):
+        timer = self.batch_timers.pop(queue, None)
+        if timer is not None:
+            self.connection.remove_timeout(timer)
 
-        else:
-            channel.basic_ack(delivery_tag=method.delivery_tag)
+        deliveries, self.batches[queue] = self.batches[queue], []
+        if deliveries:
+            self.executors[queue].submit(
+                self._run_batch, queue, ThreadSafeChannel(self.connection, self.channels[queue]), deliveries)
 
-    def process_appointment(self, channel, method, properties, body):
+    def _run_batch(self, queue, channel, deliveries):
+        close_old_connections()
+        metrics.count(queue, 'consumed', len(deliveries))
         try:
-            appointment_id = json_string_to_dict(body).get('appointment_id')
-            appointment = Appointment.objects.get(pk=appointment_id)
-            notification_message = f'Appointment request updated, please confirm or decline: {appointment}'
-            Notification.objects.create(
-                notification_appointment=appointment,
-                message=notification_message,
-                is_confirmed=False,
-                notification_date=datetime.now()
-            )
-        except (Appointment.DoesNotExist, KeyError, TypeError) as e:
-            print(f"Appointment with id {appointment_id} does not exist.")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-        except Exception as e:
-            print(f"Unknown error processing appointment: {e}")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            with metrics.timed_handler(queue, len(deliveries)):
+                self.process_batch(queue, channel, deliveries)
+        except Exception:
+            logger.exception('Unhandled error in batch of %s messages from %s', len(deliveries), queue)
+            self._tally(failed=len(deliveries))
         finally:
-            channel.basic_ack(delivery_tag=method.delivery_tag)
+            close_old_connections()
+
+    def process_batch(self, queue, channel, deliveries):
+        """
+        Write the notifications for a batch of deliveries with one appointment query and
+        one insert, then ack all of them at once. Messages that fail are retried or parked
+        on their own so they do not hold back the rest of the batch.
+        """
+        failed = []
+        duplicates = []
+        parsed = []
+        batch_ids = set()
+        for delivery in deliveries:
+            try:
+                message, appointment_id = parse_message(delivery[2])
+            except MalformedMessage as e:
+                logger.error('%s: %s', queue, e)
+                failed.append((delivery, False))
+                continue
+
+            if self.dedupe.seen(queue, message.message_id) or message.message_id in batch_ids:
+                duplicates.append(delivery)
+            else:
+                if message.message_id is not None:
+                    batch_ids.add(message.message_id)
+                parsed.append((delivery, message, appointment_id))
+
+        already_processed = self.dedupe.processed(queue, batch_ids)
+        duplicates += [delivery for delivery, message, _ in parsed if message.message_id in already_processed]
+        parsed = [item for item in parsed if item[1].message_id not in already_processed]
+
+        appointments = Appointment.objects.in_bulk({appointment_id for _, _, appointment_id in parsed})
+
+        pending = []
+        for delivery, message, appointment_id in parsed:
+            appointment = appointments.get(appointment_id)
+            if appointment is None:
+                logger.error('Appointment with id %s does not exist.', appointment_id)
+                failed.append((delivery, True))
+            else:
+                pending.append((delivery, message, build_notification(queue, appointment)))
 
-    def notification_confirmed(self, ch, method, properties, body):
         try:
+            with transaction.atomic():
+                self.dedupe.claim_all(queue, [message.message_id for _, message, _ in pending])
+                Notification.objects.bulk_create([notification for _, _, notification in pending])
+        except DatabaseError:
+            logger.exception('Bulk insert of %s notifications failed, inserting one by one', len(pending))
+            pending, retried = [], pending
+            for delivery, message, notification in retried:
+                try:
+                    with transaction.atomic():
+                        self.dedupe.claim(queue, message.message_id)
+                        notification.save()
+                except DuplicateMessage:
+                    duplicates.append(delivery)
+                except DatabaseError:
+                    logger.exception('Could not save notification for delivery %s', delivery[0].delivery_tag)
+                    failed.append((delivery, True))
+                else:
+                    pending.append((delivery, message, notification))
 
-            appointment_id = json_string_to_dict(body).get('appointment_id')
-            appointment = Appointment.objects.get(id=appointment_id)
-
-            Notification.objects.create(
-                notification_appointment=appointment,
-                message='New appointment has been confirmed.',
-                notification_date=datetime.now()
-            )
-        except Appointment.DoesNotExist:
-            print("Error: The appointment does not exist")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-        except Lab.DoesNotExist:
-            print("Error: The lab does not exist")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-        except Exception as e:
-            print("Error: ", str(e))
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-        finally:
-            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+        self.dedupe.remember(queue, [message.message_id for _, message, _ in pending])
+        self._count_duplicates(queue, len(duplicates))
+
+        for (method, properties, body), retry in failed:
+            self.reject(channel, queue, method, properties, body, retry=retry)
+
+        # Failed deliveries were settled first, so this only acks the successful ones and the duplicates.
+        settled = [delivery for delivery, _, _ in pending] + duplicates
+        if settled:
+            channel.basic_ack(delivery_tag=max(delivery[0].delivery_tag for delivery in settled), multiple=True)
+
+        metrics.count(queue, 'acked', len(pending))
+        for _, message, _ in pending:
+            metrics.observe_latency(queue, message.produced_at)
+        self._tally(processed=len(settled), failed=len(failed))
+
+    def _tally(self, processed=0, failed=0):
+        with self._processed_lock:
+            self.processed += processed
+            self.failed += failed
+
+    def _count_duplicates(self, queue, count):
+        metrics.count(queue, 'duplicate', count)
+        if count:
+            with self._processed_lock:
+                self.duplicates += count
 
-    def cancel_appointment(self, ch, method, properties, body):
+    def _poll_depth(self):
+        # Runs on the connection thread, the only one allowed to use its channels.
         try:
-            appointment_id = json_string_to_dict(body).get('appointment_id')
-            appointment = Appointment.objects.get(id=appointment_id)
-
-            notification = Notification.objects.create(
-                notification_appointment=appointment,
-                message='Your appointment has been canceled.',
-                notification_date=datetime.now())
-            notification.save()
-
-        except ObjectDoesNotExist as e:
-            print(f"Appointment with id {appointment_id} does not exist.")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-        except ValueError as e:
-            print(f"Invalid appointment id {body}.")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-        except Exception as e:
-            print(f"An error occurred while canceling appointment: {str(e)}")
-            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-        finally:
-            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+            if self.depth_channel is None or not self.depth_channel.is_open:
+                self.depth_channel = self.connection.channel()
+            for queue in self.queues:
+                for name in (queue, parking_queue(queue)):
+                    declared = self.depth_channel.queue_declare(queue=name, durable=True, passive=True)
+                    metrics.QUEUE_DEPTH.labels(name).set(declared.method.message_count)
+        except ChannelClosed as e:
+            logger.warning('Could not read queue depth: %s', e)
+
+        if self._consuming:
+            self.connection.call_later(self.depth_interval, self._poll_depth)
 
     def start(self):
-        self.channel.start_consuming()
+        self._consuming = True
+        while self._consuming:
+            self.connection.process_data_events(time_limit=1)
+        self._shutdown()
+
+    def stop(self):
+        self._consuming = False
+
+    def _shutdown(self):
+        for queue, channel in self.channels.items():
+            channel.basic_cancel(self.consumer_tags[queue])
+        for queue in self.batches:
+            self._flush(queue)
+
+        # Let the workers finish what was already delivered, then flush their acks before closing.
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        self.connection.process_data_events(time_limit=0)
+        self.connection.close()
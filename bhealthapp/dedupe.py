@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from bhealthapp.models import ProcessedMessage
+
+
+class DuplicateMessage(Exception):
+    pass
+
+
+class RecentIds:
+    """Thread-safe LRU set."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._ids:
+                self._ids.move_to_end(key)
+                return True
+            return False
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, key):
+        with self._lock:
+            self._ids[key] = None
+            self._ids.move_to_end(key)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+
+class DedupeStore:
+    """
+    Tells a consumer whether it has handled a message before. Ids seen recently are
+    answered from memory; everything else is settled by the ProcessedMessage unique
+    constraint, so claims belong in the same transaction as the handler's writes.
+    Messages without an id, published before envelopes, are never deduplicated.
+    """
+
+    def __init__(self, cache_size=None):
+        self.recent = RecentIds(settings.CONSUMER_DEDUPE_CACHE_SIZE if cache_size is None else cache_size)
+
+    def seen(self, queue, message_id) -> bool:
+        return message_id is not None and (queue, message_id) in self.recent
+
+    def remember(self, queue, message_ids):
+        for message_id in message_ids:
+            if message_id is not None:
+                self.recent.add((queue, message_id))
+
+    def processed(self, queue, message_ids) -> set:
+        """Of message_ids, the ones another delivery already committed."""
+        message_ids = {message_id for message_id in message_ids if message_id is not None}
+        if not message_ids:
+            return set()
+        found = set(ProcessedMessage.objects.filter(queue=queue, message_id__in=message_ids)
+                    .values_list('message_id', flat=True))
+        self.remember(queue, found)
+        return found
+
+    def claim(self, queue, message_id):
+        """Record message_id as handled, raising DuplicateMessage if it already was."""
+        if message_id is None:
+            return
+        try:
+            ProcessedMessage.objects.create(queue=queue, message_id=message_id)
+        except IntegrityError as e:
+            self.remember(queue, [message_id])
+            raise DuplicateMessage(message_id) from e
+
+    def claim_all(self, queue, message_ids):
+        """Bulk claim, raises IntegrityError if any of them was already handled."""
+        ProcessedMessage.objects.bulk_create(
+            [ProcessedMessage(queue=queue, message_id=message_id) for message_id in message_ids if message_id is not None])
+
+
+def prune_processed_messages(retention_hours=None, chunk_size=None) -> int:
+    """Delete dedupe rows past the retention window a chunk at a time, so no delete holds long locks."""
+    retention_hours = settings.CONSUMER_DEDUPE_RETENTION_HOURS if retention_hours is None else retention_hours
+    chunk_size = chunk_size or settings.CONSUMER_DEDUPE_PRUNE_CHUNK
+    cutoff = timezone.now() - timedelta(hours=retention_hours)
+
+    deleted = 0
+    while True:
+        ids = list(ProcessedMessage.objects.filter(processed_at__lt=cutoff).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += ProcessedMessage.objects.filter(pk__in=ids).delete()[0]
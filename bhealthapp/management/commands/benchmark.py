@@ -0,0 +1,29 @@
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+
+BENCHMARKS = {
+    'autocomplete': 'bhealthapp.benchmarks.autocomplete',
+    'availability': 'bhealthapp.benchmarks.availability',
+    'booking': 'bhealthapp.benchmarks.booking',
+    'codec': 'bhealthapp.benchmarks.codec',
+    'messaging': 'bhealthapp.benchmarks.messaging',
+    'publisher': 'bhealthapp.benchmarks.publisher',
+    'search': 'bhealthapp.benchmarks.search',
+}
+
+
+class Command(BaseCommand):
+    help = "Run one of the bhealthapp benchmarks"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for name, module in BENCHMARKS.items():
+            benchmark = import_module(module)
+            benchmark.add_arguments(subparsers.add_parser(name, help=benchmark.__doc__.strip().splitlines()[0]))
+
+    def handle(self, benchmark, **options):
+        results = import_module(BENCHMARKS[benchmark]).run(**options)
+
+        for label, value in results:
+            self.stdout.write(f'{label:<40} {value:>14.2f}')
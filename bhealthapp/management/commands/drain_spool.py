@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from bhealthapp.rmq_send_message import Publisher
+from bhealthapp.spool import get_spool
+
+
+class Command(BaseCommand):
+    help = "Publish the messages spooled while the broker was unreachable, in the order they were spooled"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help='Only show how much is spooled and how old it is.')
+
+    def handle(self, **options):
+        spool = get_spool()
+        if not options['stats']:
+            publisher = Publisher(confirm_delivery=True)
+            try:
+                self.stdout.write(f'Drained {spool.drain(publisher)} messages')
+            finally:
+                publisher.close()
+
+        stats = spool.stats()
+        self.stdout.write(f"Spooled: {stats['segments']} segments, {stats['bytes']} bytes, "
+                          f"oldest {stats['oldest_age_seconds']:.1f}s")
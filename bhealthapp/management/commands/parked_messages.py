@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bhealthapp.consumer import Consumer
+from bhealthapp.rmq_send_message import open_connection
+from bhealthapp.rmq_topology import declare_queue, parking_queue, with_attempts
+
+
+class Command(BaseCommand):
+    help = "List the messages parked after exhausting their retries, or replay them onto their queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'replay'])
+        parser.add_argument('--queues', default='', help='Comma separated queues, defaults to all.')
+        parser.add_argument('--limit', type=int, default=100, help='Messages per queue to list or replay.')
+
+    def handle(self, action, **options):
+        queues = [queue for queue in options['queues'].split(',') if queue] or list(Consumer.QUEUES)
+        unknown = set(queues) - set(Consumer.QUEUES)
+        if unknown:
+            raise CommandError(f'Unknown queues: {", ".join(sorted(unknown))}')
+
+        connection = open_connection()
+        try:
+            for queue in queues:
+                channel = connection.channel()
+                declare_queue(channel, queue)
+                if action == 'list':
+                    self.list_parked(channel, queue, options['limit'])
+                else:
+                    self.replay_parked(channel, queue, options['limit'])
+                # Closing the channel returns every message that was only listed to the parking queue.
+                channel.close()
+        finally:
+            connection.close()
+
+    def list_parked(self, channel, queue, limit):
+        depth = channel.queue_declare(queue=parking_queue(queue), durable=True, passive=True).method.message_count
+        self.stdout.write(f'{parking_queue(queue)}: {depth} parked')
+
+        for _ in range(min(limit, depth)):
+            method, properties, body = channel.basic_get(queue=parking_queue(queue))
+            if method is None:
+                break
+            deaths = (properties.headers or {}).get('x-death') or [{}]
+            self.stdout.write(f"  attempts={(properties.headers or {}).get('x-attempts', 0)} "
+                              f"reason={deaths[0].get('reason', '-')} body={body!r}")
+
+    def replay_parked(self, channel, queue, limit):
+        channel.confirm_delivery()
+        replayed = 0
+        last_tag = None
+
+        while replayed < limit:
+            method, properties, body = channel.basic_get(queue=parking_queue(queue))
+            if method is None:
+                break
+            # Replayed messages get a fresh set of retries.
+            channel.basic_publish(exchange='', routing_key=queue, body=body, properties=with_attempts(properties, 0))
+            last_tag = method.delivery_tag
+            replayed += 1
+
+        if last_tag is not None:
+            # Every publish above was confirmed by the broker, so the parked copies can go.
+            channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+        self.stdout.write(f'{queue}: replayed {replayed} parked messages')
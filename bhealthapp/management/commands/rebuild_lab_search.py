@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bhealthapp.search import refresh
+
+
+class Command(BaseCommand):
+    help = "Recompute the search documents of the labs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--labs', default='', help='Comma separated lab ids, defaults to all.')
+
+    def handle(self, **options):
+        lab_ids = [int(lab_id) for lab_id in options['labs'].split(',') if lab_id] or None
+        labs = refresh(lab_ids)
+        self.stdout.write(f'Rebuilt the search documents of {labs} labs')
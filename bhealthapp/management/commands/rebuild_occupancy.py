@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from bhealthapp.occupancy import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the lab-day occupancy bitmaps from the appointments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild, defaults to today.')
+        parser.add_argument('--days', type=int, default=90, help='Number of days to rebuild.')
+        parser.add_argument('--labs', default='', help='Comma separated lab ids, defaults to all.')
+
+    def handle(self, **options):
+        try:
+            start = parse_date(options['since']) if options['since'] else timezone.localdate()
+        except ValueError:
+            start = None
+        if start is None:
+            raise CommandError(f"Not a date: {options['since']}")
+
+        lab_ids = [int(lab_id) for lab_id in options['labs'].split(',') if lab_id] or None
+        end = start + timedelta(days=options['days'] - 1)
+        rows = rebuild(start, end, lab_ids)
+        self.stdout.write(f'Rebuilt {rows} lab-days from {start} to {end}')
@@ -0,0 +1,56 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bhealthapp import metrics
+from bhealthapp.outbox import relay_batch
+from bhealthapp.rmq_send_message import RECONNECT_ERRORS, Publisher
+from bhealthapp.spool import get_spool
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Publish committed outbox events and drain the local spool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=0.5, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit.')
+        parser.add_argument('--metrics-port', type=int, default=settings.PUBLISHER_METRICS_PORT,
+                            help='Expose spool and throttling metrics on this port.')
+
+    def handle(self, **options):
+        self._running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if options['metrics_port']:
+            metrics.serve(options['metrics_port'])
+
+        # Confirms make sure the broker has every message before its row is deleted.
+        publisher = Publisher(confirm_delivery=True)
+        relayed = 0
+        try:
+            while self._running:
+                try:
+                    relayed += get_spool().drain(publisher)
+                    count = relay_batch(publisher, options['batch_size'])
+                except RECONNECT_ERRORS as e:
+                    # Everything unsent stays in the spool or the outbox, try again later.
+                    logger.warning('Broker unavailable: %s', e)
+                    count = 0
+                relayed += count
+                if count < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        finally:
+            publisher.close()
+
+        self.stdout.write(f'Relayed {relayed} events')
+
+    def stop(self, signum=None, frame=None):
+        self._running = False
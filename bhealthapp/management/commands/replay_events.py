@@ -0,0 +1,62 @@
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from bhealthapp.replay import REPLAYABLE_EVENTS, Checkpoint, replay_events
+from bhealthapp.rmq_send_message import Publisher
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, datetime.min.time())
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = "Publish an event again for every matching appointment, resuming from the last checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', required=True, choices=sorted(REPLAYABLE_EVENTS), dest='event_type')
+        parser.add_argument('--since', help='Only appointments dated on or after this date or datetime.')
+        parser.add_argument('--until', help='Only appointments dated before this date or datetime.')
+        parser.add_argument('--rate', type=float, default=500, help='Messages per second, 0 for no limit.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Appointments fetched and checkpointed at once.')
+        parser.add_argument('--checkpoint', help='Checkpoint file, defaults to one per event type in SPOOL_DIR.')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and replay from the start.')
+
+    def handle(self, event_type, **options):
+        try:
+            since = parse_moment(options['since']) if options['since'] else None
+            until = parse_moment(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(f'Not a date: {e}')
+
+        path = options['checkpoint'] or os.path.join(settings.SPOOL_DIR, f'replay-{event_type}.json')
+        selection = {'type': event_type, 'since': options['since'], 'until': options['until']}
+        checkpoint = Checkpoint(path, selection)
+        if options['restart']:
+            checkpoint.remove()
+        try:
+            if checkpoint.load():
+                self.stdout.write(f'Resuming after appointment {checkpoint.last_id}, {checkpoint.replayed} already replayed')
+        except ValueError as e:
+            raise CommandError(f'{e}, pass --restart or another --checkpoint')
+
+        publisher = Publisher(confirm_delivery=True)
+        try:
+            published = replay_events(publisher, event_type, checkpoint, since=since, until=until, rate=options['rate'],
+                                      chunk_size=options['chunk_size'])
+        finally:
+            publisher.close()
+
+        # Finished, the next replay of this event type starts over.
+        checkpoint.remove()
+        self.stdout.write(f'Replayed {published} {event_type} events')
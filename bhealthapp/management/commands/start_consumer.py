@@ -1,11 +1,58 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from bhealthapp.consumer import Consumer
+from bhealthapp.supervisor import ConsumerSupervisor, run_consumer
+
+
+def parse_queue_concurrency(value):
+    try:
+        return {queue: int(workers) for queue, workers in (item.split('=') for item in value.split(',') if item)}
+    except ValueError:
+        raise CommandError(f'Invalid --queue-concurrency "{value}", expected e.g. results=4,requests=2')
+
+
+def parse_queues(value):
+    queues = [queue for queue in value.split(',') if queue]
+    unknown = set(queues) - set(Consumer.QUEUES)
+    if unknown:
+        raise CommandError(f'Unknown queues: {", ".join(sorted(unknown))}')
+    return queues or None
 
 
 class Command(BaseCommand):
     help = "Start the consumer"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Supervised consumer processes to fork.')
+        parser.add_argument('--queues', default='', help='Comma separated queues to consume, defaults to all.')
+        parser.add_argument('--prefetch', type=int, default=None, help='Unacked messages the broker may push per queue.')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Worker threads per queue, 0 handles messages inline on the connection thread.')
+        parser.add_argument('--queue-concurrency', default='', help='Per-queue worker threads, e.g. results=4,requests=2.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Write notifications in batches of up to this many messages.')
+        parser.add_argument('--batch-timeout-ms', type=int, default=None,
+                            help='Flush a partial batch after this many milliseconds.')
+
     def handle(self, **options):
-        apt_consumer = Consumer()
-        apt_consumer.start()
+        consumer_options = {
+            'queues': parse_queues(options['queues']),
+            'prefetch_count': options['prefetch'],
+            'concurrency': options['concurrency'],
+            'queue_concurrency': parse_queue_concurrency(options['queue_concurrency']),
+            'batch_size': options['batch_size'],
+            'batch_timeout_ms': options['batch_timeout_ms'],
+        }
+
+        if options['processes'] > 1:
+            supervisor = ConsumerSupervisor(options['processes'], consumer_options)
+            reports = supervisor.run()
+            if supervisor.restarts:
+                self.stdout.write(f'Restarted crashed consumers {supervisor.restarts} times')
+        else:
+            reports = [run_consumer(consumer_options)]
 
+        for report in reports:
+            rate = report['processed'] / report['seconds'] if report['seconds'] else 0.0
+            self.stdout.write(
+                f"consumer-{report['index']} pid={report['pid']} processed={report['processed']} "
+                f"failed={report['failed']} in {report['seconds']:.1f}s ({rate:.1f} msg/s)")
@@ -0,0 +1,441 @@
+"""
+In-process stand-in for RabbitMQ, selected with RABBITMQ_TRANSPORT = 'memory'.
+
+It implements the part of pika's BlockingConnection and BlockingChannel API this
+app uses, with the broker semantics the consumer relies on: direct, topic and
+fanout exchanges, per-consumer prefetch, ack and nack with multiple, requeue on
+nack and on channel close, dead-lettering with x-death headers, per-queue
+message TTL and connection.blocked notifications. Deliveries and timers run inside process_data_events on the thread
+that owns the connection, exactly like pika, so consumers run unchanged.
+"""
+import copy
+import heapq
+import itertools
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+
+import pika
+from pika.exceptions import ChannelClosedByBroker, ChannelWrongStateError, ConnectionWrongStateError
+
+from bhealthapp.rmq_topology import topic_matches
+
+
+class Message:
+    __slots__ = ('exchange', 'routing_key', 'body', 'properties', 'redelivered', 'expires_at')
+
+    def __init__(self, exchange, routing_key, body, properties, expires_at=None):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.redelivered = False
+        self.expires_at = expires_at
+
+
+class MemoryQueue:
+
+    def __init__(self, name, arguments):
+        self.name = name
+        self.arguments = dict(arguments or {})
+        self.messages = deque()
+        self.consumers = 0
+
+    @property
+    def ttl(self):
+        ttl = self.arguments.get('x-message-ttl')
+        return ttl / 1000 if ttl is not None else None
+
+
+class MemoryBroker:
+
+    def __init__(self):
+        self.changed = threading.Condition(threading.RLock())
+        self.exchanges = {'': ('direct', [])}
+        self.queues = {}
+        self.connections = weakref.WeakSet()
+
+    def block(self, reason='low on memory'):
+        """Tell every connection the broker stopped accepting publishes, like a RabbitMQ resource alarm."""
+        for connection in list(self.connections):
+            connection.notify(pika.spec.Connection.Blocked(reason), connection.blocked_callbacks)
+
+    def unblock(self):
+        for connection in list(self.connections):
+            connection.notify(pika.spec.Connection.Unblocked(), connection.unblocked_callbacks)
+
+    def declare_exchange(self, name, exchange_type):
+        with self.changed:
+            self.exchanges.setdefault(name, (exchange_type, []))
+
+    def declare_queue(self, name, arguments):
+        with self.changed:
+            if name not in self.queues:
+                self.queues[name] = MemoryQueue(name, arguments)
+            return self.queues[name]
+
+    def bind(self, queue, exchange, routing_key):
+        with self.changed:
+            bindings = self.exchanges[exchange][1]
+            if (queue, routing_key) not in bindings:
+                bindings.append((queue, routing_key))
+
+    def route(self, exchange, routing_key):
+        if exchange == '':
+            return [routing_key] if routing_key in self.queues else []
+
+        exchange_type, bindings = self.exchanges[exchange]
+        if exchange_type == 'fanout':
+            matched = [queue for queue, _ in bindings]
+        elif exchange_type == 'topic':
+            matched = [queue for queue, pattern in bindings if topic_matches(pattern, routing_key)]
+        else:
+            matched = [queue for queue, key in bindings if key == routing_key]
+        return list(OrderedDict.fromkeys(matched))
+
+    def publish(self, exchange, routing_key, body, properties):
+        with self.changed:
+            targets = self.route(exchange, routing_key)
+            for name in targets:
+                queue = self.queues[name]
+                expires_at = time.monotonic() + queue.ttl if queue.ttl is not None else None
+                queue.messages.append(Message(exchange, routing_key, body, properties, expires_at))
+            if targets:
+                self.changed.notify_all()
+            return len(targets)
+
+    def dead_letter(self, queue, message, reason):
+        exchange = queue.arguments.get('x-dead-letter-exchange')
+        if exchange is None:
+            return
+
+        properties = copy.copy(message.properties)
+        headers = dict(properties.headers or {})
+        headers['x-death'] = [{
+            'queue': queue.name,
+            'reason': reason,
+            'count': 1,
+            'exchange': message.exchange,
+            'routing-keys': [message.routing_key],
+        }] + list(headers.get('x-death', []))
+        properties.headers = headers
+
+        routing_key = queue.arguments.get('x-dead-letter-routing-key', message.routing_key)
+        self.publish(exchange, routing_key, message.body, properties)
+
+    def expire(self, now):
+        """Dead-letter every message whose TTL ran out, returns the next time one will."""
+        next_expiry = None
+        with self.changed:
+            for queue in list(self.queues.values()):
+                while queue.messages and queue.messages[0].expires_at is not None and queue.messages[0].expires_at <= now:
+                    self.dead_letter(queue, queue.messages.popleft(), 'expired')
+                if queue.messages and queue.messages[0].expires_at is not None:
+                    expiry = queue.messages[0].expires_at
+                    next_expiry = expiry if next_expiry is None else min(next_expiry, expiry)
+        return next_expiry
+
+
+class Timer:
+    __slots__ = ('due', 'callback', 'cancelled')
+
+    def __init__(self, due, callback):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.due < other.due
+
+
+class MemoryConnection:
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.channels = []
+        self.timers = []
+        self.callbacks = deque()
+        self.blocked_callbacks = []
+        self.unblocked_callbacks = []
+        self._channel_numbers = itertools.count(1)
+        broker.connections.add(self)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self):
+        self._check_open()
+        channel = MemoryChannel(self, next(self._channel_numbers))
+        self.channels.append(channel)
+        return channel
+
+    def close(self):
+        self._check_open()
+        for channel in self.channels:
+            if channel.is_open:
+                channel.close()
+        self.is_open = False
+
+    def call_later(self, delay, callback):
+        timer = Timer(time.monotonic() + delay, callback)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def remove_timeout(self, timer):
+        timer.cancelled = True
+
+    def add_on_connection_blocked_callback(self, callback):
+        self.blocked_callbacks.append(callback)
+
+    def add_on_connection_unblocked_callback(self, callback):
+        self.unblocked_callbacks.append(callback)
+
+    def notify(self, method, callbacks):
+        if self.is_open:
+            for callback in callbacks:
+                callback(self, pika.frame.Method(0, method))
+
+    def add_callback_threadsafe(self, callback):
+        with self.broker.changed:
+            self.callbacks.append(callback)
+            self.broker.changed.notify_all()
+
+    def process_data_events(self, time_limit=0):
+        self._check_open()
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            next_event = self._process_once()
+            if next_event is True:
+                return
+
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            wait = deadline - now
+            if next_event is not None:
+                wait = min(wait, max(next_event - now, 0))
+            with self.broker.changed:
+                if not self.callbacks:
+                    self.broker.changed.wait(wait)
+
+    def sleep(self, duration):
+        self.process_data_events(time_limit=duration)
+
+    def _process_once(self):
+        """Run whatever is ready. Returns True if anything ran, else when the next timer or expiry is due."""
+        ran = False
+        while True:
+            with self.broker.changed:
+                callback = self.callbacks.popleft() if self.callbacks else None
+            if callback is None:
+                break
+            callback()
+            ran = True
+
+        now = time.monotonic()
+        while self.timers and (self.timers[0].cancelled or self.timers[0].due <= now):
+            timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback()
+                ran = True
+
+        next_expiry = self.broker.expire(now)
+
+        for channel in list(self.channels):
+            ran = channel._dispatch() or ran
+
+        if ran:
+            return True
+        next_timer = next((timer.due for timer in sorted(self.timers) if not timer.cancelled), None)
+        due = [when for when in (next_timer, next_expiry) if when is not None]
+        return min(due) if due else None
+
+    def _check_open(self):
+        if not self.is_open:
+            raise ConnectionWrongStateError('Connection is closed.')
+
+
+class MemoryChannel:
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+        self.prefetch_count = 0
+        self.consumers = OrderedDict()
+        self.unacked = OrderedDict()
+        self._delivery_tags = itertools.count(1)
+        self._consumer_tags = itertools.count(1)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def confirm_delivery(self):
+        self._check_open()
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False, **kwargs):
+        self._check_open()
+        if passive and exchange not in self.broker.exchanges:
+            self._closed_by_broker(404, f"NOT_FOUND - no exchange '{exchange}'")
+        self.broker.declare_exchange(exchange, exchange_type)
+
+    def queue_declare(self, queue, passive=False, durable=False, exclusive=False, auto_delete=False, arguments=None):
+        self._check_open()
+        with self.broker.changed:
+            if passive and queue not in self.broker.queues:
+                self._closed_by_broker(404, f"NOT_FOUND - no queue '{queue}'")
+            declared = self.broker.declare_queue(queue, arguments)
+            return pika.frame.Method(
+                self.channel_number, pika.spec.Queue.DeclareOk(queue, len(declared.messages), declared.consumers))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._check_open()
+        if exchange not in self.broker.exchanges or queue not in self.broker.queues:
+            self._closed_by_broker(404, f"NOT_FOUND - cannot bind '{queue}' to '{exchange}'")
+        self.broker.bind(queue, exchange, routing_key if routing_key is not None else queue)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._check_open()
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False, consumer_tag=None,
+                      arguments=None):
+        self._check_open()
+        if queue not in self.broker.queues:
+            self._closed_by_broker(404, f"NOT_FOUND - no queue '{queue}'")
+        consumer_tag = consumer_tag or f'ctag{self.channel_number}.{next(self._consumer_tags)}'
+        self.consumers[consumer_tag] = (queue, on_message_callback, auto_ack)
+        with self.broker.changed:
+            self.broker.queues[queue].consumers += 1
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        consumer = self.consumers.pop(consumer_tag, None)
+        if consumer is not None:
+            with self.broker.changed:
+                self.broker.queues[consumer[0]].consumers -= 1
+        return []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if exchange not in self.broker.exchanges:
+            self._closed_by_broker(404, f"NOT_FOUND - no exchange '{exchange}'")
+        if isinstance(body, str):
+            body = body.encode()
+        self.broker.publish(exchange, routing_key, bytes(body), properties or pika.BasicProperties())
+
+    def basic_get(self, queue, auto_ack=False):
+        self._check_open()
+        with self.broker.changed:
+            if queue not in self.broker.queues:
+                self._closed_by_broker(404, f"NOT_FOUND - no queue '{queue}'")
+            self.broker.expire(time.monotonic())
+            messages = self.broker.queues[queue].messages
+            if not messages:
+                return None, None, None
+            message = messages.popleft()
+            remaining = len(messages)
+
+        delivery_tag = next(self._delivery_tags)
+        if not auto_ack:
+            self.unacked[delivery_tag] = (queue, message, None)
+        method = pika.spec.Basic.GetOk(delivery_tag, message.redelivered, message.exchange, message.routing_key, remaining)
+        return method, message.properties, message.body
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._check_open()
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._check_open()
+        for queue, message in self._settle(delivery_tag, multiple):
+            self._reject(queue, message, requeue)
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.basic_nack(delivery_tag, requeue=requeue)
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        self._check_open()
+        for consumer_tag in list(self.consumers):
+            self.basic_cancel(consumer_tag)
+        # Like a broker, hand everything this channel never settled back to its queue.
+        for queue, message in reversed([(queue, message) for queue, message, _ in self.unacked.values()]):
+            self._reject(queue, message, requeue=True)
+        self.unacked.clear()
+        self.is_open = False
+
+    def _settle(self, delivery_tag, multiple):
+        if multiple:
+            tags = [tag for tag in self.unacked if delivery_tag == 0 or tag <= delivery_tag]
+        elif delivery_tag in self.unacked:
+            tags = [delivery_tag]
+        else:
+            self._closed_by_broker(406, f'PRECONDITION_FAILED - unknown delivery tag {delivery_tag}')
+        return [self.unacked.pop(tag)[:2] for tag in tags]
+
+    def _reject(self, queue, message, requeue):
+        with self.broker.changed:
+            memory_queue = self.broker.queues.get(queue)
+            if memory_queue is None:
+                return
+            if requeue:
+                message.redelivered = True
+                memory_queue.messages.appendleft(message)
+                self.broker.changed.notify_all()
+            else:
+                self.broker.dead_letter(memory_queue, message, 'rejected')
+
+    def _unacked_by(self, consumer_tag):
+        return sum(1 for _, _, tag in self.unacked.values() if tag == consumer_tag)
+
+    def _dispatch(self):
+        delivered = False
+        for consumer_tag, (queue, callback, auto_ack) in list(self.consumers.items()):
+            while self.is_open and consumer_tag in self.consumers:
+                if self.prefetch_count and not auto_ack and self._unacked_by(consumer_tag) >= self.prefetch_count:
+                    break
+                with self.broker.changed:
+                    messages = self.broker.queues[queue].messages
+                    if not messages:
+                        break
+                    message = messages.popleft()
+
+                delivery_tag = next(self._delivery_tags)
+                if not auto_ack:
+                    self.unacked[delivery_tag] = (queue, message, consumer_tag)
+                method = pika.spec.Basic.Deliver(
+                    consumer_tag, delivery_tag, message.redelivered, message.exchange, message.routing_key)
+                callback(self, method, message.properties, message.body)
+                delivered = True
+        return delivered
+
+    def _closed_by_broker(self, reply_code, reply_text):
+        self.close()
+        raise ChannelClosedByBroker(reply_code, reply_text)
+
+    def _check_open(self):
+        if not self.is_open:
+            raise ChannelWrongStateError('Channel is closed.')
+
+
+_broker = MemoryBroker()
+
+
+def connect() -> MemoryConnection:
+    return MemoryConnection(_broker)
+
+
+def get_broker() -> MemoryBroker:
+    return _broker
+
+
+def reset() -> MemoryBroker:
+    """Forget every exchange, queue and message, for tests and benchmarks."""
+    global _broker
+    _broker = MemoryBroker()
+    return _broker
@@ -0,0 +1,85 @@
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+from bhealthapp.spool import get_spool
+
+# Notifications are written in milliseconds, lag is alerted on in seconds to minutes.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+MESSAGES = Counter(
+    'bhealth_consumer_messages_total', 'Deliveries by outcome: consumed, acked, duplicate, retried or dead_lettered.',
+    ['queue', 'outcome'])
+HANDLER_SECONDS = Histogram('bhealth_consumer_handler_seconds', 'Wall time spent handling a delivery.', ['queue'])
+DB_SECONDS = Histogram('bhealth_consumer_db_seconds', 'Database time spent per delivery.', ['queue'])
+LATENCY_SECONDS = Histogram(
+    'bhealth_event_latency_seconds', 'Time from publishing an event to its notification being written.', ['queue'],
+    buckets=LATENCY_BUCKETS)
+QUEUE_DEPTH = Gauge('bhealth_queue_depth', 'Messages ready in a queue, from passive declares.', ['queue'])
+
+
+def count(queue, outcome, amount=1):
+    if amount:
+        MESSAGES.labels(queue, outcome).inc(amount)
+
+
+def observe_latency(queue, produced_at):
+    if produced_at is not None:
+        LATENCY_SECONDS.labels(queue).observe(max(time.time() - produced_at, 0))
+
+
+class QueryTimer:
+    """Execute wrapper adding up the time the current thread spends in the database."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+@contextmanager
+def timed_handler(queue, messages=1):
+    """Record handler wall time and database time, spread evenly over the messages handled."""
+    timer = QueryTimer()
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(timer):
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        for _ in range(messages):
+            HANDLER_SECONDS.labels(queue).observe(elapsed / messages)
+            DB_SECONDS.labels(queue).observe(timer.seconds / messages)
+
+
+class SpoolCollector:
+    """Reads the local spool on every scrape."""
+
+    def collect(self):
+        stats = get_spool().stats()
+        yield GaugeMetricFamily('bhealth_spool_bytes', 'Bytes waiting in the local spool.', value=stats['bytes'])
+        yield GaugeMetricFamily('bhealth_spool_segments', 'Spool segments not yet drained.', value=stats['segments'])
+        yield GaugeMetricFamily(
+            'bhealth_spool_oldest_seconds', 'Age of the oldest spooled message.', value=stats['oldest_age_seconds'])
+
+
+_serving = False
+
+
+def serve(port):
+    """Expose every metric of this process on http://0.0.0.0:<port>/metrics."""
+    global _serving
+    if not _serving:
+        REGISTRY.register(SpoolCollector())
+        start_http_server(port)
+        _serving = True
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:02
+
+from django.db import migrations, models
+import uuid
+
+
+def fill_message_ids(apps, schema_editor):
+    Outbox = apps.get_model('bhealthapp', 'Outbox')
+    for event in Outbox.objects.filter(message_id__isnull=True).only('pk'):
+        event.message_id = uuid.uuid4()
+        event.save(update_fields=['message_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bhealthapp', '0018_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outbox',
+            name='message_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_message_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='outbox',
+            name='message_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
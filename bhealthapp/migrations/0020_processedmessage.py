@@ -0,0 +1,26 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bhealthapp', '0019_outbox_message_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(max_length=255)),
+                ('message_id', models.CharField(max_length=64)),
+                ('processed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='processedmessage',
+            constraint=models.UniqueConstraint(fields=('queue', 'message_id'), name='unique_processed_message'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bhealthapp', '0020_processedmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabDayOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('slots', models.BinaryField()),
+                ('lab', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='bhealthapp.lab')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='labdayoccupancy',
+            constraint=models.UniqueConstraint(fields=('lab', 'day'), name='unique_lab_day_occupancy'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:25
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking bookings on a large appointment table.
+    atomic = False
+
+    dependencies = [
+        ('bhealthapp', '0021_labdayoccupancy'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'status', 'date'], name='appointment_patient_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(fields=['lab_appointment', 'status', 'date'], name='appointment_lab_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 0)), fields=['lab_appointment', '-id'], name='appointment_lab_pending_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 2)), fields=['-date'], name='appointment_canceled_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 2), _negated=True), fields=['lab_appointment', 'date'], name='appointment_lab_booked_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:34
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+def build_documents(apps, schema_editor):
+    from bhealthapp.search import refresh
+
+    refresh(apps=apps)
+
+
+class Migration(migrations.Migration):
+    # Fill the documents first and index them without blocking the lab table.
+    atomic = False
+
+    dependencies = [
+        ('bhealthapp', '0022_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lab',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='lab',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='lab_search_idx'),
+        ),
+    ]
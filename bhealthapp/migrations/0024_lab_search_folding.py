@@ -0,0 +1,98 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:42
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.lookups import Unaccent
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Concat, Lower
+
+# Folding and typo matching need these, search works without them where the database server lacks contrib.
+EXTENSIONS = ('unaccent', 'pg_trgm')
+
+
+def installed(schema_editor, extension):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_extension WHERE extname = %s', [extension])
+        return cursor.fetchone() is not None
+
+
+def create_extensions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT name FROM pg_available_extensions WHERE name IN %s', [EXTENSIONS])
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'CREATE EXTENSION IF NOT EXISTS {name}')
+
+
+def create_configuration(apps, schema_editor):
+    # Like simple, with diacritics folded before words are indexed or searched.
+    schema_editor.execute('CREATE TEXT SEARCH CONFIGURATION bhealth_search (COPY = simple)')
+    if installed(schema_editor, 'unaccent'):
+        schema_editor.execute('ALTER TEXT SEARCH CONFIGURATION bhealth_search '
+                              'ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple')
+
+
+def drop_configuration(apps, schema_editor):
+    schema_editor.execute('DROP TEXT SEARCH CONFIGURATION bhealth_search')
+
+
+def build_documents(apps, schema_editor):
+    Lab = apps.get_model('bhealthapp', 'Lab')
+    City = apps.get_model('bhealthapp', 'City')
+    LabService = apps.get_model('bhealthapp', 'LabService')
+
+    city = Coalesce(models.Subquery(City.objects.filter(pk=models.OuterRef('city_id')).values('name')[:1]),
+                    models.Value(''), output_field=models.TextField())
+    services = Coalesce(models.Subquery(
+        LabService.objects.filter(lab_service=models.OuterRef('pk')).values('lab_service').annotate(
+            names=StringAgg('service__name', ' ', output_field=models.TextField())).values('names')),
+        models.Value(''), output_field=models.TextField())
+    names = Concat('name', models.Value(' '), city, models.Value(' '), services, output_field=models.TextField())
+    Lab.objects.update(
+        search_vector=(
+            SearchVector('name', weight='A', config='bhealth_search')
+            + SearchVector(city, weight='B', config='bhealth_search')
+            + SearchVector(services, weight='B', config='bhealth_search')
+            + SearchVector('address', weight='C', config='bhealth_search')
+            + SearchVector('description', weight='D', config='bhealth_search')
+        ),
+        search_names=Lower(Unaccent(names)) if installed(schema_editor, 'unaccent') else Lower(names),
+    )
+
+
+def create_trigram_index(apps, schema_editor):
+    if installed(schema_editor, 'pg_trgm'):
+        schema_editor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS lab_names_trgm_idx '
+                              'ON bhealthapp_lab USING gin (search_names gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS lab_names_trgm_idx')
+
+
+class Migration(migrations.Migration):
+    # Index without blocking the lab table.
+    atomic = False
+
+    dependencies = [
+        ('bhealthapp', '0023_lab_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_extensions, migrations.RunPython.noop),
+        migrations.RunPython(create_configuration, drop_configuration),
+        migrations.AddField(
+            model_name='lab',
+            name='search_names',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_trigram_index, drop_trigram_index)],
+            state_operations=[migrations.AddIndex(
+                model_name='lab',
+                index=django.contrib.postgres.indexes.GinIndex(fields=['search_names'], name='lab_names_trgm_idx',
+                                                               opclasses=['gin_trgm_ops']),
+            )],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bhealthapp', '0024_lab_search_folding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lab',
+            name='availability_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
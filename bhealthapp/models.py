@@ -1,7 +1,12 @@
+import uuid
 from datetime import datetime
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django_rest_passwordreset.signals import reset_password_token_created
@@ -94,6 +99,17 @@ class Lab(models.Model):
     working_days = models.TextField(null=True, max_length=255, default='All working days')
     profile_picture = models.ImageField(default='default.jpg', upload_to='profile_pics', null=True)
     average_rating = models.FloatField(default=0.0)
+    # Maintained by bhealthapp.search from save signals.
+    search_vector = SearchVectorField(null=True, editable=False)
+    search_names = models.TextField(null=True, editable=False)
+    # Bumped by bhealthapp.availability with every change to the lab's appointments.
+    availability_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='lab_search_idx'),
+            GinIndex(fields=['search_names'], opclasses=['gin_trgm_ops'], name='lab_names_trgm_idx'),
+        ]
 
 
 class UserRating(models.Model):
@@ -161,6 +177,108 @@ class Appointment(models.Model):
         default=STATUS_PENDING,
     )
 
+    class Meta:
+        indexes = [
+            # Upcoming and past appointments of a patient or a lab: equality on owner and status, range on date.
+            models.Index(fields=['patient', 'status', 'date'], name='appointment_patient_idx'),
+            models.Index(fields=['lab_appointment', 'status', 'date'], name='appointment_lab_idx'),
+            # Booking requests a lab has not answered yet, newest first. Status 0 is pending, 2 canceled.
+            models.Index(fields=['lab_appointment', '-id'], name='appointment_lab_pending_idx',
+                         condition=models.Q(status=0)),
+            models.Index(fields=['-date'], name='appointment_canceled_idx', condition=models.Q(status=2)),
+            # Appointments keeping a lab busy, read by availability, occupancy and booking.
+            models.Index(fields=['lab_appointment', 'date'], name='appointment_lab_booked_idx',
+                         condition=~models.Q(status=2)),
+        ]
+
+
+# Appointment fields that decide when a lab is busy, remembered to tell which lab-days a save touched.
+BOOKING_FIELDS = ('lab_appointment_id', 'date', 'status', 'service_appointment_id')
+
+
+@receiver(post_init, sender=Appointment)
+def remember_booking(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded for every instance.
+    instance._booked_was = tuple(instance.__dict__.get(field) for field in BOOKING_FIELDS)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def booking_changed(sender, instance, signal, created=False, **kwargs):
+    from bhealthapp import availability, occupancy
+
+    occupancy.appointment_changed(instance, created=created, deleted=signal is post_delete)
+    availability.appointment_changed(instance, created=created, deleted=signal is post_delete)
+    instance._booked_was = tuple(getattr(instance, field) for field in BOOKING_FIELDS)
+
+
+@receiver(post_save, sender=Lab)
+def lab_saved(sender, instance, update_fields=None, **kwargs):
+    from bhealthapp import search
+
+    search.lab_changed(instance, update_fields)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    from bhealthapp import search
+
+    search.set_similarity_threshold(connection)
+
+
+@receiver(post_save, sender=LabService)
+@receiver(post_delete, sender=LabService)
+def lab_service_changed(sender, instance, **kwargs):
+    from bhealthapp import search
+
+    search.refresh([instance.lab_service_id])
+
+
+@receiver(post_save, sender=Service)
+def service_saved(sender, instance, created=False, **kwargs):
+    from bhealthapp import search
+
+    if not created:
+        search.labs_of_service_changed(instance)
+
+
+@receiver(post_save, sender=City)
+def city_saved(sender, instance, created=False, **kwargs):
+    from bhealthapp import search
+
+    if not created:
+        search.labs_of_city_changed(instance)
+
+
+@receiver(post_init, sender=Lab)
+@receiver(post_init, sender=Service)
+@receiver(post_init, sender=Type)
+@receiver(post_init, sender=City)
+def remember_name(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred name is not loaded for every instance.
+    instance._name_was = instance.__dict__.get('name')
+
+
+@receiver(post_save, sender=Lab)
+@receiver(post_delete, sender=Lab)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Type)
+@receiver(post_delete, sender=Type)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def catalog_changed(sender, instance, signal, created=False, update_fields=None, **kwargs):
+    from bhealthapp import autocomplete
+
+    # Only names are indexed, ratings reach the index with its periodic rebuild.
+    if signal is post_save and not created:
+        if update_fields is not None and 'name' not in update_fields:
+            return
+        if instance.__dict__.get('name') == instance._name_was:
+            return
+    autocomplete.catalog_changed()
+    instance._name_was = instance.__dict__.get('name')
+
 
 class Result(models.Model):
     appointment = models.ForeignKey(Appointment, related_name='appointment_result', on_delete=models.DO_NOTHING)
@@ -174,4 +292,47 @@ class Notification(models.Model):
     notification_date = models.DateTimeField(default=datetime.now())
 
 
+class Outbox(models.Model):
+    """
+    Broker messages written in the same transaction as the change they describe and
+    published by the outbox relay once that transaction has committed.
+    """
+    routing_key = models.CharField(max_length=255)
+    payload = models.JSONField()
+    # Shared by every publish of the row, so consumers can drop the duplicates.
+    message_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ProcessedMessage(models.Model):
+    """
+    Ids of the messages each consumer queue has handled. The row is written in the
+    handler's transaction, so a redelivered message hits the unique constraint instead
+    of creating its notification twice.
+    """
+    queue = models.CharField(max_length=255)
+    message_id = models.CharField(max_length=64)
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['queue', 'message_id'], name='unique_processed_message'),
+        ]
+
+
+class LabDayOccupancy(models.Model):
+    """
+    Which 5 minute slots of a lab-day are taken by non-canceled appointments, one bit
+    per slot with bit 0 at midnight. Derived from appointments, see bhealthapp.occupancy.
+    """
+    lab = models.ForeignKey(Lab, related_name='occupancy', on_delete=models.CASCADE)
+    day = models.DateField(db_index=True)
+    slots = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['lab', 'day'], name='unique_lab_day_occupancy'),
+        ]
+
+
 saved_file.connect(generate_aliases_global)
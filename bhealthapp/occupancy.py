@@ -0,0 +1,183 @@
+"""
+Per lab-day occupancy bitmaps for finding free windows across many labs.
+
+Each LabDayOccupancy row holds one bit per 5 minute slot of the day, set while a
+non-canceled appointment keeps the lab busy in any part of it. A search loads the
+rows of every candidate lab for a day with one query and finds each lab's first
+free window with bitwise operations on Python ints, so no appointment is scanned.
+An appointment running past midnight sets bits in the rows of both days.
+
+Rows are kept current from appointment signals inside the saving transaction:
+a new appointment sets its bits, any other change recomputes the lab-days it
+touched under a row lock. rebuild recomputes them in bulk, e.g. after loading
+data with signals bypassed. A lab-day without a row is free.
+"""
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from bhealthapp.availability import as_datetime, day_bounds, occupied_seconds
+from bhealthapp.models import BOOKING_FIELDS, Appointment, LabDayOccupancy, Service
+
+SLOT_SECONDS = 5 * 60
+SLOTS_PER_DAY = 24 * 60 * 60 // SLOT_SECONDS
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+
+def to_bytes(bits: int) -> bytes:
+    return bits.to_bytes(SLOTS_PER_DAY // 8, 'little')
+
+
+def from_bytes(data) -> int:
+    return int.from_bytes(bytes(data), 'little')
+
+
+def booking_bits(start: datetime, duration: timedelta, day: date) -> int:
+    """Slots of day taken by an appointment starting at start, partly taken slots included."""
+    midnight = day_bounds(day)[0]
+    begins = int(start.timestamp()) - midnight
+    ends = begins + occupied_seconds(duration)
+    first = max(begins // SLOT_SECONDS, 0)
+    last = min(-(-ends // SLOT_SECONDS), SLOTS_PER_DAY)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def day_of(moment: datetime) -> date:
+    return timezone.localtime(moment).date()
+
+
+def booked_days(start: datetime, duration: timedelta) -> list:
+    """Days a booking starting at start keeps its lab busy on, the next one too when it runs past midnight."""
+    first = day_of(start)
+    last = day_of(start + timedelta(seconds=occupied_seconds(duration) - 1))
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def bitmaps(start: date, end: date, lab_ids=None) -> dict:
+    """Occupancy of every booked lab-day from day start through day end, computed with one query."""
+    # From the day before, whose late appointments can run into day start.
+    appointments = Appointment.objects.filter(
+        date__gte=datetime.fromtimestamp(day_bounds(start - timedelta(days=1))[0], timezone.utc),
+        date__lt=datetime.fromtimestamp(day_bounds(end)[1], timezone.utc),
+    ).exclude(status=Appointment.STATUS_CANCELED)
+    if lab_ids is not None:
+        appointments = appointments.filter(lab_appointment_id__in=lab_ids)
+
+    occupancy = {}
+    for lab_id, moment, duration in appointments.values_list(
+            'lab_appointment_id', 'date', 'service_appointment__duration').iterator(chunk_size=5000):
+        for day in booked_days(moment, duration):
+            if start <= day <= end:
+                occupancy[lab_id, day] = occupancy.get((lab_id, day), 0) | booking_bits(moment, duration, day)
+    return occupancy
+
+
+def rebuild(start: date, end: date, lab_ids=None) -> int:
+    """Recompute the occupancy rows of every lab-day from day start through day end, returns how many were written."""
+    with transaction.atomic():
+        occupancy = bitmaps(start, end, lab_ids)
+        rows = LabDayOccupancy.objects.filter(day__gte=start, day__lte=end)
+        if lab_ids is not None:
+            rows = rows.filter(lab_id__in=lab_ids)
+        rows.delete()
+        LabDayOccupancy.objects.bulk_create([
+            LabDayOccupancy(lab_id=lab_id, day=day, slots=to_bytes(bits)) for (lab_id, day), bits in occupancy.items()
+        ], batch_size=1000)
+    return len(occupancy)
+
+
+def _locked_row(lab_id, day) -> LabDayOccupancy:
+    LabDayOccupancy.objects.bulk_create([LabDayOccupancy(lab_id=lab_id, day=day, slots=to_bytes(0))],
+                                        ignore_conflicts=True)
+    return LabDayOccupancy.objects.select_for_update().get(lab_id=lab_id, day=day)
+
+
+def _recompute(lab_id, day):
+    # Lock first, so the appointments read next include every change committed before ours.
+    row = _locked_row(lab_id, day)
+    row.slots = to_bytes(bitmaps(day, day, [lab_id]).get((lab_id, day), 0))
+    row.save(update_fields=['slots'])
+
+
+def appointment_changed(appointment, created=False, deleted=False):
+    was = dict(zip(BOOKING_FIELDS, getattr(appointment, '_booked_was', (None,) * len(BOOKING_FIELDS))))
+    was['date'] = as_datetime(was['date'])
+    now = {field: getattr(appointment, field) for field in BOOKING_FIELDS}
+    now['date'] = as_datetime(now['date'])
+    if not created and not deleted and was == now:
+        return
+
+    # Part of the saving transaction when there is one, no savepoint needed.
+    with transaction.atomic(savepoint=False):
+        if created:
+            if now['date'] is not None and now['status'] != Appointment.STATUS_CANCELED:
+                duration = appointment.service_appointment.duration
+                for day in booked_days(now['date'], duration):
+                    row = _locked_row(now['lab_appointment_id'], day)
+                    row.slots = to_bytes(from_bytes(row.slots) | booking_bits(now['date'], duration, day))
+                    row.save(update_fields=['slots'])
+            return
+
+        durations = {now['service_appointment_id']: appointment.service_appointment.duration}
+        if was['service_appointment_id'] not in durations and was['service_appointment_id'] is not None:
+            durations[was['service_appointment_id']] = Service.objects.only('duration').get(
+                pk=was['service_appointment_id']).duration
+        touched = {(booking['lab_appointment_id'], day)
+                   for booking in (was, now) if booking['lab_appointment_id'] is not None and booking['date'] is not None
+                   for day in booked_days(booking['date'], durations.get(booking['service_appointment_id']))}
+        for lab_id, day in sorted(touched):
+            _recompute(lab_id, day)
+
+
+def window_starts(occupied: int, length: int) -> int:
+    """Bits set at every slot where length consecutive slots are free."""
+    windows = ~occupied & FULL_DAY
+    span = 1
+    # Doubling: a bit stays set while the span slots starting at it are all free.
+    while span < length:
+        shift = min(span, length - span)
+        windows &= windows >> shift
+        span += shift
+    return windows
+
+
+def allowed_starts(day: date, length: int, not_before=None) -> int:
+    """Bits at the slots a window of length slots may start at: within opening hours and on the slot grid."""
+    if day.weekday() not in settings.LAB_WORKING_DAYS:
+        return 0
+    midnight = day_bounds(day)[0]
+    opens = settings.LAB_OPENING_HOUR * 3600 // SLOT_SECONDS
+    closes = settings.LAB_CLOSING_HOUR * 3600 // SLOT_SECONDS
+    step = max(settings.AVAILABILITY_SLOT_MINUTES * 60 // SLOT_SECONDS, 1)
+
+    allowed = 0
+    for slot in range(opens, closes - length + 1, step):
+        if not_before is None or midnight + slot * SLOT_SECONDS >= not_before:
+            allowed |= 1 << slot
+    return allowed
+
+
+def earliest_free(lab_ids, day: date, duration: timedelta):
+    """(lab id, start, end) of the earliest free window of duration at any of the labs on day, or None."""
+    lab_ids = list(lab_ids)
+    length = -(-occupied_seconds(duration) // SLOT_SECONDS)
+    allowed = allowed_starts(day, length, not_before=int(timezone.now().timestamp()))
+    if not allowed or not lab_ids:
+        return None
+
+    occupancy = dict(LabDayOccupancy.objects.filter(day=day, lab_id__in=lab_ids).values_list('lab_id', 'slots'))
+    best = None
+    for lab_id in sorted(lab_ids):
+        starts = window_starts(from_bytes(occupancy[lab_id]) if lab_id in occupancy else 0, length) & allowed
+        if starts:
+            # Lowest set bit is the earliest start.
+            slot = (starts & -starts).bit_length() - 1
+            if best is None or slot < best[1]:
+                best = (lab_id, slot)
+
+    if best is None:
+        return None
+    start = datetime.fromtimestamp(day_bounds(day)[0] + best[1] * SLOT_SECONDS, timezone.utc)
+    return best[0], start, start + timedelta(seconds=occupied_seconds(duration))
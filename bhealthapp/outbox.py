@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from bhealthapp.background_publisher import enqueue
+from bhealthapp.backpressure import DELAY, SHED
+from bhealthapp.envelope import Envelope, encode
+from bhealthapp.models import Outbox
+from bhealthapp.rmq_topology import routing_key_for
+
+
+def record_event(routing_key: str, payload: dict) -> Outbox:
+    """
+    Queue a broker message. Call it inside the transaction that makes the change the
+    message describes, so the message exists if and only if that change commits.
+    Once it commits the background publisher sends it right away, the relay only
+    picks up rows that are still there OUTBOX_RELAY_DELAY_SECONDS later.
+    """
+    event = Outbox.objects.create(routing_key=routing_key, payload=payload)
+    transaction.on_commit(lambda: enqueue(envelope_for(event), outbox_id=event.pk))
+    return event
+
+
+def envelope_for(event: Outbox) -> Envelope:
+    return Envelope.new(routing_key_for(event.routing_key), event.payload, message_id=event.message_id.hex,
+                        produced_at=event.created_at.timestamp())
+
+
+def relay_batch(publisher, batch_size=100, min_age=None) -> int:
+    """
+    Publish up to batch_size outbox rows older than min_age seconds in insertion order
+    and delete them. Rows locked by another relay are skipped, so several relays can
+    drain in parallel. If publishing fails the transaction rolls back and the rows stay
+    for the next run. Rows the publisher delays stay as well, and the rows behind them
+    are read past them so critical events never wait on delayed ones; rows it sheds are
+    deleted unpublished. Returns how many rows were published or shed.
+    """
+    min_age = settings.OUTBOX_RELAY_DELAY_SECONDS if min_age is None else min_age
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+
+    with transaction.atomic():
+        rows = Outbox.objects.select_for_update(skip_locked=True).filter(created_at__lte=cutoff).order_by('id')
+        done = []
+        delayed = set()
+        last_id = 0
+        while len(done) < batch_size:
+            events = list(rows.filter(id__gt=last_id).exclude(routing_key__in=delayed)[:batch_size - len(done)])
+            if not events:
+                break
+            for event in events:
+                last_id = event.pk
+                if event.routing_key in delayed:
+                    continue
+                decision = publisher.admit(event.routing_key)
+                if decision == DELAY:
+                    # Asked once per batch, the next read leaves out its rows.
+                    delayed.add(event.routing_key)
+                    continue
+                if decision != SHED:
+                    publisher.publish(event.routing_key, encode(envelope_for(event)))
+                done.append(event.pk)
+        Outbox.objects.filter(pk__in=done).delete()
+
+    return len(done)
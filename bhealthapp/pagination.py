@@ -0,0 +1,153 @@
+"""
+Pagination for the large list endpoints.
+
+EstimatedCountPaginator counts the pages of an unfiltered queryset from the
+table's row estimate in pg_class once it passes
+settings.PAGINATION_EXACT_COUNT_THRESHOLD, so a page of millions of notifications
+does not wait for an exact COUNT(*). Filtered querysets, whose estimates can be
+far off, and smaller tables are counted exactly; count_is_exact tells which one a
+page got. A page coming back short shows the estimate overshot: it is the last
+page and the count is corrected from it.
+
+Keyset pagination:
+
+A page is the next page_size rows after the position of the previous page's last
+row in a fixed ordering, e.g. ('-date', '-id'), so it costs the same on the
+thousandth page as on the first: no COUNT(*) and no OFFSET. The position travels
+to the client as an opaque cursor in the next link. The last field of the
+ordering must be unique, otherwise rows tied on every field could be skipped.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimated_count(queryset):
+    """Rows in the table of an unfiltered queryset as the Postgres planner estimates them, None for any other queryset."""
+    if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+        return None
+    query = queryset.query
+    if query.where or query.is_sliced or query.distinct or query.group_by is not None or query.combinator:
+        return None
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        # reltuples as of the last ANALYZE, scaled to the table's current size like the planner does.
+        cursor.execute(
+            "SELECT CASE WHEN relpages > 0 THEN reltuples / relpages * "
+            "(pg_relation_size(oid) / current_setting('block_size')::int) ELSE reltuples END "
+            "FROM pg_class WHERE oid = %s::regclass", [connection.ops.quote_name(queryset.model._meta.db_table)])
+        estimate = cursor.fetchone()[0]
+    # -1 until the table is first analyzed.
+    return int(estimate) if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        self._count_is_exact = estimate is None or estimate < settings.PAGINATION_EXACT_COUNT_THRESHOLD
+        return super().count if self._count_is_exact else estimate
+
+    @property
+    def count_is_exact(self) -> bool:
+        return self.count is not None and self._count_is_exact
+
+    def page(self, number):
+        page = super().page(number)
+        if not self.count_is_exact and len(page) < self.per_page:
+            if not len(page) and page.number > 1:
+                raise EmptyPage('That page contains no results')
+            # Fewer rows than estimated: this is the last page, which tells the exact count.
+            self.__dict__['count'] = (page.number - 1) * self.per_page + len(page)
+            self.__dict__.pop('num_pages', None)
+            self._count_is_exact = True
+        return page
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering, page_size):
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+
+    @classmethod
+    def requested(cls, request) -> bool:
+        return request.query_params.get(cls.mode_query_param) == 'cursor' or cls.cursor_query_param in request.query_params
+
+    def fields(self, model):
+        return [(model._meta.get_field(name.lstrip('-')), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, position) -> str:
+        # isoformat keeps the microseconds, DjangoJSONEncoder would drop them and break ties on date.
+        return base64.urlsafe_b64encode(json.dumps(position, default=lambda value: value.isoformat()).encode()).decode()
+
+    def decode_cursor(self, cursor, fields):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(position, list) or len(position) != len(fields):
+                raise ValueError(position)
+            return [None if value is None else field.to_python(value) for (field, _), value in zip(fields, position)]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, fields, position) -> Q:
+        """Rows after position in the ordering, with nulls where Postgres puts them: last ascending, first descending."""
+        (field, descending), value = fields[0], position[0]
+        if value is None:
+            beyond = Q(**{f'{field.attname}__isnull': False}) if descending else None
+            tied = Q(**{f'{field.attname}__isnull': True})
+        else:
+            beyond = Q(**{f'{field.attname}__{"lt" if descending else "gt"}': value})
+            if field.null and not descending:
+                beyond |= Q(**{f'{field.attname}__isnull': True})
+            tied = Q(**{field.attname: value})
+
+        if len(fields) > 1:
+            rest = tied & self.after(fields[1:], position[1:])
+            return rest if beyond is None else beyond | rest
+        return Q(pk__in=[]) if beyond is None else beyond
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        fields = self.fields(queryset.model)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(fields, self.decode_cursor(cursor, fields)))
+
+        # One row more than the page tells whether there is a next page.
+        rows = list(queryset[:self.page_size + 1])
+        page = rows[:self.page_size]
+        self.next_position = None
+        if len(rows) > self.page_size:
+            self.next_position = [getattr(page[-1], field.attname) for field, _ in fields]
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,127 @@
+"""
+Republishes events for appointments that already exist, e.g. to regenerate the
+notifications lost to an outage or a consumer bug.
+
+Appointments are streamed in primary key order through a server-side cursor and
+published on one confirm-mode channel, so a message has reached the broker once
+publish returns. After every chunk the last published id goes to a checkpoint file,
+and a replay started again with the same arguments carries on after it. Message ids
+are derived from the replay run and the appointment, so messages published again
+after a crash between two checkpoints are dropped by the consumers' dedupe.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+
+from bhealthapp.backpressure import PUBLISH
+from bhealthapp.envelope import Envelope, encode
+from bhealthapp.models import Appointment
+
+logger = logging.getLogger(__name__)
+
+
+def _appointments():
+    return Appointment.objects.all()
+
+
+def _with_status(status):
+    return lambda: Appointment.objects.filter(status=status)
+
+
+def _with_results():
+    return Appointment.objects.filter(appointment_result__isnull=False).distinct()
+
+
+# Appointments each event type can be replayed for.
+REPLAYABLE_EVENTS = {
+    'appointment.created': _appointments,
+    'appointment.updated': _appointments,
+    'appointment.confirmed': _with_status(Appointment.STATUS_CONFIRMED),
+    'appointment.canceled': _with_status(Appointment.STATUS_CANCELED),
+    'result.added': _with_results,
+}
+
+
+class Checkpoint:
+    """Last replayed appointment id of a replay run, kept in a small JSON file replaced atomically."""
+
+    def __init__(self, path, selection):
+        self.path = path
+        self.selection = selection
+        self.run_id = uuid.uuid4().hex
+        self.last_id = 0
+        self.replayed = 0
+
+    def load(self) -> bool:
+        """Pick up where an earlier run of the same replay stopped, returns False if there is none."""
+        try:
+            with open(self.path) as checkpoint:
+                state = json.load(checkpoint)
+        except FileNotFoundError:
+            return False
+        if state.get('selection') != self.selection:
+            raise ValueError(f'{self.path} belongs to another replay: {state.get("selection")}')
+
+        self.run_id, self.last_id, self.replayed = state['run_id'], state['last_id'], state['replayed']
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as tmp:
+            json.dump({'selection': self.selection, 'run_id': self.run_id, 'last_id': self.last_id,
+                       'replayed': self.replayed}, tmp)
+        os.replace(self.path + '.tmp', self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def replay_message_id(run_id, event_type, appointment_id):
+    return uuid.uuid5(uuid.UUID(run_id), f'{event_type}:{appointment_id}').hex
+
+
+def replay_events(publisher, event_type, checkpoint, since=None, until=None, rate=0, chunk_size=2000) -> int:
+    """
+    Publish event_type for every matching appointment dated from since until until after
+    the checkpoint, at most rate messages a second when rate is set. Returns how many
+    were published by this call. While the publisher throttles the event type the
+    replay waits instead of adding to the backlog.
+    """
+    queryset = REPLAYABLE_EVENTS[event_type]().filter(pk__gt=checkpoint.last_id)
+    if since is not None:
+        queryset = queryset.filter(date__gte=since)
+    if until is not None:
+        queryset = queryset.filter(date__lt=until)
+
+    started = time.monotonic()
+    published = 0
+    try:
+        for appointment_id in queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size):
+            while publisher.admit(event_type) != PUBLISH:
+                time.sleep(settings.BACKPRESSURE_DEPTH_TTL_SECONDS)
+
+            envelope = Envelope.new(event_type, {'appointment_id': appointment_id},
+                                    message_id=replay_message_id(checkpoint.run_id, event_type, appointment_id))
+            publisher.publish(event_type, encode(envelope))
+            published += 1
+            checkpoint.last_id = appointment_id
+            checkpoint.replayed += 1
+
+            if published % chunk_size == 0:
+                checkpoint.save()
+                logger.info('Replayed %s %s events, up to appointment %s', checkpoint.replayed, event_type, appointment_id)
+            if rate:
+                # Sleep off any lead over the schedule instead of sending in bursts.
+                ahead = started + published / rate - time.monotonic()
+                if ahead > 0:
+                    time.sleep(ahead)
+    finally:
+        if published:
+            checkpoint.save()
+
+    return published
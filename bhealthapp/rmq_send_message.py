@@ -1,25 +1,150 @@
 import json
+import logging
+import os
+import threading
 
 import pika
+from django.conf import settings
+from django.utils.module_loading import import_string
+from pika.exceptions import AMQPConnectionError, ChannelClosed, ChannelWrongStateError
 
+from bhealthapp.backpressure import DELAY, PUBLISH, SHED, Backpressure
+from bhealthapp.envelope import Envelope, encode
+from bhealthapp.rmq_topology import declare_routing, routing_key_for
+from bhealthapp.spool import get_spool
 
-def send_messages(queue_name: str, message: dict) -> None:
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host='rabbitmq'))
-    channel = connection.channel()
-    channel.queue_declare(queue=queue_name, durable=True)
+logger = logging.getLogger(__name__)
 
-    message = dict_to_json_string(message)
+RABBITMQ_CONNECTION_HOST = 'rabbitmq'
 
-    channel.basic_publish(
-        exchange='',
-        routing_key=queue_name,
-        body=message,
-        properties=pika.BasicProperties(
-            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
-        ))
+# Connection factories selectable with RABBITMQ_TRANSPORT, which also accepts a dotted path to another one.
+TRANSPORTS = {
+    'amqp': 'bhealthapp.rmq_send_message.amqp_connection',
+    'memory': 'bhealthapp.memory_broker.connect',
+}
 
-    connection.close()
+# Errors after which the cached connection is thrown away and the publish retried once on a fresh one.
+RECONNECT_ERRORS = (AMQPConnectionError, ChannelClosed, ChannelWrongStateError)
+
+_local = threading.local()
+
+
+def amqp_connection() -> pika.BlockingConnection:
+    return pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_CONNECTION_HOST))
+
+
+def open_connection():
+    return import_string(TRANSPORTS.get(settings.RABBITMQ_TRANSPORT, settings.RABBITMQ_TRANSPORT))()
+
+
+class Publisher:
+    """
+    Keeps one broker connection and channel open for the lifetime of a worker and
+    publishes every event to the topic exchange, declaring the routing for each
+    routing key only once per connection. Legacy queue names are translated to
+    their routing keys. Callers ask admit whether an event may go out now.
+    """
+
+    def __init__(self, confirm_delivery=False):
+        self.confirm_delivery = confirm_delivery
+        self.connection = None
+        self.channel = None
+        self.declared_routes = set()
+        self.backpressure = Backpressure()
+        self.pid = os.getpid()
+
+    def connect(self):
+        self.connection = open_connection()
+        # RabbitMQ blocks publishing connections when it runs low on memory or disk.
+        self.connection.add_on_connection_blocked_callback(self.backpressure.on_blocked)
+        self.connection.add_on_connection_unblocked_callback(self.backpressure.on_unblocked)
+        self.backpressure.on_unblocked()
+        self.channel = self.connection.channel()
+        if self.confirm_delivery:
+            self.channel.confirm_delivery()
+        self.declared_routes = set()
+
+    def close(self):
+        connection, self.connection, self.channel = self.connection, None, None
+        self.declared_routes = set()
+
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except RECONNECT_ERRORS:
+                pass
+
+    def publish(self, routing_key: str, body) -> None:
+        routing_key = routing_key_for(routing_key)
+        try:
+            self._publish(routing_key, body)
+        except RECONNECT_ERRORS:
+            # The broker restarted or dropped an idle connection, reconnect and try once more.
+            self.close()
+            self._publish(routing_key, body)
+
+    def admit(self, routing_key: str) -> str:
+        """Whether to publish, delay or shed an event given how backed up its queues are."""
+        routing_key = routing_key_for(routing_key)
+        try:
+            self._ensure_routing(routing_key)
+            return self.backpressure.decide(self.channel, routing_key)
+        except RECONNECT_ERRORS:
+            # Let publish find out whether the broker is back.
+            self.close()
+            return PUBLISH
+
+    def _publish(self, routing_key, body):
+        self._ensure_routing(routing_key)
+        self.channel.basic_publish(
+            exchange=settings.RABBITMQ_EXCHANGE,
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
+            ))
+
+    def _ensure_routing(self, routing_key):
+        self._ensure_channel()
+        if routing_key not in self.declared_routes:
+            declare_routing(self.channel, routing_key)
+            self.declared_routes.add(routing_key)
+
+    def _ensure_channel(self):
+        if self.pid != os.getpid():
+            # Forked worker, the inherited socket belongs to the parent process.
+            self.connection, self.channel, self.declared_routes = None, None, set()
+            self.pid = os.getpid()
+
+        if self.channel is None or not self.channel.is_open or not self.connection.is_open:
+            self.close()
+            self.connect()
+
+
+def get_publisher() -> Publisher:
+    publisher = getattr(_local, 'publisher', None)
+    if publisher is None:
+        publisher = Publisher(confirm_delivery=settings.RABBITMQ_PUBLISHER_CONFIRMS)
+        _local.publisher = publisher
+    return publisher
+
+
+def send_messages(routing_key: str, message: dict) -> None:
+    routing_key = routing_key_for(routing_key)
+    body = encode(Envelope.new(routing_key, message))
+    publisher = get_publisher()
+    decision = publisher.admit(routing_key)
+    if decision == SHED:
+        return
+    if decision == DELAY:
+        get_spool().append(routing_key, body)
+        return
+
+    try:
+        publisher.publish(routing_key, body)
+    except RECONNECT_ERRORS:
+        logger.warning('Broker unreachable, spooling message for %s', routing_key)
+        get_spool().append(routing_key, body)
 
 
 def dict_to_json_string(payload: dict) -> str:
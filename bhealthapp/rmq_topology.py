@@ -0,0 +1,132 @@
+"""
+Queue layout shared by publishers and consumers.
+
+Events are published once to the RABBITMQ_EXCHANGE topic exchange under routing keys
+such as appointment.created. Each work queue binds the patterns in QUEUE_BINDINGS,
+so a new subscriber is a new entry there rather than another publish per event.
+
+Every work queue Q dead-letters into Q.parking through DEAD_LETTER_EXCHANGE. Failed
+messages are republished to Q.retry.<tier>, a queue without consumers whose TTL
+grows with the tier and whose expired messages dead-letter back into Q. The
+number of attempts so far travels in the ATTEMPTS_HEADER header.
+"""
+import copy
+
+import pika
+from django.conf import settings
+
+DEAD_LETTER_EXCHANGE = 'bhealth.dead_letter'
+ATTEMPTS_HEADER = 'x-attempts'
+
+# Queue names producers used to publish to directly, and the event each one carried.
+LEGACY_ROUTING_KEYS = {
+    'requests': 'appointment.created',
+    'appointment_updates': 'appointment.updated',
+    'appointment': 'appointment.confirmed',
+    'appointment_canceled': 'appointment.canceled',
+    'results': 'result.added',
+}
+
+# Routing key patterns each work queue receives, * matches one word and # any number.
+QUEUE_BINDINGS = {
+    'requests': ['appointment.created'],
+    'appointment_updates': ['appointment.updated'],
+    'appointment': ['appointment.confirmed'],
+    'appointment_canceled': ['appointment.canceled'],
+    'results': ['result.added'],
+}
+
+
+def routing_key_for(name):
+    return LEGACY_ROUTING_KEYS.get(name, name)
+
+
+def topic_matches(pattern, routing_key):
+    return _match(pattern.split('.'), routing_key.split('.'))
+
+
+def _match(pattern, words):
+    if not pattern:
+        return not words
+    if pattern[0] == '#':
+        return any(_match(pattern[1:], words[i:]) for i in range(len(words) + 1))
+    return bool(words) and pattern[0] in ('*', words[0]) and _match(pattern[1:], words[1:])
+
+
+def subscribers(routing_key):
+    return [queue for queue, patterns in QUEUE_BINDINGS.items() if any(topic_matches(p, routing_key) for p in patterns)]
+
+
+def parking_queue(queue):
+    return f'{queue}.parking'
+
+
+def retry_queue(queue, tier):
+    return f'{queue}.retry.{tier}'
+
+
+def queue_arguments(queue):
+    return {
+        'x-dead-letter-exchange': DEAD_LETTER_EXCHANGE,
+        'x-dead-letter-routing-key': parking_queue(queue),
+    }
+
+
+def declare_exchange(channel):
+    channel.exchange_declare(exchange=settings.RABBITMQ_EXCHANGE, exchange_type='topic', durable=True)
+
+
+def declare_routing(channel, routing_key):
+    """
+    Declare the exchange and every queue subscribed to routing_key, so events published
+    before any consumer started are queued rather than dropped as unroutable.
+    """
+    declare_exchange(channel)
+    for queue in subscribers(routing_key):
+        declare_queue(channel, queue)
+
+
+def declare_queue(channel, queue):
+    channel.exchange_declare(exchange=DEAD_LETTER_EXCHANGE, exchange_type='direct', durable=True)
+    channel.queue_declare(queue=queue, durable=True, arguments=queue_arguments(queue))
+    if queue in QUEUE_BINDINGS:
+        declare_exchange(channel)
+        for pattern in QUEUE_BINDINGS[queue]:
+            channel.queue_bind(queue=queue, exchange=settings.RABBITMQ_EXCHANGE, routing_key=pattern)
+
+    channel.queue_declare(queue=parking_queue(queue), durable=True)
+    channel.queue_bind(queue=parking_queue(queue), exchange=DEAD_LETTER_EXCHANGE, routing_key=parking_queue(queue))
+
+    for tier, delay in enumerate(settings.CONSUMER_RETRY_DELAYS_MS):
+        channel.queue_declare(queue=retry_queue(queue, tier), durable=True, arguments={
+            'x-message-ttl': delay,
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': queue,
+        })
+
+
+def attempts(properties):
+    return int((properties.headers or {}).get(ATTEMPTS_HEADER, 0)) if properties is not None else 0
+
+
+def with_attempts(properties, count):
+    properties = copy.copy(properties) if properties is not None else pika.BasicProperties()
+    headers = dict(properties.headers or {})
+    if count:
+        headers[ATTEMPTS_HEADER] = count
+    else:
+        headers.pop(ATTEMPTS_HEADER, None)
+    properties.headers = headers
+    return properties
+
+
+def next_retry_queue(queue, properties):
+    """
+    Retry queue for the next attempt of a failed message, or None once it has used
+    up CONSUMER_MAX_ATTEMPTS and belongs in the parking queue.
+    """
+    done = attempts(properties) + 1
+    delays = settings.CONSUMER_RETRY_DELAYS_MS
+    if done >= settings.CONSUMER_MAX_ATTEMPTS or not delays:
+        return None
+    return retry_queue(queue, min(done, len(delays)) - 1)
@@ -0,0 +1,144 @@
+"""
+Ranked full-text search over labs.
+
+Every lab stores a search document in Lab.search_vector, weighted from its name
+(A), city and the names of the services it offers (B), address (C) and
+description (D), and backed by a GIN index. The bhealth_search configuration
+folds diacritics with unaccent, so "Cenic" finds "Ćenić".
+
+Typos are caught by trigram word similarity against Lab.search_names, the lab,
+city and service names folded to lowercase ASCII under a pg_trgm GIN index:
+"Sarajvo" is close enough to "sarajevo" within settings.LAB_SEARCH_SIMILARITY.
+The threshold is set on every database connection as it opens.
+Both columns are recomputed in the database from save signals of labs, cities,
+services and lab services, so a search only reads the indexes and ranks. Where
+the database server lacks the unaccent or pg_trgm extension, 0024 skips it and
+search goes without folding or typo matching.
+"""
+from functools import lru_cache
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.lookups import Unaccent
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Func, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce, Concat, Lower
+
+from bhealthapp.models import Lab, LabService
+
+# Fields of a lab its document is built from, saves touching none of them leave it alone.
+LAB_DOCUMENT_FIELDS = {'name', 'city', 'city_id', 'address', 'description'}
+# Full-text matches first, then the closest typo matches.
+SEARCH_ORDERING = ('-rank', '-similarity', 'id')
+
+
+class WordSimilar(Func):
+    """text <% names: text is similar to a run of words in names, pg_trgm's word_similarity_threshold decides."""
+    arg_joiner = ' <%% '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+@lru_cache(maxsize=None)
+def _extensions(database) -> frozenset:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT extname FROM pg_extension')
+        return frozenset(name for (name,) in cursor.fetchall())
+
+
+def has_extension(name) -> bool:
+    """Whether the database has the extension installed, looked up once per process."""
+    return name in _extensions(connection.settings_dict['NAME'])
+
+
+def fold(expression):
+    """Lowercase expression with diacritics removed, as in Lab.search_names."""
+    return Lower(Unaccent(expression)) if has_extension('unaccent') else Lower(expression)
+
+
+def related_names(apps=global_apps):
+    """The city name and the space separated names of the services of each lab row, '' when it has none."""
+    cities = apps.get_model('bhealthapp', 'City').objects
+    lab_services = apps.get_model('bhealthapp', 'LabService').objects
+
+    city = cities.filter(pk=OuterRef('city_id')).values('name')[:1]
+    services = lab_services.filter(lab_service=OuterRef('pk')).values('lab_service').annotate(
+        names=StringAgg('service__name', ' ', output_field=TextField())).values('names')
+    return (Coalesce(Subquery(city), Value(''), output_field=TextField()),
+            Coalesce(Subquery(services), Value(''), output_field=TextField()))
+
+
+def lab_document(apps=global_apps, config=None):
+    """Expression computing the search document of each lab row, also usable with the historical models of a migration."""
+    config = config or settings.LAB_SEARCH_CONFIG
+    city, services = related_names(apps)
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(city, weight='B', config=config)
+        + SearchVector(services, weight='B', config=config)
+        + SearchVector('address', weight='C', config=config)
+        + SearchVector('description', weight='D', config=config)
+    )
+
+
+def lab_names(apps=global_apps):
+    """Expression computing Lab.search_names of each lab row."""
+    city, services = related_names(apps)
+    return fold(Concat('name', Value(' '), city, Value(' '), services, output_field=TextField()))
+
+
+def refresh(lab_ids=None, apps=global_apps, config=None) -> int:
+    """Recompute the documents of the given labs, ids or a queryset of them, or of every lab, returns how many were updated."""
+    labs = apps.get_model('bhealthapp', 'Lab').objects.all()
+    if not any(field.name == 'search_names' for field in labs.model._meta.fields):
+        # Called by 0023_lab_search, 0024_lab_search_folding builds the documents after it.
+        return 0
+    if lab_ids is not None:
+        labs = labs.filter(pk__in=lab_ids)
+    return labs.update(search_vector=lab_document(apps, config), search_names=lab_names(apps))
+
+
+def search_labs(text, queryset=None):
+    """Labs matching text or close to it, best first, annotated with their rank, similarity and a highlighted headline."""
+    config = settings.LAB_SEARCH_CONFIG
+    query = SearchQuery(text, search_type='websearch', config=config)
+    matches = Q(search_vector=query)
+    similarity = Value(0.0, output_field=FloatField())
+    if has_extension('pg_trgm'):
+        folded = fold(Value(text, output_field=TextField()))
+        matches |= Q(WordSimilar(folded, F('search_names')))
+        similarity = Func(folded, F('search_names'), function='word_similarity', output_field=FloatField())
+
+    queryset = Lab.objects.all() if queryset is None else queryset
+    return queryset.filter(matches).annotate(
+        rank=SearchRank(F('search_vector'), query),
+        similarity=similarity,
+        headline=SearchHeadline(Concat('name', Value(' - '), 'address', Value(' - '), 'description'), query,
+                                config=config, start_sel='<b>', stop_sel='</b>', max_words=25, min_words=10),
+    ).order_by(*SEARCH_ORDERING)
+
+
+def set_similarity_threshold(connection):
+    """Have <% on connection match within settings.LAB_SEARCH_SIMILARITY, for the rest of its session."""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        # Kept as a placeholder until pg_trgm loads, so it can be set with or without the extension.
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)",
+                       [str(settings.LAB_SEARCH_SIMILARITY)])
+
+
+def lab_changed(lab, update_fields=None):
+    if update_fields is not None and not LAB_DOCUMENT_FIELDS.intersection(update_fields):
+        return
+    refresh([lab.pk])
+
+
+def labs_of_service_changed(service):
+    refresh(LabService.objects.filter(service=service).values('lab_service'))
+
+
+def labs_of_city_changed(city):
+    refresh(Lab.objects.filter(city=city).values('pk'))
@@ -145,6 +145,17 @@ class LabViewSerializer(serializers.ModelSerializer):
         depth = 1
 
 
+class LabSearchSerializer(LabViewSerializer):
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta(LabViewSerializer.Meta):
+        fields = LabViewSerializer.Meta.fields + [
+            "rank",
+            "headline",
+        ]
+
+
 class LabServiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = LabService
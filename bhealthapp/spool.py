@@ -0,0 +1,242 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from bhealthapp.backpressure import DELAY, SHED
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.seg'
+OFFSET_SUFFIX = '.offset'
+APPEND_LOCK = 'append.lock'
+DRAIN_LOCK = 'drain.lock'
+
+# Starts every record, a drain that meets a damaged one reads on from the next.
+MAGIC = b'BHSP'
+# Magic, CRC32 of everything after it, body length, routing key length, spooled at.
+HEADER = struct.Struct('>4sIIHd')
+# Bytes before the checksummed part.
+CHECKED = len(MAGIC) + 4
+
+_instance = None
+
+
+class Spool:
+    """
+    Append-only store for messages the broker could not take. Records go to numbered
+    segment files that rotate at segment_bytes; the drainer seals the active segment,
+    replays the sealed ones in order through mmap and deletes each once it is sent.
+    Appends and drains are serialised with flock so every process of a host can share
+    one directory. Records are checksummed: a process starts a new segment with its
+    first append, so nothing it writes lands behind a record torn by a crash, and the
+    drain skips to the next intact record past one that does not check out.
+    """
+
+    def __init__(self, directory=None, segment_bytes=None, fsync=None):
+        self.directory = directory or settings.SPOOL_DIR
+        self.segment_bytes = segment_bytes or settings.SPOOL_SEGMENT_BYTES
+        self.fsync = settings.SPOOL_FSYNC if fsync is None else fsync
+        self.pid = None
+
+    def append(self, routing_key: str, body) -> None:
+        if isinstance(body, str):
+            body = body.encode()
+        key = routing_key.encode()
+        record = HEADER.pack(MAGIC, 0, len(body), len(key), time.time())[CHECKED:] + key + body
+        record = MAGIC + zlib.crc32(record).to_bytes(4, 'big') + record
+
+        with self._file_lock(APPEND_LOCK):
+            if self.pid != os.getpid():
+                # The last segment may end in a record torn by a crashed process.
+                self.pid = os.getpid()
+                path = self._new_segment(self.segments())
+            else:
+                path = self._active_segment()
+            with open(path, 'ab') as segment:
+                segment.write(record)
+                segment.flush()
+                if self.fsync:
+                    os.fsync(segment.fileno())
+
+    def drain(self, publisher) -> int:
+        """
+        Publish every spooled message in the order it was appended, returns how many were
+        sent. A failed publish stops the drain and the next one resumes at that message.
+        Messages the publisher delays stay where they are for the next drain, along with
+        every later one of their routing key, while the messages around them are sent;
+        the ones it sheds are dropped.
+        """
+        with self._file_lock(DRAIN_LOCK, blocking=False) as acquired:
+            if not acquired:
+                return 0
+
+            with self._file_lock(APPEND_LOCK):
+                self._seal()
+
+            sent = 0
+            delayed = set()
+            for name in self.segments()[:-1]:
+                sent += self._drain_segment(os.path.join(self.directory, name), publisher, delayed)
+            return sent
+
+    def segments(self) -> list:
+        try:
+            return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        except FileNotFoundError:
+            return []
+
+    def stats(self) -> dict:
+        pending_bytes = 0
+        pending_segments = 0
+        oldest = None
+        for name in self.segments():
+            path = os.path.join(self.directory, name)
+            offset = self._read_offset(path)
+            size = os.path.getsize(path)
+            if size <= offset:
+                continue
+            pending_bytes += size - offset
+            pending_segments += 1
+            if oldest is None:
+                with open(path, 'rb') as segment:
+                    segment.seek(offset)
+                    header = segment.read(HEADER.size)
+                if len(header) == HEADER.size and header.startswith(MAGIC):
+                    oldest = HEADER.unpack(header)[4]
+
+        return {
+            'segments': pending_segments,
+            'bytes': pending_bytes,
+            'oldest_age_seconds': time.time() - oldest if oldest is not None else 0.0,
+        }
+
+    def _active_segment(self):
+        segments = self.segments()
+        if segments:
+            path = os.path.join(self.directory, segments[-1])
+            if os.path.getsize(path) < self.segment_bytes:
+                return path
+        return self._new_segment(segments)
+
+    def _new_segment(self, segments):
+        if segments and not os.path.getsize(os.path.join(self.directory, segments[-1])):
+            return os.path.join(self.directory, segments[-1])
+        number = int(segments[-1][:-len(SEGMENT_SUFFIX)]) + 1 if segments else 1
+        path = os.path.join(self.directory, f'{number:012d}{SEGMENT_SUFFIX}')
+        open(path, 'ab').close()
+        return path
+
+    def _seal(self):
+        # Start an empty segment so every earlier one is closed for appends.
+        segments = self.segments()
+        if segments and os.path.getsize(os.path.join(self.directory, segments[-1])) > 0:
+            self._new_segment(segments)
+
+    def _drain_segment(self, path, publisher, delayed):
+        # The offset stops at the first delayed record, the records after it that are done
+        # are kept as start: end in done.
+        offset, done = self._read_position(path)
+        size = os.path.getsize(path)
+        sent = 0
+
+        if offset < size:
+            with open(path, 'rb') as segment, mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                position = offset
+                try:
+                    while position < size:
+                        end = done.get(position)
+                        record = read_record(data, position, size) if end is None else None
+                        if end is None and record is None:
+                            # Torn or damaged, carry on from the next record that checks out.
+                            end = resync(data, position, size)
+                            logger.error('Discarding %s unreadable bytes at %s of %s', end - position, position, path)
+                        elif end is None:
+                            start, end, key_length = record
+                            routing_key = data[start:start + key_length].decode()
+                            # A routing key delayed once waits for the next drain, so its messages keep their order.
+                            decision = DELAY if routing_key in delayed else publisher.admit(routing_key)
+                            if decision == DELAY:
+                                delayed.add(routing_key)
+                                position = end
+                                continue
+                            if decision != SHED:
+                                publisher.publish(routing_key, data[start + key_length:end])
+                                sent += 1
+                        if offset < position:
+                            done[position] = end
+                        else:
+                            offset = end
+                        position = end
+                finally:
+                    if offset < size:
+                        self._write_position(path, offset, done)
+
+        if offset < size:
+            return sent
+        os.remove(path)
+        if os.path.exists(path + OFFSET_SUFFIX):
+            os.remove(path + OFFSET_SUFFIX)
+        return sent
+
+    def _read_offset(self, path):
+        return self._read_position(path)[0]
+
+    def _read_position(self, path):
+        try:
+            with open(path + OFFSET_SUFFIX) as position:
+                offset, *done = position.read().split() or ['0']
+        except FileNotFoundError:
+            return 0, {}
+        return int(offset), dict(map(int, span.split(':')) for span in done)
+
+    def _write_position(self, path, offset, done):
+        with open(path + OFFSET_SUFFIX + '.tmp', 'w') as tmp:
+            tmp.write(' '.join([str(offset)] + [f'{start}:{end}' for start, end in sorted(done.items()) if start >= offset]))
+        os.replace(path + OFFSET_SUFFIX + '.tmp', path + OFFSET_SUFFIX)
+
+    @contextmanager
+    def _file_lock(self, name, blocking=True):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_record(data, offset, size):
+    """(start of the routing key, end, routing key length) of an intact record at offset, None for anything else."""
+    if offset + HEADER.size > size:
+        return None
+    magic, crc, body_length, key_length, _ = HEADER.unpack_from(data, offset)
+    end = offset + HEADER.size + key_length + body_length
+    if magic != MAGIC or end > size or zlib.crc32(data[offset + CHECKED:end]) != crc:
+        return None
+    return offset + HEADER.size, end, key_length
+
+
+def resync(data, offset, size) -> int:
+    """Where the first intact record after offset starts, size if there is none."""
+    position = data.find(MAGIC, offset + 1)
+    while position != -1 and read_record(data, position, size) is None:
+        position = data.find(MAGIC, position + 1)
+    return size if position == -1 else position
+
+
+def get_spool() -> Spool:
+    global _instance
+    if _instance is None:
+        _instance = Spool()
+    return _instance
@@ -0,0 +1,118 @@
+import logging
+import multiprocessing
+import signal
+import time
+from queue import Empty
+
+from django.conf import settings
+from django.db import connections
+
+from bhealthapp import metrics
+from bhealthapp.consumer import Consumer
+
+logger = logging.getLogger(__name__)
+
+
+def run_consumer(consumer_options, stats=None, index=0):
+    """
+    Run one Consumer until SIGTERM, then finish in-flight messages and report
+    how many messages this process handled. Each process serves its metrics on
+    CONSUMER_METRICS_PORT plus its index.
+    """
+    if settings.CONSUMER_METRICS_PORT is not None:
+        metrics.serve(settings.CONSUMER_METRICS_PORT + index)
+
+    apt_consumer = Consumer(**consumer_options)
+    signal.signal(signal.SIGTERM, lambda signum, frame: apt_consumer.stop())
+
+    started = time.monotonic()
+    apt_consumer.start()
+
+    report = {
+        'index': index,
+        'pid': multiprocessing.current_process().pid,
+        'processed': apt_consumer.processed,
+        'failed': apt_consumer.failed,
+        'seconds': time.monotonic() - started,
+    }
+    if stats is not None:
+        stats.put(report)
+    return report
+
+
+def _run_child(consumer_options, stats, index):
+    # The parent forwards Ctrl+C as SIGTERM, so children only react to SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_consumer(consumer_options, stats, index)
+
+
+class ConsumerSupervisor:
+    """
+    Forks a fixed number of consumer processes, restarts the ones that crash and
+    stops all of them gracefully on SIGTERM or SIGINT.
+    """
+
+    def __init__(self, processes, consumer_options, restart_delay=1.0, shutdown_timeout=60.0):
+        self.processes = processes
+        self.consumer_options = consumer_options
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.context = multiprocessing.get_context('fork')
+        self.stats = self.context.Queue()
+        self.children = {}
+        self.restarts = 0
+        self._running = False
+
+    def run(self):
+        self._running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for index in range(self.processes):
+            self._spawn(index)
+
+        while self._running:
+            time.sleep(self.restart_delay)
+            self._restart_crashed()
+
+        return self._shutdown()
+
+    def stop(self, signum=None, frame=None):
+        self._running = False
+
+    def _spawn(self, index):
+        # Children must open their own DB connections instead of sharing the parent's sockets.
+        connections.close_all()
+        child = self.context.Process(
+            target=_run_child, args=(self.consumer_options, self.stats, index), name=f'consumer-{index}')
+        child.start()
+        self.children[index] = child
+
+    def _restart_crashed(self):
+        for index, child in list(self.children.items()):
+            if self._running and not child.is_alive():
+                logger.warning('Consumer %s (pid %s) exited with %s, restarting', index, child.pid, child.exitcode)
+                self.restarts += 1
+                self._spawn(index)
+
+    def _shutdown(self):
+        for child in self.children.values():
+            if child.is_alive():
+                child.terminate()
+
+        reports = []
+        deadline = time.monotonic() + self.shutdown_timeout
+        while len(reports) < len(self.children) and time.monotonic() < deadline:
+            try:
+                reports.append(self.stats.get(timeout=0.5))
+            except Empty:
+                if not any(child.is_alive() for child in self.children.values()):
+                    break
+
+        for child in self.children.values():
+            child.join(max(0.0, deadline - time.monotonic()))
+            if child.is_alive():
+                logger.error('Consumer %s did not stop in time, killing it', child.name)
+                child.kill()
+
+        return sorted(reports, key=lambda report: report['index'])
@@ -5,7 +5,9 @@ from PIL import Image
 from django.core.files.base import ContentFile
 from django.http import HttpResponse
 
-from bhealthapp.rmq_send_message import send_messages
+from bhealthapp import dedupe
+from bhealthapp.background_publisher import enqueue
+from bhealthapp.envelope import Envelope
 
 today = date.today()
 
@@ -15,38 +17,43 @@ from bhealthapp.models import User
 
 @shared_task
 def upload_pdf(appointment_id):
-    send_messages('results', {'appointment_id': appointment_id})
+    enqueue(Envelope.new('result.added', {'appointment_id': appointment_id}))
     return "Done"
 
 
 @shared_task
 def send_request_notification(appointment_id):
-    send_messages('requests', {'appointment_id': appointment_id})
+    enqueue(Envelope.new('appointment.created', {'appointment_id': appointment_id}))
 
     return "Done"
 
 
 @shared_task
 def request_updated(appointment_id):
-    send_messages('appointment_updates', {'appointment_id': appointment_id})
+    enqueue(Envelope.new('appointment.updated', {'appointment_id': appointment_id}))
 
     return "Done"
 
 
 @shared_task
 def send_appointment_message(appointment_id):
-    send_messages('appointment', {'appointment_id': appointment_id})
+    enqueue(Envelope.new('appointment.confirmed', {'appointment_id': appointment_id}))
 
     return "Done"
 
 
 @shared_task
 def send_appointment_canceled_message(appointment_id):
-    send_messages('appointment_canceled', {'appointment_id': appointment_id})
+    enqueue(Envelope.new('appointment.canceled', {'appointment_id': appointment_id}))
 
     return "Done"
 
 
+@shared_task
+def prune_processed_messages():
+    return dedupe.prune_processed_messages()
+
+
 @shared_task
 def resize_profile_picture(user_id):
     try:
@@ -0,0 +1,198 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from bhealthapp import autocomplete
+from bhealthapp.autocomplete import Autocomplete, PrefixIndex, fold, get_autocomplete
+from bhealthapp.benchmarks.data import create_appointment, create_city, create_lab, create_patient, create_service
+from bhealthapp.models import Appointment
+
+ENTRIES = [
+    (3, 'lab', 1, 'Hormone Lab'),
+    (9, 'city', 2, 'Mostar'),
+    (5, 'lab', 3, 'Ćenić Dijagnostika'),
+    (7, 'service', 4, 'Thyroid panel - hormones'),
+]
+
+
+class PrefixIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex(ENTRIES, limit=3)
+
+    def test_fold(self):
+        self.assertEqual(fold('Đurić-Ćenić'), 'duric cenic')
+        self.assertEqual(fold('  Dr.  Hajdarević '), 'dr hajdarevic')
+        self.assertEqual(fold('ŽELJEZNIČKA'), 'zeljeznicka')
+
+    def test_matches_the_start_of_any_word(self):
+        self.assertEqual(self.index.lookup('mos'), [('city', 2, 'Mostar')])
+        self.assertEqual(self.index.lookup('pan'), [('service', 4, 'Thyroid panel - hormones')])
+        self.assertEqual(self.index.lookup('thyroid panel h'), [('service', 4, 'Thyroid panel - hormones')])
+        self.assertEqual(self.index.lookup('Dijagnostika'), [('lab', 3, 'Ćenić Dijagnostika')])
+        self.assertEqual(self.index.lookup('ostar'), [])
+        self.assertEqual(self.index.lookup(' -  '), [])
+
+    def test_folds_the_typed_text(self):
+        self.assertEqual(self.index.lookup('cenic'), [('lab', 3, 'Ćenić Dijagnostika')])
+        self.assertEqual(self.index.lookup('ĆEN'), [('lab', 3, 'Ćenić Dijagnostika')])
+
+    def test_most_popular_first(self):
+        self.assertEqual(self.index.lookup('hormo'), [('service', 4, 'Thyroid panel - hormones'), ('lab', 1, 'Hormone Lab')])
+        self.assertEqual(self.index.lookup('hormo', limit=1), [('service', 4, 'Thyroid panel - hormones')])
+        self.assertEqual(len(PrefixIndex(ENTRIES, limit=1).lookup('hormo', limit=50)), 1)
+
+    @mock.patch('bhealthapp.autocomplete.SCAN_LIMIT', 8)
+    def test_crowded_prefixes_are_precomputed(self):
+        names = [f'{first}{second} {third}'
+                 for first in 'abc' for second in 'abcdef' for third in ('lab', 'centar', 'poliklinika')]
+        index = PrefixIndex([(len(names) - i, 'lab', i, name) for i, name in enumerate(names)], limit=5)
+        self.assertIn('a', index.top)
+        self.assertNotIn('aa', index.top)
+
+        for prefix in ['a', 'b', 'ab', 'c', 'ce', 'cen', 'l', 'la', 'p', 'po', 'ba p', 'x']:
+            expected = [(kind, pk, name) for _, kind, pk, name in sorted(
+                (len(names) - i, 'lab', i, name) for i, name in enumerate(names)
+                if any(word.startswith(prefix) for word in [' '.join(name.split()[start:]) for start in range(2)])
+            )[::-1]][:5]
+            self.assertEqual(index.lookup(prefix), expected, prefix)
+
+
+class AutocompleteTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.mostar = create_city(name='Mostar', postal_code=88000)
+        create_city(name='Tuzla', postal_code=75000)
+        self.busy = create_lab(city=self.mostar, name='Mostar Dijagnostika', email='busy@example.com')
+        self.rated = create_lab(city=self.mostar, name='Mostarska Poliklinika', email='rated@example.com')
+        self.rated.average_rating = 5
+        self.rated.save()
+        self.thyroid = create_service(name='Thyroid panel', lab=self.busy)
+        self.patient = create_patient(city=self.mostar)
+        for _ in range(2):
+            create_appointment(lab=self.busy, service=self.thyroid, patient=self.patient)
+        create_appointment(lab=self.rated, service=self.thyroid, patient=self.patient, status=Appointment.STATUS_CANCELED)
+
+    def names(self, text, **kwargs):
+        index = Autocomplete()
+        index.rebuild()
+        return [(kind, name) for kind, _, name in index.suggest(text, **kwargs)]
+
+    def test_weighted_by_appointments_and_rating(self):
+        # Mostar has the two appointments of its labs, Mostar Dijagnostika two and Mostarska Poliklinika its rating.
+        self.assertEqual(self.names('most'), [
+            ('city', 'Mostar'), ('lab', 'Mostar Dijagnostika'), ('lab', 'Mostarska Poliklinika')])
+        self.assertEqual(self.names('labor'), [('type', 'Laboratory')])
+        self.assertEqual(self.names('thy'), [('service', 'Thyroid panel')])
+        # Cities without a lab are not suggested.
+        self.assertEqual(self.names('tuz'), [])
+
+    def test_lookups_do_not_query(self):
+        index = Autocomplete()
+        index.rebuild()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(index.suggest('m')), 3)
+            self.assertEqual(index.suggest('x'), [])
+
+    def test_catalog_changes_bump_the_version(self):
+        index = Autocomplete()
+        index.rebuild()
+        self.assertFalse(index.stale())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.busy.name = 'Tuzla Dijagnostika'
+            self.busy.save()
+        self.assertTrue(index.stale())
+        self.assertEqual([name for _, _, name in index.suggest('tuz')], [])
+
+        index.rebuild()
+        self.assertFalse(index.stale())
+        self.assertEqual([name for _, _, name in index.suggest('tuz')], ['Tuzla Dijagnostika'])
+
+    def test_ratings_and_unchanged_names_keep_the_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rated.average_rating = 4
+            self.rated.save()
+            self.rated.save(update_fields=['average_rating'])
+            self.mostar.save()
+            self.thyroid.name = 'Ferritin'
+            self.thyroid.save(update_fields=['duration'])
+        self.assertIsNone(cache.get(autocomplete.VERSION_KEY))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thyroid.save()
+        self.assertEqual(cache.get(autocomplete.VERSION_KEY), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thyroid.save()
+            create_city(name='Zenica', postal_code=72000)
+        self.assertEqual(cache.get(autocomplete.VERSION_KEY), 2)
+
+    @override_settings(AUTOCOMPLETE_MAX_AGE=0)
+    def test_old_index_is_stale(self):
+        index = Autocomplete()
+        index.rebuild()
+        self.assertTrue(index.stale())
+
+    def test_autocomplete_view(self):
+        get_autocomplete().rebuild()
+
+        with self.assertNumQueries(0):
+            response = APIClient().get(reverse('autocomplete'), {'q': 'most', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'kind': 'city', 'id': self.mostar.id, 'name': 'Mostar'},
+            {'kind': 'lab', 'id': self.busy.id, 'name': 'Mostar Dijagnostika'},
+        ])
+
+        self.assertEqual(APIClient().get(reverse('autocomplete'), {'q': ''}).data['results'], [])
+        self.assertEqual(APIClient().get(reverse('autocomplete'), {'q': 'most', 'limit': 0}).status_code, 400)
+
+
+@override_settings(AUTOCOMPLETE_CHECK_SECONDS=0.01)
+class AutocompleteRebuildTest(TransactionTestCase):
+
+    def names(self, index, text, count):
+        deadline = time.monotonic() + 5
+        while len(index.suggest(text)) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return [name for _, _, name in index.suggest(text)]
+
+    def test_built_in_the_background(self):
+        cache.clear()
+        create_lab(name='Cardio Centar')
+        index = Autocomplete()
+        self.addCleanup(index.stop, 5)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(index.suggest('car'), [])
+        self.assertEqual(self.names(index, 'car', 1), ['Cardio Centar'])
+
+        create_lab(name='Cardiology Tuzla', email='tuzla@example.com')
+        self.assertEqual(self.names(index, 'car', 2), ['Cardio Centar', 'Cardiology Tuzla'])
+
+    def test_warm_up(self):
+        create_lab(name='Cardio Centar')
+        autocomplete._instance = None
+        self.addCleanup(setattr, autocomplete, '_instance', None)
+        autocomplete.warm_up()
+        self.addCleanup(get_autocomplete().stop, 5)
+
+        self.assertEqual(self.names(get_autocomplete(), 'car', 1), ['Cardio Centar'])
+
+    def test_forked_worker_keeps_the_index(self):
+        create_lab(name='Cardio Centar')
+        parent = autocomplete._instance = Autocomplete()
+        self.addCleanup(setattr, autocomplete, '_instance', None)
+        parent.rebuild()
+
+        with mock.patch('bhealthapp.autocomplete.os.getpid', return_value=parent.pid + 1):
+            child = get_autocomplete()
+        self.addCleanup(child.stop, 5)
+        self.assertIsNot(child, parent)
+        self.assertIs(child.index, parent.index)
+        self.assertIsNotNone(child.thread)
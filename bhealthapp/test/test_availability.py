@@ -0,0 +1,114 @@
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from bhealthapp.availability import available_slots, cache_key, free_starts, merge_intervals
+from bhealthapp.benchmarks.data import create_appointment, create_lab, create_patient, create_service
+from bhealthapp.models import Appointment, Lab
+
+MONDAY = date(2030, 1, 7)
+
+
+def at(hour, minute=0, day=MONDAY):
+    return timezone.make_aware(datetime(day.year, day.month, day.day, hour, minute))
+
+
+class IntervalTest(SimpleTestCase):
+
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([(5, 7), (0, 2), (1, 3), (3, 4), (8, 9)]), [[0, 4], [5, 7], [8, 9]])
+
+    def test_free_starts_fit_between_busy_intervals(self):
+        busy = [[10, 20], [25, 30], [45, 60]]
+        self.assertEqual(list(free_starts(busy, 0, 60, length=5, step=5)), [0, 5, 20, 30, 35, 40])
+        self.assertEqual(list(free_starts(busy, 0, 60, length=10, step=5)), [0, 30, 35])
+        self.assertEqual(list(free_starts(busy, 0, 60, length=5, step=5, not_before=32)), [35, 40])
+
+
+@override_settings(LAB_OPENING_HOUR=8, LAB_CLOSING_HOUR=10, AVAILABILITY_SLOT_MINUTES=30, TIME_ZONE='UTC')
+class AvailabilityTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lab = create_lab()
+        self.service = create_service(lab=self.lab, duration=timedelta(minutes=30))
+        self.long_service = create_service(name='MRI', duration=timedelta(minutes=60))
+        self.patient = create_patient(city=self.lab.city)
+
+    def book(self, start, service=None, status=Appointment.STATUS_PENDING):
+        return create_appointment(lab=self.lab, service=service or self.service, patient=self.patient, date=start,
+                                  status=status)
+
+    def starts(self, duration=timedelta(minutes=30), end=MONDAY):
+        return [start for start, _ in available_slots(self.lab.id, duration, MONDAY, end)]
+
+    def test_slots_skip_bookings_but_not_canceled_ones(self):
+        self.book(at(8, 30), service=self.long_service)
+        self.book(at(8), status=Appointment.STATUS_CANCELED)
+
+        self.assertEqual(self.starts(), [at(8), at(9, 30)])
+        self.assertEqual(self.starts(timedelta(minutes=60)), [])
+
+    def test_weekends_have_no_slots(self):
+        sunday = MONDAY + timedelta(days=6)
+        self.assertEqual([start.date() for start in self.starts(end=sunday)][-1], MONDAY + timedelta(days=4))
+
+    def test_one_query_for_the_range_then_cached(self):
+        self.book(at(9))
+        version = Lab.objects.get(pk=self.lab.pk).availability_version
+        with self.assertNumQueries(1):
+            available_slots(self.lab.id, timedelta(minutes=30), MONDAY, MONDAY + timedelta(days=27), version)
+        with self.assertNumQueries(0):
+            available_slots(self.lab.id, timedelta(minutes=30), MONDAY, MONDAY + timedelta(days=27), version)
+        # Reading the version takes one more.
+        with self.assertNumQueries(1):
+            self.starts(end=MONDAY + timedelta(days=27))
+
+    def test_booking_invalidates_cached_days(self):
+        self.assertEqual(len(self.starts()), 4)
+
+        appointment = self.book(at(9))
+        self.assertEqual(self.starts(), [at(8), at(8, 30), at(9, 30)])
+
+        appointment.date = at(9, day=MONDAY + timedelta(days=1))
+        appointment.save()
+        self.assertEqual(len(self.starts()), 4)
+
+        # Saves that leave the booking as it was keep the cached days.
+        version = Lab.objects.get(pk=self.lab.pk).availability_version
+        Appointment.objects.get(pk=appointment.pk).save()
+        self.assertEqual(Lab.objects.get(pk=self.lab.pk).availability_version, version)
+
+    def test_invalidation_reaches_other_processes(self):
+        self.assertEqual(len(self.starts()), 4)
+        stale = cache.get_many([cache_key(self.lab.id, 0, MONDAY)])
+
+        self.book(at(9))
+        # The other process still has the day cached, under a version no lookup asks for any more.
+        cache.set_many(stale)
+        self.assertEqual(self.starts(), [at(8), at(8, 30), at(9, 30)])
+
+    @override_settings(LAB_OPENING_HOUR=0)
+    def test_bookings_from_the_day_before(self):
+        self.book(at(23, 30, day=MONDAY - timedelta(days=1)), service=self.long_service)
+
+        self.assertEqual(self.starts()[0], at(0, 30))
+
+    def test_api(self):
+        self.book(at(8))
+        response = APIClient().get(reverse('availability'), {
+            'lab': self.lab.id, 'service': self.long_service.id, 'start': MONDAY.isoformat()})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([slot['start'] for slot in response.data['slots']], [at(8, 30), at(9)])
+
+    def test_api_rejects_long_ranges(self):
+        response = APIClient().get(reverse('availability'), {
+            'lab': self.lab.id, 'service': self.service.id, 'start': '2030-01-01', 'end': '2030-06-01'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
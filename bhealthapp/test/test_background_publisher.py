@@ -0,0 +1,141 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, TransactionTestCase
+
+from bhealthapp.background_publisher import BackgroundPublisher, get_background_publisher
+from bhealthapp.backpressure import DELAY, SHED
+from bhealthapp.envelope import Envelope, decode
+from bhealthapp.models import Outbox
+from bhealthapp.outbox import envelope_for
+
+
+class BackgroundPublisherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.spool = mock.Mock()
+        self.publisher = mock.Mock()
+
+    def _background(self, **kwargs):
+        options = dict(max_size=1, overflow='spill', block_timeout=0, spool=self.spool, publisher=self.publisher)
+        options.update(kwargs)
+        return BackgroundPublisher(**options)
+
+    def _spooled(self):
+        return [(call.args[0], decode(call.args[1]).payload) for call in self.spool.append.call_args_list]
+
+    def test_publishes_from_background_thread(self):
+        published = threading.Event()
+        self.publisher.publish.side_effect = lambda *args: published.set()
+        background = self._background()
+        background.start()
+
+        envelope = Envelope.new('requests', {'appointment_id': 1})
+        self.assertTrue(background.enqueue(envelope))
+
+        self.assertTrue(published.wait(5))
+        background.stop(timeout=5)
+        routing_key, body = self.publisher.publish.call_args.args
+        self.assertEqual((routing_key, decode(body)), ('requests', envelope))
+
+    def test_full_queue_spills_to_spool(self):
+        background = self._background()
+        background.enqueue(Envelope.new('requests', {'appointment_id': 1}))
+
+        self.assertFalse(background.enqueue(Envelope.new('requests', {'appointment_id': 2})))
+
+        self.assertEqual(self._spooled(), [('requests', {'appointment_id': 2})])
+
+    def test_full_queue_drops(self):
+        background = self._background(overflow='drop')
+        background.enqueue(Envelope.new('requests', {'appointment_id': 1}))
+
+        self.assertFalse(background.enqueue(Envelope.new('requests', {'appointment_id': 2})))
+
+        self.assertEqual(background.dropped, 1)
+        self.spool.append.assert_not_called()
+
+    def test_outbox_messages_are_not_spilled(self):
+        background = self._background()
+        background.enqueue(Envelope.new('requests', {'appointment_id': 1}))
+
+        background.enqueue(Envelope.new('requests', {'appointment_id': 2}), outbox_id=7)
+
+        self.spool.append.assert_not_called()
+
+    def test_stop_spills_what_was_not_published(self):
+        background = self._background(max_size=10)
+        for appointment_id in (1, 2):
+            background.enqueue(Envelope.new('results', {'appointment_id': appointment_id}))
+
+        # The thread never started, so everything still queued goes to disk.
+        background.stop(timeout=0)
+
+        self.assertEqual(self._spooled(), [('results', {'appointment_id': 1}), ('results', {'appointment_id': 2})])
+        self.publisher.close.assert_called_once_with()
+
+    def test_broker_failure_spools_without_retrying_each_message(self):
+        background = self._background(max_size=10)
+        self.publisher.publish.side_effect = ConnectionError
+
+        for appointment_id in (1, 2):
+            background._publish((Envelope.new('results', {'appointment_id': appointment_id}), None))
+
+        self.assertEqual(self.publisher.publish.call_count, 1)
+        self.assertEqual(len(self._spooled()), 2)
+
+    def test_throttled_events_are_spooled_or_shed(self):
+        background = self._background(max_size=10)
+        self.publisher.admit.return_value = DELAY
+        self.assertFalse(background._publish((Envelope.new('appointment.updated', {'appointment_id': 1}), None)))
+
+        self.publisher.admit.return_value = SHED
+        self.assertTrue(background._publish((Envelope.new('appointment.updated', {'appointment_id': 2}), 7)))
+
+        self.publisher.publish.assert_not_called()
+        self.assertEqual(self._spooled(), [('appointment.updated', {'appointment_id': 1})])
+        self.assertEqual(background.shed, 1)
+
+    def test_thread_survives_failing_spool_and_publisher(self):
+        self.spool.append.side_effect = [OSError('No space left on device'), ValueError, ValueError, None]
+        self.publisher.admit.return_value = DELAY
+        background = self._background(max_size=10)
+        for appointment_id in (1, 2, 3):
+            background.enqueue(Envelope.new('results', {'appointment_id': appointment_id}))
+
+        with self.assertLogs('bhealthapp.background_publisher', 'ERROR'):
+            background.start()
+            background.stop(timeout=5)
+
+        self.assertEqual((background.dropped, background.spilled), (1, 1))
+        self.assertEqual(self._spooled()[-1], ('results', {'appointment_id': 3}))
+
+    def test_dead_thread_is_restarted(self):
+        background = self._background(max_size=10)
+        background.start()
+        background.stop(timeout=5)
+        self.assertFalse(background.thread.is_alive())
+
+        with mock.patch('bhealthapp.background_publisher._instance', background), \
+                self.assertLogs('bhealthapp.background_publisher', 'ERROR'):
+            self.assertIs(get_background_publisher(), background)
+        self.addCleanup(background.stop, 5)
+        self.assertTrue(background.thread.is_alive())
+
+
+class BackgroundPublisherOutboxTest(TransactionTestCase):
+
+    def test_deletes_published_outbox_rows_together(self):
+        events = [Outbox.objects.create(routing_key='result.added', payload={'appointment_id': i}) for i in range(3)]
+        publisher = mock.Mock()
+        background = BackgroundPublisher(max_size=10, spool=mock.Mock(), publisher=publisher)
+        for event in events:
+            background.enqueue(envelope_for(event), outbox_id=event.pk)
+
+        with mock.patch.object(Outbox.objects, 'filter', wraps=Outbox.objects.filter) as outbox_filter:
+            background.start()
+            background.stop(timeout=5)
+
+        self.assertEqual(publisher.publish.call_count, 3)
+        self.assertFalse(Outbox.objects.exists())
+        outbox_filter.assert_called_once_with(pk__in=[event.pk for event in events])
@@ -0,0 +1,83 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from bhealthapp import memory_broker
+from bhealthapp.backpressure import DELAY, PUBLISH, SHED, Backpressure
+from bhealthapp.rmq_send_message import Publisher
+
+
+class BackpressureTest(SimpleTestCase):
+
+    def setUp(self):
+        self.channel = mock.Mock()
+        self.set_depth(0)
+        self.backpressure = Backpressure(high_watermark=100, low_watermark=10, depth_ttl=0)
+
+    def set_depth(self, depth):
+        self.channel.queue_declare.return_value.method.message_count = depth
+
+    def test_critical_events_are_always_published(self):
+        self.set_depth(1000)
+
+        self.assertEqual(self.backpressure.decide(self.channel, 'result.added'), PUBLISH)
+        self.channel.queue_declare.assert_not_called()
+
+    def test_throttles_between_watermarks(self):
+        decisions = []
+        for depth in (50, 100, 50, 10):
+            self.set_depth(depth)
+            decisions.append(self.backpressure.decide(self.channel, 'appointment.updated'))
+
+        self.assertEqual(decisions, [PUBLISH, DELAY, DELAY, PUBLISH])
+        self.channel.queue_declare.assert_called_with(queue='appointment_updates', durable=True, passive=True)
+
+    def test_caches_depth(self):
+        backpressure = Backpressure(high_watermark=100, low_watermark=10, depth_ttl=60)
+        for _ in range(3):
+            backpressure.decide(self.channel, 'appointment.updated')
+
+        self.assertEqual(self.channel.queue_declare.call_count, 1)
+
+    def test_blocked_connection_throttles_without_polling(self):
+        self.backpressure.on_blocked()
+        self.assertEqual(self.backpressure.decide(self.channel, 'appointment.updated'), DELAY)
+        self.channel.queue_declare.assert_not_called()
+
+        self.backpressure.on_unblocked()
+        self.assertEqual(self.backpressure.decide(self.channel, 'appointment.updated'), PUBLISH)
+
+    @override_settings(PUBLISH_EVENT_POLICIES={'appointment.updated': SHED})
+    def test_policy_override(self):
+        self.set_depth(1000)
+        self.assertEqual(self.backpressure.decide(self.channel, 'appointment.updated'), SHED)
+
+    def test_zero_high_watermark_disables_throttling(self):
+        self.set_depth(1000)
+        self.assertEqual(Backpressure(high_watermark=0).decide(self.channel, 'appointment.updated'), PUBLISH)
+
+
+@override_settings(RABBITMQ_TRANSPORT='memory', BACKPRESSURE_HIGH_WATERMARK=2, BACKPRESSURE_LOW_WATERMARK=0,
+                   BACKPRESSURE_DEPTH_TTL_SECONDS=0)
+class PublisherBackpressureTest(SimpleTestCase):
+
+    def setUp(self):
+        memory_broker.reset()
+        self.publisher = Publisher()
+
+    def test_admit_reads_depth_from_broker(self):
+        self.assertEqual(self.publisher.admit('appointment_updates'), PUBLISH)
+        self.publisher.publish('appointment_updates', b'1')
+        self.publisher.publish('appointment_updates', b'2')
+
+        self.assertEqual(self.publisher.admit('appointment_updates'), DELAY)
+        self.assertEqual(self.publisher.admit('results'), PUBLISH)
+
+    def test_follows_broker_flow_control(self):
+        self.assertEqual(self.publisher.admit('appointment.updated'), PUBLISH)
+
+        memory_broker.get_broker().block()
+        self.assertEqual(self.publisher.admit('appointment.updated'), DELAY)
+
+        memory_broker.get_broker().unblock()
+        self.assertEqual(self.publisher.admit('appointment.updated'), PUBLISH)
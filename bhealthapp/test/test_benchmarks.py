@@ -0,0 +1,12 @@
+from django.test import SimpleTestCase
+
+from bhealthapp.benchmarks import publisher
+
+
+class PublisherBenchmarkTest(SimpleTestCase):
+
+    def test_runs_against_the_stand_in_broker(self):
+        for confirm_delivery in (False, True):
+            results = dict(publisher.run(messages=5, round_trip_ms=0, confirm_delivery=confirm_delivery))
+            self.assertEqual(set(results), {'per-call connection', 'pooled publisher', 'speedup'})
+            self.assertGreater(results['pooled publisher'], 0)
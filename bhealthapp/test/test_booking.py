@@ -0,0 +1,128 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from bhealthapp import booking
+from bhealthapp.benchmarks.data import create_lab, create_patient, create_service
+from bhealthapp.booking import SlotTaken, book_appointment
+from bhealthapp.models import Appointment
+from bhealthapp.test.test_availability import MONDAY, at
+
+
+class BookingTest(TestCase):
+
+    def setUp(self):
+        self.lab = create_lab()
+        self.service = create_service(lab=self.lab, duration=timedelta(minutes=30))
+        self.patient = create_patient(city=self.lab.city)
+
+    def book(self, start):
+        return book_appointment(self.lab, self.service, self.patient, start)
+
+    def test_overlapping_booking_is_refused(self):
+        self.book(at(9))
+
+        for start in (at(9), at(8, 45), at(9, 15)):
+            with self.assertRaises(SlotTaken):
+                self.book(start)
+        self.book(at(8, 30))
+        self.book(at(9, 30))
+
+    def test_canceled_appointment_frees_its_slot(self):
+        appointment = self.book(at(9))
+        appointment.status = Appointment.STATUS_CANCELED
+        appointment.save(update_fields=['status'])
+
+        self.book(at(9))
+
+    def test_other_labs_are_independent(self):
+        self.book(at(9))
+        book_appointment(create_lab(city=self.lab.city, name='Other'), self.service, self.patient, at(9))
+
+    def test_view_answers_conflict(self):
+        payload = {'lab_appointment': self.lab.id, 'service_appointment': self.service.id, 'patient': self.patient.id,
+                   'date': at(9).isoformat()}
+        client = APIClient()
+
+        self.assertEqual(client.post(reverse('add_appointment'), payload, format='json').status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(client.post(reverse('add_appointment'), payload, format='json').status_code,
+                         status.HTTP_409_CONFLICT)
+        self.assertEqual(client.post(reverse('add_appointment'), dict(payload, date='tomorrow'), format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+
+    @mock.patch('bhealthapp.outbox.enqueue')
+    def test_one_of_many_concurrent_bookings_wins(self, enqueue):
+        lab = create_lab()
+        service = create_service(lab=lab, duration=timedelta(minutes=30))
+        patient = create_patient(city=lab.city)
+        start = threading.Barrier(8)
+        outcomes = []
+
+        def client(minute):
+            try:
+                start.wait()
+                book_appointment(lab, service, patient, at(9, minute))
+                outcomes.append('booked')
+            except SlotTaken:
+                outcomes.append('taken')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(minute,)) for minute in range(0, 16, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['booked'] + ['taken'] * 7)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    @mock.patch('bhealthapp.outbox.enqueue')
+    def test_bookings_across_midnight_are_serialised(self, enqueue):
+        lab = create_lab()
+        late = create_service(name='Sleep study', lab=lab, duration=timedelta(minutes=60))
+        early = create_service(name='Blood test', lab=lab, duration=timedelta(minutes=30))
+        patient = create_patient(city=lab.city)
+        start = threading.Barrier(2)
+        outcomes = []
+        check = booking.overlapping
+
+        def slow_check(*args):
+            # Widen the window between the overlap check and the insert committing.
+            found = check(*args)
+            found.exists()
+            time.sleep(0.2)
+            return found
+
+        def client(service, moment):
+            try:
+                start.wait()
+                book_appointment(lab, service, patient, moment)
+                outcomes.append('booked')
+            except SlotTaken:
+                outcomes.append('taken')
+            finally:
+                connection.close()
+
+        tuesday = MONDAY + timedelta(days=1)
+        with mock.patch('bhealthapp.booking.overlapping', slow_check):
+            threads = [threading.Thread(target=client, args=(late, at(23, 30))),
+                       threading.Thread(target=client, args=(early, at(0, 0, day=tuesday)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(outcomes), ['booked', 'taken'])
+        self.assertEqual(Appointment.objects.count(), 1)
@@ -0,0 +1,169 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pika
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from bhealthapp import consumer
+from bhealthapp.benchmarks.data import create_appointment
+from bhealthapp.consumer import Consumer, ThreadSafeChannel
+from bhealthapp.dedupe import RecentIds
+from bhealthapp.envelope import Envelope, encode
+from bhealthapp.models import Notification, ProcessedMessage
+from bhealthapp.rmq_topology import next_retry_queue
+
+
+class ConsumerTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(consumer, 'open_connection')
+        self.open_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = self.open_connection.return_value
+
+    def test_sets_prefetch_and_consumes_every_queue(self):
+        Consumer(prefetch_count=5, concurrency=0)
+
+        channel = self.connection.channel.return_value
+        self.assertEqual(self.connection.channel.call_count, len(Consumer.QUEUES))
+        channel.basic_qos.assert_called_with(prefetch_count=5)
+        self.assertEqual(
+            sorted(call.kwargs['queue'] for call in channel.basic_consume.call_args_list), sorted(Consumer.QUEUES))
+
+    def test_concurrent_mode_runs_handlers_on_queue_pool(self):
+        apt_consumer = Consumer(queues=['results'], prefetch_count=1, queue_concurrency={'results': 3})
+        self.assertEqual(apt_consumer.executors['results']._max_workers, 3)
+        self.connection.channel.return_value.basic_qos.assert_called_with(prefetch_count=3)
+
+        channel = mock.Mock()
+        with mock.patch.object(apt_consumer, 'process_message') as handler:
+            apt_consumer._submit('results', channel, SimpleNamespace(delivery_tag=7), None, b'{}')
+            apt_consumer.executors['results'].shutdown(wait=True)
+
+        handler_channel = handler.call_args.args[1]
+        self.assertIsInstance(handler_channel, ThreadSafeChannel)
+
+        handler_channel.basic_ack(delivery_tag=7)
+        callback = self.connection.add_callback_threadsafe.call_args.args[0]
+        channel.basic_ack.assert_not_called()
+        callback()
+        channel.basic_ack.assert_called_once_with(delivery_tag=7, multiple=False)
+
+
+class ConsumerBatchTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(consumer, 'open_connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.consumer = Consumer(queues=['requests'], batch_size=10)
+        self.channel = mock.Mock()
+
+    def test_batch_writes_with_one_insert_and_one_ack(self):
+        first, second = create_appointment(), create_appointment()
+        properties = pika.BasicProperties()
+        deliveries = [
+            (SimpleNamespace(delivery_tag=1), properties, b'{"appointment_id": %d}' % first.pk),
+            (SimpleNamespace(delivery_tag=2), properties, b'not json'),
+            (SimpleNamespace(delivery_tag=3), properties, b'{"appointment_id": %d}' % second.pk),
+            (SimpleNamespace(delivery_tag=4), properties, b'{"appointment_id": 999999}'),
+        ]
+
+        # Appointment lookup, then the notification insert inside its savepoint.
+        with self.assertNumQueries(4):
+            self.consumer.process_batch('requests', self.channel, deliveries)
+
+        self.assertEqual(
+            sorted(Notification.objects.values_list('notification_appointment', flat=True)), [first.pk, second.pk])
+        retry_properties = self.channel.basic_publish.call_args.kwargs['properties']
+        self.assertEqual(retry_properties.headers, {'x-attempts': 1})
+        self.assertEqual(self.channel.mock_calls, [
+            mock.call.basic_nack(delivery_tag=2, requeue=False),
+            mock.call.basic_publish(
+                exchange='', routing_key='requests.retry.0', body=b'{"appointment_id": 999999}',
+                properties=retry_properties),
+            mock.call.basic_ack(delivery_tag=4),
+            mock.call.basic_ack(delivery_tag=3, multiple=True),
+        ])
+        # Throughput counts the notifications written, not the deliveries retried or parked.
+        self.assertEqual((self.consumer.processed, self.consumer.failed), (2, 2))
+
+    def test_batch_skips_messages_already_processed(self):
+        appointment = create_appointment()
+        done = Envelope.new('requests', {'appointment_id': appointment.pk})
+        redelivered = Envelope.new('requests', {'appointment_id': appointment.pk})
+        ProcessedMessage.objects.create(queue='requests', message_id=done.message_id)
+        properties = pika.BasicProperties()
+        deliveries = [
+            (SimpleNamespace(delivery_tag=1), properties, encode(done)),
+            (SimpleNamespace(delivery_tag=2), properties, encode(redelivered)),
+            (SimpleNamespace(delivery_tag=3), properties, encode(redelivered)),
+        ]
+
+        self.consumer.process_batch('requests', self.channel, deliveries)
+
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(self.consumer.duplicates, 2)
+        self.assertEqual(self.consumer.processed, 3)
+        self.assertEqual(self.channel.mock_calls, [mock.call.basic_ack(delivery_tag=3, multiple=True)])
+
+
+class ConsumerDedupeTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(consumer, 'open_connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.consumer = Consumer(queues=['results'])
+        self.channel = mock.Mock()
+
+    def _deliver(self, tag, body):
+        self.consumer.process_message('results', self.channel, SimpleNamespace(delivery_tag=tag), pika.BasicProperties(), body)
+
+    def test_redelivery_is_acked_from_cache_without_queries(self):
+        body = encode(Envelope.new('results', {'appointment_id': create_appointment().pk}))
+        self._deliver(1, body)
+
+        with self.assertNumQueries(0):
+            self._deliver(2, body)
+
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(self.channel.basic_ack.call_args_list, [mock.call(delivery_tag=1), mock.call(delivery_tag=2)])
+
+    def test_redelivery_to_another_process_hits_the_constraint(self):
+        body = encode(Envelope.new('results', {'appointment_id': create_appointment().pk}))
+        self._deliver(1, body)
+        self.consumer.dedupe.recent = RecentIds(10)
+
+        self._deliver(2, body)
+
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(self.consumer.duplicates, 1)
+        self.channel.basic_ack.assert_called_with(delivery_tag=2)
+
+
+class ConsumerRetryTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(consumer, 'open_connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.consumer = Consumer(queues=['results'])
+        self.channel = mock.Mock()
+
+    @override_settings(CONSUMER_RETRY_DELAYS_MS=[1000, 10000], CONSUMER_MAX_ATTEMPTS=4)
+    def test_retry_tiers_back_off_then_park(self):
+        targets = []
+        for attempt in range(4):
+            properties = pika.BasicProperties(headers={'x-attempts': attempt} if attempt else None)
+            targets.append(next_retry_queue('results', properties))
+
+        self.assertEqual(targets, ['results.retry.0', 'results.retry.1', 'results.retry.1', None])
+
+    @override_settings(CONSUMER_MAX_ATTEMPTS=2)
+    def test_message_out_of_attempts_is_dead_lettered(self):
+        method = SimpleNamespace(delivery_tag=9)
+        self.consumer.reject(self.channel, 'results', method, pika.BasicProperties(headers={'x-attempts': 1}), b'{}')
+
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=9, requeue=False)
+        self.channel.basic_publish.assert_not_called()
@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from bhealthapp.dedupe import DedupeStore, DuplicateMessage, RecentIds, prune_processed_messages
+from bhealthapp.models import ProcessedMessage
+
+
+class RecentIdsTest(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        recent = RecentIds(2)
+        recent.add('a')
+        recent.add('b')
+        self.assertIn('a', recent)
+
+        recent.add('c')
+
+        self.assertNotIn('b', recent)
+        self.assertIn('a', recent)
+        self.assertEqual(len(recent), 2)
+
+
+class DedupeStoreTest(TestCase):
+
+    def test_claim_twice_raises(self):
+        store = DedupeStore(cache_size=10)
+        store.claim('results', 'abc')
+
+        with self.assertRaises(DuplicateMessage):
+            store.claim('results', 'abc')
+
+        self.assertTrue(store.seen('results', 'abc'))
+        self.assertFalse(store.seen('requests', 'abc'))
+
+    def test_legacy_messages_are_never_duplicates(self):
+        store = DedupeStore(cache_size=10)
+        store.claim('results', None)
+        store.claim('results', None)
+
+        self.assertFalse(store.seen('results', None))
+        self.assertFalse(ProcessedMessage.objects.exists())
+
+    def test_prune_deletes_old_rows_in_chunks(self):
+        for i in range(5):
+            ProcessedMessage.objects.create(queue='results', message_id=str(i))
+        ProcessedMessage.objects.filter(message_id__in=['0', '1', '2']).update(
+            processed_at=timezone.now() - timedelta(hours=100))
+
+        self.assertEqual(prune_processed_messages(retention_hours=72, chunk_size=2), 3)
+
+        self.assertEqual(sorted(ProcessedMessage.objects.values_list('message_id', flat=True)), ['3', '4'])
@@ -0,0 +1,38 @@
+from unittest import skipIf
+
+from django.test import SimpleTestCase
+
+from bhealthapp import envelope
+from bhealthapp.envelope import Envelope, decode, encode
+
+
+class EnvelopeTest(SimpleTestCase):
+
+    def test_json_round_trip(self):
+        message = Envelope.new('requests', {'appointment_id': 5})
+
+        body = encode(message, 'json')
+
+        self.assertEqual(decode(body), message)
+        self.assertEqual(decode(memoryview(body)), message)
+        self.assertEqual(message.version, envelope.SCHEMA_VERSION)
+        self.assertEqual(len(message.message_id), 32)
+
+    @skipIf(envelope.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_round_trip_is_smaller(self):
+        message = Envelope.new('requests', {'appointment_id': 5})
+
+        body = encode(message, 'msgpack')
+
+        self.assertEqual(decode(body), message)
+        self.assertEqual(decode(memoryview(body)), message)
+        self.assertLess(len(body), len(encode(message, 'json')))
+
+    def test_legacy_bare_payload(self):
+        message = decode(b'{"appointment_id": 5}', event_type='results')
+
+        self.assertEqual(message, Envelope('results', 0, None, None, {'appointment_id': 5}))
+
+    def test_rejects_non_objects(self):
+        with self.assertRaises(ValueError):
+            decode(b'[1, 2]')
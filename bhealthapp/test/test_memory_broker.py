@@ -0,0 +1,129 @@
+import time
+
+import pika
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from bhealthapp import memory_broker
+from bhealthapp.benchmarks.data import create_appointment
+from bhealthapp.consumer import Consumer
+from bhealthapp.models import Notification
+from bhealthapp.rmq_send_message import Publisher, send_messages
+from bhealthapp.rmq_topology import declare_queue, parking_queue
+
+
+class MemoryBrokerTest(SimpleTestCase):
+
+    def setUp(self):
+        memory_broker.reset()
+        self.connection = memory_broker.connect()
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue='work', arguments={
+            'x-dead-letter-exchange': '', 'x-dead-letter-routing-key': 'dead'})
+        self.channel.queue_declare(queue='dead')
+
+    def _consume(self, prefetch_count=0):
+        deliveries = []
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+        self.channel.basic_consume(
+            queue='work', on_message_callback=lambda channel, method, properties, body: deliveries.append((method, body)))
+        return deliveries
+
+    def _publish(self, *bodies):
+        for body in bodies:
+            self.channel.basic_publish(exchange='', routing_key='work', body=body)
+
+    def test_topic_exchange_fans_out_by_pattern(self):
+        self.channel.exchange_declare(exchange='events', exchange_type='topic')
+        self.channel.queue_bind(queue='work', exchange='events', routing_key='appointment.*')
+        self.channel.queue_bind(queue='dead', exchange='events', routing_key='#')
+
+        self.channel.basic_publish(exchange='events', routing_key='appointment.created', body=b'a')
+        self.channel.basic_publish(exchange='events', routing_key='result.added', body=b'r')
+
+        self.assertEqual(self.channel.queue_declare(queue='work', passive=True).method.message_count, 1)
+        self.assertEqual(self.channel.queue_declare(queue='dead', passive=True).method.message_count, 2)
+
+    def test_prefetch_holds_back_deliveries_until_acked(self):
+        deliveries = self._consume(prefetch_count=2)
+        self._publish(b'1', b'2', b'3')
+
+        self.connection.process_data_events()
+        self.assertEqual([body for _, body in deliveries], [b'1', b'2'])
+
+        self.channel.basic_ack(delivery_tag=deliveries[1][0].delivery_tag, multiple=True)
+        self.connection.process_data_events()
+        self.assertEqual([body for _, body in deliveries], [b'1', b'2', b'3'])
+
+    def test_nack_requeues_or_dead_letters(self):
+        deliveries = self._consume(prefetch_count=1)
+        self._publish(b'1')
+
+        self.connection.process_data_events()
+        self.channel.basic_nack(delivery_tag=deliveries[0][0].delivery_tag, requeue=True)
+        self.connection.process_data_events()
+        self.assertTrue(deliveries[1][0].redelivered)
+
+        self.channel.basic_nack(delivery_tag=deliveries[1][0].delivery_tag, requeue=False)
+        method, properties, body = self.channel.basic_get(queue='dead')
+        self.assertEqual(body, b'1')
+        self.assertEqual(properties.headers['x-death'][0]['reason'], 'rejected')
+
+    def test_closing_channel_requeues_unacked(self):
+        self._publish(b'1', b'2')
+        self.channel.basic_get(queue='work')
+        self.channel.basic_get(queue='work')
+
+        self.channel.close()
+
+        channel = self.connection.channel()
+        self.assertEqual([channel.basic_get(queue='work')[2] for _ in range(2)], [b'1', b'2'])
+
+    def test_expired_messages_are_dead_lettered(self):
+        self.channel.queue_declare(queue='delay', arguments={
+            'x-message-ttl': 10, 'x-dead-letter-exchange': '', 'x-dead-letter-routing-key': 'work'})
+        self.channel.basic_publish(exchange='', routing_key='delay', body=b'later')
+        deliveries = self._consume()
+
+        self.connection.process_data_events(time_limit=1)
+
+        self.assertEqual([body for _, body in deliveries], [b'later'])
+
+    def test_unknown_delivery_tag_closes_channel(self):
+        with self.assertRaises(pika.exceptions.ChannelClosedByBroker):
+            self.channel.basic_ack(delivery_tag=42)
+        self.assertFalse(self.channel.is_open)
+
+
+@override_settings(RABBITMQ_TRANSPORT='memory', CONSUMER_RETRY_DELAYS_MS=[10], CONSUMER_MAX_ATTEMPTS=2,
+                   CONSUMER_DEPTH_POLL_SECONDS=0)
+class MessagingFlowTest(TransactionTestCase):
+
+    def setUp(self):
+        memory_broker.reset()
+
+    def _drain(self, apt_consumer, seconds=1.0):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            apt_consumer.connection.process_data_events(time_limit=0.05)
+
+    def test_published_event_becomes_notification(self):
+        appointment = create_appointment()
+        apt_consumer = Consumer(queues=['requests'], concurrency=0, batch_size=0)
+
+        send_messages('requests', {'appointment_id': appointment.pk})
+        self._drain(apt_consumer, 0.2)
+
+        self.assertEqual(list(Notification.objects.values_list('notification_appointment', flat=True)), [appointment.pk])
+        self.assertEqual(apt_consumer.processed, 1)
+
+    def test_failing_message_is_retried_then_parked(self):
+        apt_consumer = Consumer(queues=['results'], concurrency=0, batch_size=0)
+
+        publisher = Publisher()
+        publisher.publish('result.added', '{"appointment_id": 999999}')
+        self._drain(apt_consumer, 0.5)
+
+        self.assertEqual((apt_consumer.processed, apt_consumer.failed), (0, 2))
+        channel = memory_broker.connect().channel()
+        declare_queue(channel, 'results')
+        self.assertEqual(channel.queue_declare(queue=parking_queue('results'), passive=True).method.message_count, 1)
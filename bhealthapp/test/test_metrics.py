@@ -0,0 +1,56 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import pika
+from django.test import TestCase
+from prometheus_client import REGISTRY
+
+from bhealthapp import consumer, metrics
+from bhealthapp.benchmarks.data import create_appointment
+from bhealthapp.consumer import Consumer
+from bhealthapp.envelope import Envelope, encode
+from bhealthapp.models import Appointment
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class ConsumerMetricsTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(consumer, 'open_connection')
+        self.connection = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.consumer = Consumer(queues=['results'])
+        self.channel = mock.Mock()
+
+    def test_counts_outcomes_and_latency(self):
+        acked = sample('bhealth_consumer_messages_total', queue='results', outcome='acked')
+        dead_lettered = sample('bhealth_consumer_messages_total', queue='results', outcome='dead_lettered')
+        latencies = sample('bhealth_event_latency_seconds_count', queue='results')
+        handled = sample('bhealth_consumer_db_seconds_count', queue='results')
+
+        body = encode(Envelope.new('result.added', {'appointment_id': create_appointment().pk}, produced_at=time.time() - 3))
+        for tag, delivered in enumerate([body, b'nope']):
+            with metrics.timed_handler('results'):
+                self.consumer.process_message(
+                    'results', self.channel, SimpleNamespace(delivery_tag=tag), pika.BasicProperties(), delivered)
+
+        self.assertEqual(sample('bhealth_consumer_messages_total', queue='results', outcome='acked'), acked + 1)
+        self.assertEqual(
+            sample('bhealth_consumer_messages_total', queue='results', outcome='dead_lettered'), dead_lettered + 1)
+        self.assertEqual(sample('bhealth_event_latency_seconds_count', queue='results'), latencies + 1)
+        self.assertGreaterEqual(sample('bhealth_event_latency_seconds_sum', queue='results'), 3)
+        self.assertEqual(sample('bhealth_consumer_db_seconds_count', queue='results'), handled + 2)
+
+    def test_polls_queue_depth_with_passive_declares(self):
+        depth_channel = self.connection.channel.return_value
+        depth_channel.queue_declare.return_value = SimpleNamespace(method=SimpleNamespace(message_count=42))
+
+        self.consumer._poll_depth()
+
+        depth_channel.queue_declare.assert_any_call(queue='results.parking', durable=True, passive=True)
+        self.assertEqual(sample('bhealth_queue_depth', queue='results'), 42)
+        self.assertEqual(Appointment.objects.count(), 0)
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from bhealthapp.benchmarks.data import create_appointment, create_city, create_lab, create_patient, create_service
+from bhealthapp.models import Appointment, LabDayOccupancy
+from bhealthapp.occupancy import FULL_DAY, booking_bits, earliest_free, from_bytes, window_starts
+from bhealthapp.test.test_availability import MONDAY, at
+
+
+class BitmapTest(SimpleTestCase):
+
+    def test_booking_bits_cover_partly_taken_slots(self):
+        self.assertEqual(booking_bits(at(0, 3), timedelta(minutes=20), MONDAY), 0b11111)
+        self.assertEqual(booking_bits(at(23, 55), timedelta(minutes=30), MONDAY), 1 << 287)
+
+    def test_window_starts(self):
+        occupied = 0b0110_0000_1000
+        self.assertEqual(window_starts(occupied, 3) & 0xFFF, 0b1000_0111_0001)
+        self.assertEqual(window_starts(FULL_DAY, 1), 0)
+        self.assertEqual(window_starts(0, 288), 1)
+
+
+@override_settings(LAB_OPENING_HOUR=8, LAB_CLOSING_HOUR=10, AVAILABILITY_SLOT_MINUTES=30, TIME_ZONE='UTC')
+class OccupancyTest(TestCase):
+
+    def setUp(self):
+        self.city = create_city()
+        self.service = create_service(duration=timedelta(minutes=60))
+        self.labs = [create_lab(city=self.city, name=name, email=f'{name}@example.com') for name in ('a', 'b')]
+        self.patient = create_patient(city=self.city)
+
+    def book(self, lab, start, status=Appointment.STATUS_PENDING):
+        return create_appointment(lab=lab, service=self.service, patient=self.patient, date=start, status=status)
+
+    def occupancy(self, lab, day=MONDAY):
+        row = LabDayOccupancy.objects.filter(lab=lab, day=day).first()
+        return from_bytes(row.slots) if row else 0
+
+    def test_signals_keep_bitmap_current(self):
+        appointment = self.book(self.labs[0], at(8))
+        self.assertEqual(self.occupancy(self.labs[0]), booking_bits(at(8), self.service.duration, MONDAY))
+
+        appointment.date = at(9)
+        appointment.save()
+        self.assertEqual(self.occupancy(self.labs[0]), booking_bits(at(9), self.service.duration, MONDAY))
+
+        appointment.status = Appointment.STATUS_CANCELED
+        appointment.save(update_fields=['status'])
+        self.assertEqual(self.occupancy(self.labs[0]), 0)
+
+    def test_bookings_past_midnight_mark_the_next_day(self):
+        tuesday = MONDAY + timedelta(days=1)
+        appointment = self.book(self.labs[0], at(23, 30))
+        self.assertEqual(self.occupancy(self.labs[0]), booking_bits(at(23, 30), self.service.duration, MONDAY))
+        self.assertEqual(self.occupancy(self.labs[0], tuesday), 0b111111)
+
+        appointment.date = at(23)
+        appointment.save()
+        self.assertEqual(self.occupancy(self.labs[0], tuesday), 0)
+
+        appointment.date = at(23, 45)
+        appointment.save()
+        self.assertEqual(self.occupancy(self.labs[0], tuesday), 0b111_111_111)
+        appointment.status = Appointment.STATUS_CANCELED
+        appointment.save(update_fields=['status'])
+        self.assertEqual(self.occupancy(self.labs[0]), 0)
+        self.assertEqual(self.occupancy(self.labs[0], tuesday), 0)
+
+    @override_settings(LAB_OPENING_HOUR=0)
+    def test_earliest_free_after_a_booking_from_the_day_before(self):
+        tuesday = MONDAY + timedelta(days=1)
+        self.book(self.labs[0], at(23, 30))
+
+        self.assertEqual(earliest_free([self.labs[0].id], tuesday, self.service.duration)[1], at(0, 30, day=tuesday))
+
+    def test_rebuild_matches_signals(self):
+        self.book(self.labs[0], at(8))
+        self.book(self.labs[1], at(23, 30))
+        self.book(self.labs[1], at(9, 30))
+        self.book(self.labs[1], at(8), status=Appointment.STATUS_CANCELED)
+        expected = {lab.id: self.occupancy(lab) for lab in self.labs}
+        LabDayOccupancy.objects.all().delete()
+
+        call_command('rebuild_occupancy', '--since', MONDAY.isoformat(), '--days', '7', stdout=StringIO())
+
+        self.assertEqual({lab.id: self.occupancy(lab) for lab in self.labs}, expected)
+
+    def test_earliest_free_across_labs(self):
+        self.book(self.labs[0], at(8))
+        self.book(self.labs[1], at(8, 30))
+        lab_ids = [lab.id for lab in self.labs]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(earliest_free(lab_ids, MONDAY, self.service.duration)[:2], (self.labs[0].id, at(9)))
+
+        self.book(self.labs[0], at(9))
+        self.assertIsNone(earliest_free(lab_ids, MONDAY, self.service.duration))
+        self.assertIsNone(earliest_free(lab_ids, MONDAY + timedelta(days=5), self.service.duration))
+
+    def test_api_searches_following_days(self):
+        for lab in self.labs:
+            self.service.service_name.create(lab_service=lab)
+            self.book(lab, at(8))
+            self.book(lab, at(9))
+
+        response = APIClient().get(reverse('earliest_slot'), {
+            'city': self.city.id, 'service': self.service.id, 'day': MONDAY.isoformat(), 'days': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['lab'], response.data['start']),
+                         (self.labs[0].id, at(8, day=MONDAY + timedelta(days=1))))
@@ -0,0 +1,87 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase
+
+from bhealthapp.backpressure import DELAY, PUBLISH, SHED
+from bhealthapp.envelope import decode
+from bhealthapp.models import Outbox
+from bhealthapp.outbox import envelope_for, record_event, relay_batch
+
+
+class OutboxTest(TestCase):
+
+    def test_rolled_back_change_leaves_no_event(self):
+        try:
+            with transaction.atomic():
+                record_event('requests', {'appointment_id': 1})
+                raise RuntimeError('appointment insert failed')
+        except RuntimeError:
+            pass
+
+        self.assertFalse(Outbox.objects.exists())
+
+    @mock.patch('bhealthapp.outbox.enqueue')
+    def test_commit_hands_event_to_background_publisher(self, enqueue):
+        with self.captureOnCommitCallbacks(execute=True):
+            event = record_event('requests', {'appointment_id': 1})
+            enqueue.assert_not_called()
+
+        enqueue.assert_called_once_with(envelope_for(event), outbox_id=event.pk)
+        self.assertEqual(envelope_for(event).message_id, event.message_id.hex)
+
+    def test_relay_leaves_fresh_events_to_background_publisher(self):
+        record_event('requests', {'appointment_id': 1})
+        publisher = mock.Mock()
+
+        self.assertEqual(relay_batch(publisher, min_age=60), 0)
+        publisher.publish.assert_not_called()
+
+    def test_relay_publishes_in_order_and_deletes(self):
+        for appointment_id in (1, 2, 3):
+            record_event('results', {'appointment_id': appointment_id})
+        publisher = mock.Mock()
+
+        self.assertEqual(relay_batch(publisher, batch_size=2, min_age=0), 2)
+
+        published = [(call.args[0], decode(call.args[1]).payload) for call in publisher.publish.call_args_list]
+        self.assertEqual(published, [('results', {'appointment_id': 1}), ('results', {'appointment_id': 2})])
+        self.assertEqual(list(Outbox.objects.values_list('payload', flat=True)), [{'appointment_id': 3}])
+
+    def test_failed_publish_keeps_rows(self):
+        record_event('appointment', {'appointment_id': 1})
+        publisher = mock.Mock()
+        publisher.publish.side_effect = ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            relay_batch(publisher, min_age=0)
+
+        self.assertEqual(Outbox.objects.count(), 1)
+
+    def test_relay_keeps_delayed_rows_and_deletes_shed_ones(self):
+        for routing_key in ('appointment.updated', 'result.added', 'appointment.confirmed'):
+            record_event(routing_key, {'appointment_id': 1})
+        publisher = mock.Mock()
+        publisher.admit.side_effect = lambda routing_key: {
+            'appointment.updated': DELAY, 'appointment.confirmed': SHED}.get(routing_key, PUBLISH)
+
+        self.assertEqual(relay_batch(publisher, min_age=0), 2)
+
+        self.assertEqual([call.args[0] for call in publisher.publish.call_args_list], ['result.added'])
+        self.assertEqual(list(Outbox.objects.values_list('routing_key', flat=True)), ['appointment.updated'])
+
+    def test_delayed_rows_do_not_hold_back_critical_ones(self):
+        for appointment_id in range(5):
+            record_event('appointment.updated', {'appointment_id': appointment_id})
+        record_event('result.added', {'appointment_id': 1})
+        record_event('appointment.updated', {'appointment_id': 5})
+        record_event('result.added', {'appointment_id': 2})
+        publisher = mock.Mock()
+        publisher.admit.side_effect = lambda routing_key: DELAY if routing_key == 'appointment.updated' else PUBLISH
+
+        self.assertEqual(relay_batch(publisher, batch_size=5, min_age=0), 2)
+
+        published = [(call.args[0], decode(call.args[1]).payload) for call in publisher.publish.call_args_list]
+        self.assertEqual(published, [('result.added', {'appointment_id': 1}), ('result.added', {'appointment_id': 2})])
+        self.assertEqual(publisher.admit.call_count, 3)
+        self.assertEqual(set(Outbox.objects.values_list('routing_key', flat=True)), {'appointment.updated'})
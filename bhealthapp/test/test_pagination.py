@@ -1,11 +1,21 @@
+from datetime import timedelta
 from urllib.parse import urlencode
 
+from django.contrib.admin.sites import AdminSite
+from django.core.paginator import EmptyPage
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from bhealthapp.admin import AppointmentAdmin
+from bhealthapp.benchmarks.data import create_appointment, create_lab, create_patient, create_service
 from bhealthapp.models import Notification, Lab, Result, Appointment, User, UserRating
-from bhealthapp.serializers import ResultViewSerializer, AppointmentViewSerializer
+from bhealthapp.pagination import EstimatedCountPaginator
+from bhealthapp.serializers import ResultViewSerializer, AppointmentViewSerializer, AppointmentSerializer
 from bhealthapp.test.factories import LabFactory, LabServiceFactory, UserFactory, AppointmentFactory
 
 
@@ -239,3 +249,117 @@ class TestWeRecommendViewPagination(APITestCase):
         # Check if the response contains the correct data
         self.assertEqual(response.data['results'][0][0], 'Lab 8')
         self.assertEqual(response.data['results'][0][1], 5)
+
+
+class CursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.lab = create_lab()
+        service = create_service(lab=self.lab)
+        patient = create_patient(city=self.lab.city)
+        start = timezone.now() + timedelta(days=7)
+        # Three appointments share a date, so the cursor has to break ties on id.
+        self.appointments = [
+            create_appointment(lab=self.lab, service=service, patient=patient, date=start + timedelta(hours=min(i, 3)),
+                               status=Appointment.STATUS_CONFIRMED)
+            for i in range(6)
+        ]
+
+    def walk(self, url, params):
+        pages = []
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+            while True:
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotIn('count', response.data)
+                pages.append(response.data['results'])
+                if response.data['next'] is None:
+                    break
+                response = self.client.get(response.data['next'])
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+        return pages
+
+    def test_pages_follow_date_and_id(self):
+        pages = self.walk(reverse('lab_upcoming_appointments'), {'lab': self.lab.pk, 'pagination': 'cursor', 'page_size': 2})
+
+        expected = sorted(self.appointments, key=lambda appointment: (appointment.date, appointment.pk), reverse=True)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2])
+        self.assertEqual([row['date'] for page in pages for row in page],
+                         [AppointmentSerializer(appointment).data['date'] for appointment in expected])
+
+    def test_pages_follow_id(self):
+        Appointment.objects.update(status=Appointment.STATUS_PENDING)
+        pages = self.walk(reverse('requests'), {'lab_appointment': self.lab.pk, 'pagination': 'cursor', 'page_size': 4})
+        self.assertEqual([len(page) for page in pages], [4, 2])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('lab_upcoming_appointments'), {'lab': self.lab.pk, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_numbers_stay_the_default(self):
+        response = self.client.get(reverse('lab_upcoming_appointments'), {'lab': self.lab.pk, 'page_size': 2})
+        self.assertEqual(response.data['count'], 6)
+
+
+class EstimatedCountPaginatorTestCase(APITestCase):
+    def setUp(self):
+        appointment = create_appointment(status=Appointment.STATUS_CANCELED)
+        Appointment.objects.bulk_create([
+            Appointment(lab_appointment=appointment.lab_appointment, service_appointment=appointment.service_appointment,
+                        patient=appointment.patient, date=appointment.date, status=Appointment.STATUS_CANCELED)
+            for _ in range(199)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE bhealthapp_appointment')
+
+    @override_settings(PAGINATION_EXACT_COUNT_THRESHOLD=100)
+    def test_estimate_above_threshold(self):
+        paginator = EstimatedCountPaginator(Appointment.objects.order_by('id'), 10)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertAlmostEqual(paginator.count, 200, delta=20)
+        self.assertFalse(paginator.count_is_exact)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+    @override_settings(PAGINATION_EXACT_COUNT_THRESHOLD=1000)
+    def test_exact_below_threshold(self):
+        paginator = EstimatedCountPaginator(Appointment.objects.order_by('id'), 10)
+        self.assertEqual(paginator.count, 200)
+        self.assertTrue(paginator.count_is_exact)
+
+    @override_settings(PAGINATION_EXACT_COUNT_THRESHOLD=100)
+    def test_filtered_querysets_count_exactly(self):
+        paginator = EstimatedCountPaginator(Appointment.objects.filter(pk__lte=Appointment.objects.first().pk + 5), 10)
+        self.assertEqual(paginator.count, 6)
+        self.assertTrue(paginator.count_is_exact)
+        self.assertEqual(EstimatedCountPaginator(Appointment.objects.filter(pk__in=[]), 10).count, 0)
+
+        response = self.client.get(reverse('canceled_appointments'), {'page_size': 2})
+        self.assertEqual(response.data['count'], 200)
+        self.assertTrue(response.data['count_is_exact'])
+
+    @override_settings(PAGINATION_EXACT_COUNT_THRESHOLD=100)
+    def test_short_page_corrects_an_overshooting_estimate(self):
+        # Deleted rows keep their pages until vacuumed, the estimate stays at about 200.
+        Appointment.objects.filter(pk__gt=Appointment.objects.order_by('id')[44].pk).delete()
+        appointments = Appointment.objects.order_by('id')
+
+        paginator = EstimatedCountPaginator(appointments, 10)
+        self.assertGreater(paginator.count, 100)
+        page = paginator.page(5)
+        self.assertEqual(len(page), 5)
+        self.assertFalse(page.has_next())
+        self.assertEqual((paginator.count, paginator.num_pages), (45, 5))
+        self.assertTrue(paginator.count_is_exact)
+
+        self.assertTrue(EstimatedCountPaginator(appointments, 10).page(4).has_next())
+        with self.assertRaises(EmptyPage):
+            EstimatedCountPaginator(appointments, 10).page(10)
+
+    def test_exact_by_default(self):
+        response = self.client.get(reverse('canceled_appointments'), {'page_size': 2})
+        self.assertEqual(response.data['count'], 200)
+        self.assertTrue(response.data['count_is_exact'])
+
+    def test_admin_changelists(self):
+        admin = AppointmentAdmin(Appointment, AdminSite())
+        self.assertIsInstance(admin.get_paginator(None, Appointment.objects.all(), 100), EstimatedCountPaginator)
+        self.assertFalse(admin.show_full_result_count)
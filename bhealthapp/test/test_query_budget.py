@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from bhealthapp.benchmarks.data import create_appointment, create_city, create_lab, create_patient, create_service
+from bhealthapp.models import Appointment, LabService, Notification, Result
+
+ROWS = 12
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Pins every list and detail endpoint to a fixed number of queries, the same for a
+    page of one row as for a full page, so a nested serializer loading its relations
+    per row fails here. Unfiltered lists pay one query for the count estimate.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        city = create_city()
+        cls.lab = create_lab(city=city)
+        cls.patient = create_patient(city=city)
+        now = timezone.now()
+
+        cls.appointments = []
+        for i in range(ROWS):
+            lab = create_lab(city=city, name=f'Lab {i}', email=f'lab{i}@example.com')
+            service = create_service(name=f'Service {i}', lab=lab)
+            patient = create_patient(city=city, username=f'patient{i}', email=f'patient{i}@example.com')
+            LabService.objects.create(lab_service=cls.lab, service=service)
+            for days, status in ((30, Appointment.STATUS_CONFIRMED), (-30, Appointment.STATUS_CONFIRMED),
+                                 (10, Appointment.STATUS_PENDING), (20, Appointment.STATUS_CANCELED)):
+                cls.appointments.append(create_appointment(
+                    lab=cls.lab, service=service, patient=cls.patient if i % 2 else patient,
+                    date=now + timedelta(days=days, minutes=i), status=status))
+            # Patients of the lab come from other labs' appointments too.
+            create_appointment(lab=lab, service=service, patient=cls.patient, date=now + timedelta(days=30, minutes=i),
+                               status=Appointment.STATUS_CONFIRMED)
+
+        for appointment in cls.appointments[:ROWS]:
+            Notification.objects.create(notification_appointment=appointment)
+            Result.objects.create(appointment=appointment)
+
+    def count_queries(self, name, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(reverse(name), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return len(queries)
+
+    def assertListBudget(self, budget, name, **params):
+        for page_size in (1, ROWS):
+            self.assertEqual(self.count_queries(name, dict(params, page_size=page_size)), budget,
+                             f'{name} with page_size={page_size}')
+
+    def assertDetailBudget(self, budget, name, **params):
+        self.assertEqual(self.count_queries(name, params), budget, name)
+
+    def test_appointment_lists(self):
+        self.assertListBudget(5, 'user_upcoming_appointments', patient=self.patient.pk)
+        self.assertListBudget(5, 'user_past_appointments', patient=self.patient.pk)
+        self.assertListBudget(3, 'lab_upcoming_appointments', lab=self.lab.pk)
+        self.assertListBudget(3, 'lab_past_appointments', lab=self.lab.pk)
+        self.assertListBudget(4, 'requests', lab_appointment=self.lab.pk)
+        self.assertListBudget(2, 'canceled_appointments')
+
+    def test_notifications_and_results(self):
+        self.assertListBudget(5, 'notifications')
+        self.assertListBudget(4, 'notifications', patient=self.patient.pk)
+        self.assertListBudget(2, 'results', patient=self.patient.pk)
+
+    def test_labs_and_patients(self):
+        self.assertListBudget(3, 'labs')
+        self.assertListBudget(3, 'lab_services')
+        self.assertListBudget(3, 'patients', lab=self.lab.pk)
+        self.assertListBudget(2, 'top_labs')
+
+    def test_details(self):
+        self.assertDetailBudget(3, 'get_appointment', pk=self.appointments[0].pk)
+        self.assertDetailBudget(1, 'get_lab', pk=self.lab.pk)
+        self.assertDetailBudget(1, 'get_result', pk=Result.objects.first().pk)
+        self.assertDetailBudget(1, 'get_profile', pk=self.patient.pk)
@@ -0,0 +1,81 @@
+import random
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from bhealthapp.benchmarks.data import create_city, create_lab, create_service
+from bhealthapp.models import Appointment, User
+
+LABS = 40
+PATIENTS = 400
+APPOINTMENTS = 40000
+
+
+class AppointmentQueryPlanTest(TestCase):
+    """
+    Runs EXPLAIN on the appointment queries of the list endpoints over a seeded table
+    and checks the planner reads them through the matching index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        city = create_city()
+        service = create_service()
+        cls.labs = [create_lab(city=city, name=f'Lab {i}', email=f'lab{i}@example.com') for i in range(LABS)]
+        cls.patients = User.objects.bulk_create([
+            User(username=f'patient{i}', email=f'patient{i}@example.com', password='password', city=city)
+            for i in range(PATIENTS)
+        ])
+
+        rng = random.Random(7)
+        now = timezone.now()
+        statuses = [Appointment.STATUS_PENDING] + [Appointment.STATUS_CONFIRMED] * 8 + [Appointment.STATUS_CANCELED]
+        Appointment.objects.bulk_create([
+            Appointment(lab_appointment=rng.choice(cls.labs), service_appointment=service,
+                        patient=rng.choice(cls.patients), date=now + timedelta(days=rng.randint(-1500, 1500)),
+                        status=rng.choice(statuses))
+            for _ in range(APPOINTMENTS)
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE bhealthapp_appointment')
+
+    def plans(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url, params)
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        for query in queries:
+            if 'FROM "bhealthapp_appointment"' in query['sql']:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN ' + query['sql'])
+                    plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+        self.assertTrue(plans, f'{url} did not query appointments')
+        return plans
+
+    def assertUsesIndex(self, index, url, params):
+        plans = self.plans(url, params)
+        for plan in plans:
+            self.assertNotIn('Seq Scan on bhealthapp_appointment', plan)
+        self.assertTrue(any(index in plan for plan in plans), '\n\n'.join(plans))
+
+    def test_patient_upcoming_and_past(self):
+        params = {'patient': self.patients[0].pk}
+        self.assertUsesIndex('appointment_patient_idx', reverse('user_upcoming_appointments'), params)
+        self.assertUsesIndex('appointment_patient_idx', reverse('user_past_appointments'), params)
+
+    def test_lab_upcoming_and_past(self):
+        params = {'lab': self.labs[0].pk}
+        self.assertUsesIndex('appointment_lab_idx', reverse('lab_upcoming_appointments'), params)
+        self.assertUsesIndex('appointment_lab_idx', reverse('lab_past_appointments'), params)
+
+    def test_lab_requests(self):
+        self.assertUsesIndex('appointment_lab_pending_idx', reverse('requests'), {'lab_appointment': self.labs[0].pk})
+
+    def test_canceled(self):
+        self.assertUsesIndex('appointment_canceled_idx', reverse('canceled_appointments'), {})
@@ -0,0 +1,85 @@
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from bhealthapp import memory_broker
+from bhealthapp.backpressure import PUBLISH
+from bhealthapp.benchmarks.data import create_appointment, create_lab, create_patient, create_service
+from bhealthapp.envelope import decode
+from bhealthapp.models import Appointment
+from bhealthapp.replay import Checkpoint, replay_events
+
+
+@override_settings(RABBITMQ_TRANSPORT='memory')
+class ReplayEventsTest(TestCase):
+
+    def setUp(self):
+        memory_broker.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'replay.json')
+
+        lab = create_lab()
+        service = create_service(lab=lab)
+        patient = create_patient(city=lab.city)
+        self.appointments = [
+            create_appointment(lab=lab, service=service, patient=patient, status=status,
+                               date=timezone.make_aware(datetime(2026, 1, day)))
+            for day, status in ((1, Appointment.STATUS_CONFIRMED), (2, Appointment.STATUS_PENDING),
+                                (3, Appointment.STATUS_CONFIRMED), (4, Appointment.STATUS_CONFIRMED))
+        ]
+        self.publisher = mock.Mock()
+        self.publisher.admit.return_value = PUBLISH
+
+    def _replayed(self):
+        return [decode(call.args[1]) for call in self.publisher.publish.call_args_list]
+
+    def test_publishes_matching_appointments_in_order(self):
+        checkpoint = Checkpoint(self.path, {})
+        published = replay_events(self.publisher, 'appointment.confirmed', checkpoint,
+                                  since=timezone.make_aware(datetime(2026, 1, 2)), chunk_size=1)
+
+        self.assertEqual(published, 2)
+        envelopes = self._replayed()
+        self.assertEqual([e.payload['appointment_id'] for e in envelopes], [a.pk for a in self.appointments[2:]])
+        self.assertEqual({e.event_type for e in envelopes}, {'appointment.confirmed'})
+        with open(self.path) as saved:
+            self.assertEqual(json.load(saved)['last_id'], self.appointments[3].pk)
+
+    def test_failure_checkpoints_last_published_and_resume_reuses_message_ids(self):
+        self.publisher.publish.side_effect = [None, ConnectionError]
+        with self.assertRaises(ConnectionError):
+            replay_events(self.publisher, 'appointment.created', Checkpoint(self.path, {}), chunk_size=100)
+        failed = self._replayed()[1]
+
+        self.publisher.publish.side_effect = None
+        self.publisher.publish.reset_mock()
+        checkpoint = Checkpoint(self.path, {})
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(replay_events(self.publisher, 'appointment.created', checkpoint), 3)
+
+        self.assertEqual([e.payload['appointment_id'] for e in self._replayed()], [a.pk for a in self.appointments[1:]])
+        self.assertEqual(checkpoint.replayed, 4)
+        # Consumers that got the message the broker did not confirm drop it as a duplicate.
+        self.assertEqual(self._replayed()[0].message_id, failed.message_id)
+
+    def test_command_publishes_through_broker(self):
+        call_command('replay_events', '--type', 'appointment.confirmed', '--since', '2026-01-03',
+                     '--checkpoint', self.path, '--rate', '0', stdout=io.StringIO())
+
+        channel = memory_broker.connect().channel()
+        self.assertEqual(channel.queue_declare(queue='appointment', passive=True).method.message_count, 2)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_command_refuses_checkpoint_of_another_replay(self):
+        Checkpoint(self.path, {'type': 'result.added', 'since': None, 'until': None}).save()
+
+        with self.assertRaises(CommandError):
+            call_command('replay_events', '--type', 'appointment.confirmed', '--checkpoint', self.path)
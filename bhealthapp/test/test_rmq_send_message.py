@@ -0,0 +1,67 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from pika.exceptions import AMQPConnectionError, StreamLostError
+
+from bhealthapp import rmq_send_message
+from bhealthapp.envelope import decode
+from bhealthapp.rmq_send_message import Publisher
+
+
+class PublisherTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(rmq_send_message, 'open_connection')
+        self.open_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = self.open_connection.return_value.channel.return_value
+
+    def _declares(self, queue):
+        return [call.kwargs['queue'] for call in self.channel.queue_declare.call_args_list].count(queue)
+
+    def test_reuses_connection_and_declares_queue_once(self):
+        publisher = Publisher()
+
+        for i in range(3):
+            publisher.publish('requests', '{"appointment_id": %d}' % i)
+
+        self.assertEqual(self.open_connection.call_count, 1)
+        self.assertEqual(self._declares('requests'), 1)
+        self.assertEqual(self.channel.basic_publish.call_count, 3)
+
+    def test_reconnects_after_connection_loss(self):
+        publisher = Publisher()
+        publisher.publish('results', '{}')
+
+        self.channel.basic_publish.side_effect = [StreamLostError('gone'), None]
+        publisher.publish('results', '{}')
+
+        self.assertEqual(self.open_connection.call_count, 2)
+        self.assertEqual(self._declares('results'), 2)
+
+    def test_publishes_legacy_queue_names_to_the_topic_exchange(self):
+        Publisher().publish('appointment_canceled', '{}')
+
+        self.channel.exchange_declare.assert_any_call(exchange='bhealth.events', exchange_type='topic', durable=True)
+        self.channel.queue_bind.assert_any_call(
+            queue='appointment_canceled', exchange='bhealth.events', routing_key='appointment.canceled')
+        publish = self.channel.basic_publish.call_args.kwargs
+        self.assertEqual((publish['exchange'], publish['routing_key']), ('bhealth.events', 'appointment.canceled'))
+
+    def test_enables_publisher_confirms(self):
+        Publisher(confirm_delivery=True).publish('appointment', '{}')
+
+        self.channel.confirm_delivery.assert_called_once_with()
+
+
+class SendMessagesTest(SimpleTestCase):
+
+    @mock.patch.object(rmq_send_message, 'get_spool')
+    @mock.patch.object(rmq_send_message, 'get_publisher')
+    def test_spools_when_broker_is_unreachable(self, get_publisher, get_spool):
+        get_publisher.return_value.publish.side_effect = AMQPConnectionError
+
+        rmq_send_message.send_messages('requests', {'appointment_id': 1})
+
+        routing_key, body = get_spool.return_value.append.call_args.args
+        self.assertEqual((routing_key, decode(body).payload), ('appointment.created', {'appointment_id': 1}))
@@ -0,0 +1,19 @@
+from django.test import SimpleTestCase
+
+from bhealthapp.rmq_topology import LEGACY_ROUTING_KEYS, subscribers, topic_matches
+
+
+class TopologyTest(SimpleTestCase):
+
+    def test_topic_patterns(self):
+        self.assertTrue(topic_matches('appointment.created', 'appointment.created'))
+        self.assertTrue(topic_matches('appointment.*', 'appointment.canceled'))
+        self.assertFalse(topic_matches('appointment.*', 'appointment.canceled.late'))
+        self.assertTrue(topic_matches('#', 'result.added'))
+        self.assertTrue(topic_matches('appointment.#', 'appointment'))
+        self.assertTrue(topic_matches('#.added', 'lab.result.added'))
+        self.assertFalse(topic_matches('result.*', 'appointment.created'))
+
+    def test_every_legacy_queue_still_receives_its_events(self):
+        for queue, routing_key in LEGACY_ROUTING_KEYS.items():
+            self.assertEqual(subscribers(routing_key), [queue])
@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from bhealthapp.benchmarks.data import create_city, create_lab, create_service
+from bhealthapp.models import Lab, LabService
+from bhealthapp.search import has_extension, refresh, search_labs, set_similarity_threshold
+
+
+class LabSearchTest(TestCase):
+
+    def setUp(self):
+        self.sarajevo = create_city()
+        self.mostar = create_city(name='Mostar', postal_code=88000)
+        self.cardio = create_lab(city=self.sarajevo, name='Cardio Centar', address='Titova 1', email='cardio@example.com')
+        self.hormone = create_lab(city=self.mostar, name='Hormone Lab', address='Fejiceva 5', email='hormone@example.com')
+        self.hormone.description = 'Blood and cardio screening'
+        self.hormone.save()
+        self.thyroid = create_service(name='Thyroid panel', lab=self.hormone)
+
+    def names(self, text):
+        return [lab.name for lab in search_labs(text)]
+
+    def test_matches_every_part_of_the_document(self):
+        self.assertEqual(self.names('titova'), ['Cardio Centar'])
+        self.assertEqual(self.names('mostar'), ['Hormone Lab'])
+        self.assertEqual(self.names('thyroid'), ['Hormone Lab'])
+        self.assertEqual(self.names('hormone thyroid'), ['Hormone Lab'])
+        self.assertEqual(self.names('dentist'), [])
+
+    def test_name_outranks_description(self):
+        self.assertEqual(self.names('cardio'), ['Cardio Centar', 'Hormone Lab'])
+
+    def test_kept_in_sync_from_signals(self):
+        self.thyroid.name = 'Ferritin'
+        self.thyroid.save()
+        self.assertEqual(self.names('ferritin'), ['Hormone Lab'])
+        self.assertEqual(self.names('thyroid'), [])
+
+        self.mostar.name = 'Tuzla'
+        self.mostar.save()
+        self.assertEqual(self.names('tuzla'), ['Hormone Lab'])
+
+        LabService.objects.create(lab_service=self.cardio, service=self.thyroid)
+        self.assertEqual(self.names('ferritin'), ['Cardio Centar', 'Hormone Lab'])
+        LabService.objects.filter(lab_service=self.hormone).delete()
+        self.assertEqual(self.names('ferritin'), ['Cardio Centar'])
+
+        self.cardio.name = 'Heart Centar'
+        self.cardio.save(update_fields=['name'])
+        self.assertEqual(self.names('heart'), ['Heart Centar'])
+
+    def test_unrelated_saves_leave_the_document(self):
+        with self.assertNumQueries(1):
+            self.cardio.average_rating = 4.5
+            self.cardio.save(update_fields=['average_rating'])
+
+    def test_refresh_rebuilds_documents(self):
+        Lab.objects.update(search_vector=None, search_names=None)
+        self.assertEqual(self.names('cardio'), [])
+
+        self.assertEqual(refresh(), 2)
+        self.assertEqual(self.names('cardio'), ['Cardio Centar', 'Hormone Lab'])
+
+    def test_lab_list_search(self):
+        response = APIClient().get(reverse('labs'), {'search': 'cardio'})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([lab['name'] for lab in results], ['Cardio Centar', 'Hormone Lab'])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+        self.assertIn('<b>Cardio</b>', results[0]['headline'])
+
+    def test_folds_diacritics(self):
+        if not has_extension('unaccent'):
+            self.skipTest('unaccent is not installed')
+        celebici = create_city(name='Čelebići', postal_code=88400)
+        create_lab(city=celebici, name='Ćenić Dijagnostika', address='Đure Đakovića 3', email='cenic@example.com')
+
+        self.assertEqual(self.names('cenic'), ['Ćenić Dijagnostika'])
+        self.assertEqual(self.names('Ćenić'), ['Ćenić Dijagnostika'])
+        self.assertEqual(self.names('celebici'), ['Ćenić Dijagnostika'])
+        self.assertEqual(self.names('dure dakovica'), ['Ćenić Dijagnostika'])
+
+        response = APIClient().get(reverse('labs'), {'search': 'Čelebići'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([lab['name'] for lab in response.data['results']], ['Ćenić Dijagnostika'])
+        self.assertIn('<b>Ćenić</b>', APIClient().get(reverse('labs'), {'search': 'cenic'}).data['results'][0]['headline'])
+
+    def test_tolerates_typos(self):
+        if not has_extension('pg_trgm'):
+            self.skipTest('pg_trgm is not installed')
+        self.assertEqual(self.names('sarajvo'), ['Cardio Centar'])
+        self.assertEqual(self.names('tyroid'), ['Hormone Lab'])
+        # Search as you type: the start of a word is close to the word.
+        self.assertEqual(self.names('hormo'), ['Hormone Lab'])
+
+        # Full-text matches rank above typo matches.
+        create_lab(city=self.mostar, name='Sarajevo Lab', email='sarajevo@example.com')
+        self.assertEqual(self.names('sarajevo'), ['Sarajevo Lab', 'Cardio Centar'])
+
+    @override_settings(LAB_SEARCH_SIMILARITY=0.95)
+    def test_similarity_threshold(self):
+        if not has_extension('pg_trgm'):
+            self.skipTest('pg_trgm is not installed')
+        # Set when the connection opened, the test's rollback restores it.
+        set_similarity_threshold(connection)
+        self.assertEqual(self.names('sarajvo'), [])
+        self.assertEqual(self.names('sarajevo'), ['Cardio Centar'])
+
+    def test_threshold_is_set_per_connection(self):
+        search_labs('cardio')
+        with self.assertNumQueries(0):
+            search_labs('sarajvo')
+
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW pg_trgm.word_similarity_threshold')
+            self.assertEqual(float(cursor.fetchone()[0]), settings.LAB_SEARCH_SIMILARITY)
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from bhealthapp.backpressure import DELAY, PUBLISH, SHED
+from bhealthapp.spool import Spool
+
+
+class SpoolTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.spool = Spool(directory=self.directory, segment_bytes=64, fsync=False)
+        self.publisher = mock.Mock()
+
+    def _published(self):
+        return [(call.args[0], bytes(call.args[1])) for call in self.publisher.publish.call_args_list]
+
+    def test_drains_in_order_across_segments(self):
+        for i in range(5):
+            self.spool.append('requests', '{"appointment_id": %d}' % i)
+        self.assertGreater(len(self.spool.segments()), 1)
+
+        self.assertEqual(self.spool.drain(self.publisher), 5)
+
+        self.assertEqual(self._published(), [('requests', b'{"appointment_id": %d}' % i) for i in range(5)])
+        self.assertEqual(self.spool.stats()['bytes'], 0)
+
+    def test_failed_publish_resumes_at_the_same_message(self):
+        for i in range(3):
+            self.spool.append('results', '{"appointment_id": %d}' % i)
+        self.publisher.publish.side_effect = [None, ConnectionError]
+
+        with self.assertRaises(ConnectionError):
+            self.spool.drain(self.publisher)
+
+        self.publisher.publish.side_effect = None
+        self.publisher.publish.reset_mock()
+        self.assertEqual(self.spool.drain(self.publisher), 2)
+        self.assertEqual(self._published(), [('results', b'{"appointment_id": %d}' % i) for i in (1, 2)])
+
+    def test_delayed_messages_wait_for_next_drain(self):
+        for routing_key in ('appointment.updated', 'result.added', 'appointment.canceled'):
+            self.spool.append(routing_key, '{}')
+        self.publisher.admit.side_effect = lambda routing_key: {
+            'appointment.updated': DELAY, 'appointment.canceled': SHED}.get(routing_key, PUBLISH)
+
+        self.assertEqual(self.spool.drain(self.publisher), 1)
+        self.assertEqual(self._published(), [('result.added', b'{}')])
+
+        self.publisher.admit.side_effect = None
+        self.assertEqual(self.spool.drain(self.publisher), 1)
+        self.assertEqual(self._published()[-1], ('appointment.updated', b'{}'))
+
+    def test_delayed_messages_stay_in_place(self):
+        for routing_key in ('appointment.updated', 'result.added', 'appointment.updated', 'result.added'):
+            self.spool.append(routing_key, routing_key)
+        self.publisher.admit.side_effect = lambda routing_key: DELAY if routing_key == 'appointment.updated' else PUBLISH
+
+        with mock.patch('bhealthapp.spool.time.time', return_value=time.time() + 60):
+            for sent in (2, 0, 0):
+                self.assertEqual(self.spool.drain(self.publisher), sent)
+                # The oldest message is still the first one spooled.
+                self.assertGreaterEqual(self.spool.stats()['oldest_age_seconds'], 60)
+        self.assertEqual(self._published(), [('result.added', b'result.added')] * 2)
+        self.assertEqual(self.publisher.admit.call_count, 3 + 2)
+
+        self.publisher.admit.side_effect = None
+        self.spool.append('result.added', 'last')
+        self.assertEqual(self.spool.drain(self.publisher), 3)
+        self.assertEqual(self._published()[2:],
+                         [('appointment.updated', b'appointment.updated')] * 2 + [('result.added', b'last')])
+        self.assertEqual(self.spool.stats()['bytes'], 0)
+
+    def test_ignores_truncated_record(self):
+        self.spool.append('results', '{"appointment_id": 1}')
+        with open(os.path.join(self.directory, self.spool.segments()[-1]), 'ab') as segment:
+            segment.write(b'\x00\x00')
+
+        self.assertEqual(self.spool.drain(self.publisher), 1)
+
+    def _tear_last_record(self):
+        path = os.path.join(self.directory, self.spool.segments()[-1])
+        with open(path, 'r+b') as segment:
+            segment.truncate(os.path.getsize(path) - 5)
+
+    def test_restart_after_torn_append_keeps_later_messages(self):
+        spool = Spool(directory=self.directory, segment_bytes=1024, fsync=False)
+        spool.append('results', 'first-message')
+        spool.append('results', 'torn-message')
+        self._tear_last_record()
+
+        restarted = Spool(directory=self.directory, segment_bytes=1024, fsync=False)
+        for i in range(3):
+            restarted.append('results', 'after-%d' % i)
+
+        self.assertEqual(restarted.drain(self.publisher), 4)
+        self.assertEqual(self._published(), [('results', b'first-message')] + [('results', b'after-%d' % i) for i in range(3)])
+
+    def test_skips_damaged_records_in_the_middle_of_a_segment(self):
+        spool = Spool(directory=self.directory, segment_bytes=1024, fsync=False)
+        spool.append('results', 'first-message')
+        spool.append('results', 'torn-message')
+        # Another process carries on appending behind the record its crashed neighbour tore.
+        self._tear_last_record()
+        spool.append('results', 'second-message')
+        spool.append('results', 'third-message')
+        path = os.path.join(self.directory, spool.segments()[-1])
+        with open(path, 'r+b') as segment:
+            segment.seek(-3, os.SEEK_END)
+            segment.write(b'XXX')
+
+        with self.assertLogs('bhealthapp.spool', 'ERROR'):
+            self.assertEqual(spool.drain(self.publisher), 2)
+        self.assertEqual(self._published(), [('results', b'first-message'), ('results', b'second-message')])
+
+    def test_stats(self):
+        self.assertEqual(self.spool.stats(), {'segments': 0, 'bytes': 0, 'oldest_age_seconds': 0.0})
+
+        self.spool.append('requests', '{}')
+
+        stats = self.spool.stats()
+        self.assertEqual(stats['segments'], 1)
+        self.assertGreater(stats['bytes'], 0)
+        self.assertGreaterEqual(stats['oldest_age_seconds'], 0)
@@ -0,0 +1,45 @@
+import signal
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from bhealthapp import supervisor
+from bhealthapp.supervisor import ConsumerSupervisor
+
+
+class FakeConsumer:
+
+    def __init__(self, **options):
+        self.processed = 0
+        self.failed = 0
+        self._consuming = False
+
+    def start(self):
+        self._consuming = True
+        while self._consuming:
+            self.processed += 1
+            time.sleep(0.01)
+
+    def stop(self):
+        self._consuming = False
+
+
+class ConsumerSupervisorTest(SimpleTestCase):
+
+    def setUp(self):
+        handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+        self.addCleanup(lambda: [signal.signal(signum, handler) for signum, handler in handlers.items()])
+
+    @mock.patch.object(supervisor, 'Consumer', FakeConsumer)
+    def test_stops_children_gracefully_and_reports_throughput(self):
+        consumer_supervisor = ConsumerSupervisor(2, {}, restart_delay=0.05, shutdown_timeout=10)
+        threading.Timer(0.5, consumer_supervisor.stop).start()
+
+        reports = consumer_supervisor.run()
+
+        self.assertEqual([report['index'] for report in reports], [0, 1])
+        self.assertTrue(all(report['processed'] > 0 for report in reports))
+        self.assertFalse(any(child.is_alive() for child in consumer_supervisor.children.values()))
+        self.assertEqual(consumer_supervisor.restarts, 0)
@@ -1,8 +1,11 @@
 import os
-from datetime import datetime, date
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
 
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q, Avg
 from django.shortcuts import get_object_or_404
 from rest_framework import pagination
@@ -15,46 +18,121 @@ from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from bhealthapp.autocomplete import suggest
+from bhealthapp.availability import available_slots
+from bhealthapp.booking import SlotTaken, book_appointment
 from bhealthapp.models import Lab, LabService, Result, Appointment, User, Notification, UserRating, Service
+from bhealthapp.occupancy import earliest_free
 from src.config import common
+from bhealthapp.outbox import record_event
+from bhealthapp.pagination import EstimatedCountPaginator, KeysetPagination
+from bhealthapp.search import SEARCH_ORDERING, search_labs
 from .serializers import LabSerializer, LabServiceViewSerializer, ResultViewSerializer, \
     PatientSerializer, PatientViewSerializer, LabViewSerializer, AppointmentViewSerializer, ResultSerializer, \
     AppointmentSerializer, NotificationViewSerializer, NotificationSerializer, \
-    AddRatingSerializer, RequestViewSerializer
-from .tasks import send_appointment_canceled_message, send_appointment_message, download_file, request_updated, \
-    upload_pdf, send_request_notification
+    AddRatingSerializer, RequestViewSerializer, LabSearchSerializer
+from .tasks import download_file
 
 today = datetime.now()
 
+# Relations read by the nested serializers, loaded with the page instead of once per row.
+APPOINTMENT_VIEW_RELATED = ('lab_appointment__city', 'service_appointment', 'patient')
+APPOINTMENT_VIEW_PREFETCH = ('patient__groups', 'patient__user_permissions')
+
+
+def appointment_view_queryset(queryset, prefix=''):
+    """queryset ready for AppointmentViewSerializer, prefix is the lookup from its model to the appointment."""
+    return queryset.select_related(*(prefix + name for name in APPOINTMENT_VIEW_RELATED)).prefetch_related(
+        *(prefix + name for name in APPOINTMENT_VIEW_PREFETCH))
+
+
+def appointment_queryset(queryset):
+    """queryset ready for AppointmentSerializer."""
+    return queryset.select_related('lab_appointment', 'service_appointment', 'patient')
+
 
 class CustomPagination(pagination.PageNumberPagination):
+    django_paginator_class = EstimatedCountPaginator
     page_size = 4
     page_size_query_param = 'page_size'
     max_page_size = 12
 
+    def paginate_queryset(self, queryset, request, view=None):
+        # ?pagination=cursor opts into keyset pages on views declaring cursor_ordering: no count, no offset.
+        ordering = getattr(view, 'cursor_ordering', None)
+        self.keyset = None
+        if ordering is not None and KeysetPagination.requested(request):
+            self.keyset = KeysetPagination(ordering, self.get_page_size(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_is_exact', self.page.paginator.count_is_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
 
 class ValidateQueryParams(serializers.Serializer):
+    # Arabic letters and digits, and Latin Extended-A for names like Čelebići and Đurić.
     search = fields.RegexField(
-        "^[\u0621-\u064A\u0660-\u0669 a-zA-Z0-9]{3,30}$", required=False
+        "^[\u0621-\u064A\u0660-\u0669\u0100-\u017F a-zA-Z0-9]{3,30}$", required=False
     )
 
     city = fields.RegexField(
-        "^[\u0621-\u064A\u0660-\u0669 a-zA-Z]{3,30}$", required=False
+        "^[\u0621-\u064A\u0660-\u0669\u0100-\u017F a-zA-Z]{3,30}$", required=False
     )
     lab = fields.RegexField(
-        "^[\u0621-\u064A\u0660-\u0669 a-zA-Z]{3,30}$", required=False
+        "^[\u0621-\u064A\u0660-\u0669\u0100-\u017F a-zA-Z]{3,30}$", required=False
     )
     service = fields.RegexField(
-        "^[\u0621-\u064A\u0660-\u0669 a-zA-Z]{3,30}$", required=False
+        "^[\u0621-\u064A\u0660-\u0669\u0100-\u017F a-zA-Z]{3,30}$", required=False
     )
     patient = fields.RegexField(
-        "^[\u0621-\u064A\u0660-\u0669 a-zA-Z0-9]{3,30}$", required=False
+        "^[\u0621-\u064A\u0660-\u0669\u0100-\u017F a-zA-Z0-9]{3,30}$", required=False
     )
     pk = fields.RegexField("^[\u0621-\u064A\u0660-\u0669 0-9]{3,30}$", required=False)
     day = fields.IntegerField(min_value=1, max_value=30, required=False)
     year = fields.IntegerField(min_value=1990, max_value=today.year, required=False)
 
 
+class AvailabilityParams(serializers.Serializer):
+    lab = fields.IntegerField()
+    service = fields.IntegerField()
+    start = fields.DateField()
+    end = fields.DateField(required=False)
+
+    def validate(self, data):
+        data.setdefault('end', data['start'])
+        if data['end'] < data['start']:
+            raise serializers.ValidationError('end must not be before start.')
+        if (data['end'] - data['start']).days >= common.AVAILABILITY_MAX_DAYS:
+            raise serializers.ValidationError(f'At most {common.AVAILABILITY_MAX_DAYS} days at a time.')
+        return data
+
+
+class EarliestSlotParams(serializers.Serializer):
+    city = fields.IntegerField()
+    service = fields.IntegerField()
+    day = fields.DateField()
+    days = fields.IntegerField(min_value=1, default=1)
+
+    def validate_days(self, value):
+        if value > common.AVAILABILITY_MAX_DAYS:
+            raise serializers.ValidationError(f'At most {common.AVAILABILITY_MAX_DAYS} days at a time.')
+        return value
+
+
+class AutocompleteParams(serializers.Serializer):
+    q = fields.CharField(max_length=100, allow_blank=True, trim_whitespace=False)
+    limit = fields.IntegerField(min_value=1, required=False)
+
+
 class UserCreate(GenericAPIView):
     serializer_class = PatientSerializer
     permission_classes = [AllowAny]
@@ -175,19 +253,16 @@ class AppointmentAddView(CreateAPIView):
             service = Service.objects.get(pk=service_id)
             patient = User.objects.get(pk=patient_id)
 
-            appointment = Appointment.objects.create(
-                lab_appointment=lab,
-                service_appointment=service,
-                patient=patient,
-                date=date,
-                status=Appointment.STATUS_PENDING
-            )
-            send_request_notification(appointment_id=appointment.id)
+            book_appointment(lab, service, patient, date)
 
             return Response({'Appointment added successfully.'}, status=status.HTTP_201_CREATED)
 
         except (Lab.DoesNotExist, Service.DoesNotExist, User.DoesNotExist):
             return Response({'Failure': 'One or more related objects do not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError:
+            return Response({'Failure': 'Invalid appointment date.'}, status=status.HTTP_400_BAD_REQUEST)
+        except SlotTaken:
+            return Response({'Failure': 'The lab is already booked at this time.'}, status=status.HTTP_409_CONFLICT)
 
 
 class UserUpdateView(GenericAPIView):
@@ -216,13 +291,14 @@ class NotificationListView(ListAPIView):
     serializer_class = NotificationViewSerializer
     ordering = ['-id']
     pagination_class = CustomPagination
+    cursor_ordering = ('-id',)
     search_fields = ['notification_appointment']
     filter_backends = (filters.SearchFilter, filters.OrderingFilter)
 
     def get_queryset(self, *args, **kwargs):
         param = self.request.query_params
 
-        queryset = Notification.objects.all().order_by('id')
+        queryset = appointment_view_queryset(Notification.objects.all(), 'notification_appointment__').order_by('id')
 
         if param.get('notification_appointment') is not None:
             queryset = queryset.filter(notification_appointment=param.get('notification_appointment'))
@@ -264,8 +340,13 @@ class LabListView(ListAPIView):
     serializer_class = LabViewSerializer
     ordering = ['-id']
     pagination_class = CustomPagination
-    search_fields = ['name', 'city', 'address']
-    filter_backends = (filters.SearchFilter, filters.OrderingFilter)
+    cursor_ordering = ('-id',)
+    filter_backends = (filters.OrderingFilter,)
+
+    def get_serializer_class(self):
+        if self.request.query_params.get('search') is not None:
+            return LabSearchSerializer
+        return LabViewSerializer
 
     def get_queryset(self, *args, **kwargs):
         param = self.request.query_params
@@ -273,12 +354,13 @@ class LabListView(ListAPIView):
         query_params = ValidateQueryParams(data=param)
         query_params.is_valid(raise_exception=True)
 
-        queryset = Lab.objects.all().order_by('id')
+        queryset = Lab.objects.select_related('city').order_by('id')
 
         if param.get('search') is not None:
-
-            search = param.get('search')
-            query_set = queryset.filter(Q(lab__name__contains=search) | Q(service__name__contains=search))
+            # Matches keep their rank order, which OrderingFilter and cursors would replace.
+            self.ordering = SEARCH_ORDERING
+            self.cursor_ordering = None
+            query_set = search_labs(param.get('search'), queryset)
 
         elif param.get('city') is not None:
             query_set = queryset.filter(city=param.get('city'))
@@ -304,7 +386,7 @@ class LabView(GenericAPIView):
             param = self.request.query_params.get('pk', default=None)
             if param is None:
                 return Response('Please add primary key.')
-            lab = Lab.objects.get(pk=param)
+            lab = Lab.objects.select_related('city').get(pk=param)
         except Lab.DoesNotExist:
             return Response({'Failure': 'Lab does not exist.'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -325,7 +407,7 @@ class LabServiceListView(ListAPIView):
     def get_queryset(self, *args, **kwargs):
         param = self.request.query_params
 
-        queryset = LabService.objects.all().order_by('id')
+        queryset = LabService.objects.select_related('lab_service', 'service').order_by('id')
 
         if param.get('search') is not None:
 
@@ -356,7 +438,7 @@ class LabServiceView(GenericAPIView):
             param = self.request.query_params.get('pk', default=None)
             if param is None:
                 return Response('Please add primary key.')
-            lab = LabService.objects.get(pk=param)
+            lab = LabService.objects.select_related('lab_service', 'service').get(pk=param)
         except LabService.DoesNotExist:
             return Response({'Failure': 'Service does not exist.'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -366,6 +448,71 @@ class LabServiceView(GenericAPIView):
         return Response(data, status=status.HTTP_200_OK, content_type="application/json")
 
 
+class AvailabilityView(GenericAPIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        params = AvailabilityParams(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+
+        try:
+            lab = Lab.objects.only('id', 'availability_version').get(pk=params.validated_data['lab'])
+            service = Service.objects.only('duration').get(pk=params.validated_data['service'])
+        except (Lab.DoesNotExist, Service.DoesNotExist):
+            return Response({'Failure': 'Lab or service does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+
+        slots = available_slots(lab.id, service.duration, params.validated_data['start'], params.validated_data['end'],
+                                lab.availability_version)
+        data = {
+            'lab': lab.id,
+            'service': service.id,
+            'slots': [{'start': start, 'end': end} for start, end in slots],
+        }
+
+        return Response(data, status=status.HTTP_200_OK, content_type="application/json")
+
+
+class EarliestSlotView(GenericAPIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        params = EarliestSlotParams(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+
+        try:
+            service = Service.objects.only('duration').get(pk=params.validated_data['service'])
+        except Service.DoesNotExist:
+            return Response({'Failure': 'Service does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+
+        lab_ids = list(Lab.objects.filter(
+            city=params.validated_data['city'], lab_name_service__service=service
+        ).values_list('id', flat=True).distinct())
+
+        for offset in range(params.validated_data['days']):
+            found = earliest_free(lab_ids, params.validated_data['day'] + timedelta(days=offset), service.duration)
+            if found is not None:
+                lab_id, start, end = found
+                data = {'lab': lab_id, 'service': service.id, 'start': start, 'end': end}
+                return Response(data, status=status.HTTP_200_OK, content_type="application/json")
+
+        return Response({'Failure': 'No free slot found.'}, status=status.HTTP_404_NOT_FOUND)
+
+
+class AutocompleteView(GenericAPIView):
+    permission_classes = [AllowAny]
+    # Answered from memory on every keystroke, so no user or session is loaded either.
+    authentication_classes = []
+
+    def get(self, request):
+        params = AutocompleteParams(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+
+        suggestions = suggest(params.validated_data['q'], params.validated_data.get('limit'))
+        data = {'results': [{'kind': kind, 'id': pk, 'name': name} for kind, pk, name in suggestions]}
+
+        return Response(data, status=status.HTTP_200_OK, content_type="application/json")
+
+
 class LabAddView(CreateAPIView):
     permission_classes = [AllowAny]
     serializer_class = LabSerializer
@@ -407,6 +554,7 @@ class ResultListView(ListAPIView):
     serializer_class = ResultViewSerializer
     ordering = ['-id']
     pagination_class = CustomPagination
+    cursor_ordering = ('-id',)
     filter_backends = (filters.SearchFilter, filters.OrderingFilter)
 
     def get_queryset(self, *args, **kwargs):
@@ -415,12 +563,12 @@ class ResultListView(ListAPIView):
         if param.get('patient') is not None:
 
             patient = param.get('patient')
-            query_set = Result.objects.filter(appointment__patient=patient)
+            query_set = Result.objects.select_related('appointment').filter(appointment__patient=patient)
 
         elif param.get('appointment') is not None:
 
             appointment = param.get('appointment')
-            query_set = Result.objects.filter(appointment=appointment)
+            query_set = Result.objects.select_related('appointment').filter(appointment=appointment)
 
         else:
             query_set = Result.objects.none()
@@ -437,7 +585,7 @@ class ResultView(GenericAPIView):
             param = self.request.query_params.get('pk', default=None)
             if param is None:
                 return Response('Please add primary key.')
-            result = Result.objects.get(pk=param)
+            result = Result.objects.select_related('appointment').get(pk=param)
         except Result.DoesNotExist:
             return Response({'Failure': 'Result does not exist.'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -456,7 +604,7 @@ class AppointmentView(GenericAPIView):
             param = self.request.query_params.get('pk', default=None)
             if param is None:
                 return Response('Please add primary key.')
-            appointment = Appointment.objects.get(pk=param)
+            appointment = appointment_view_queryset(Appointment.objects.all()).get(pk=param)
         except Appointment.DoesNotExist:
             return Response({'Failure': 'Appointment does not exist.'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -471,6 +619,7 @@ class UpcomingAppointmentsUserView(ListAPIView):
     serializer_class = AppointmentViewSerializer
     ordering = ['-id']
     pagination_class = CustomPagination
+    cursor_ordering = ('-date', '-id')
     search_fields = ['patient']
     filter_backends = (filters.SearchFilter, filters.OrderingFilter)
 
@@ -482,8 +631,8 @@ class UpcomingAppointmentsUserView(ListAPIView):
             patient = User.objects.get(pk=param)
             date_from = today
             date_to = today + relativedelta(years=5)
-            query_set = Appointment.objects.filter(patient=patient, date__gte=date_from, date__lte=date_to,
-                                                   status=1)
+            query_set = appointment_view_queryset(Appointment.objects.all()).filter(
+                patient=patient, date__gte=date_from, date__lte=date_to, status=1)
 
         else:
             query_set = Appointment.objects.none()
@@ -496,6 +645,7 @@ class PastAppointmentsUserView(ListAPIView):
     serializer_class = AppointmentViewSerializer
     ordering = ['-id']
     pagination_class = CustomPagination
+    cursor_ordering = ('-date', '-id')
     search_fields = ['patient']
     filter_backends = (filters.SearchFilter, filters.OrderingFilter)
 
@@ -506,8 +656,8 @@ class PastAppointmentsUserView(ListAPIView):
             patient = User.objects.get(pk=patient_id)
             date_from = today - relativedelta(years=5)
             date_to = today
-            query_set = Appointment.objects.filter(patient=patient, date__gte=date_from, date__lte=date_to,
-                                                   status=1)
+            query_set = appointment_view_queryset(Appointment.objects.all()).filter(
+                patient=patient, date__gte=date_from, date__lte=date_to, status=1)
 
             return query_set
 
@@ -518,6 +668,7 @@ class UpcomingAppointmentsLabView(ListAPIView):
     permission_classes = [AllowAny]
     serializer_class = AppointmentSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('-date', '-id')
     search_fields = ['patient']
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     ordering_fields = ['-date']
@@ -529,7 +680,7 @@ class UpcomingAppointmentsLabView(ListAPIView):
             lab = Lab.objects.get(pk=lab_id)
             today = date.today()
             future_date = today + relativedelta(years=5)
-            queryset = Appointment.objects.filter(
+            queryset = appointment_queryset(Appointment.objects.all()).filter(
                 lab_appointment=lab,
                 date__gte=today,
                 date__lte=future_date,
@@ -545,6 +696,7 @@ class PastAppointmentsLabView(ListAPIView):
     permission_classes = [AllowAny]
     serializer_class = AppointmentSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('-date', '-id')
     search_fields = ['patient']
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     ordering_fields = ['-date']
@@ -556,7 +708,7 @@ class PastAppointmentsLabView(ListAPIView):
             lab = Lab.objects.get(pk=lab_id)
             today = datetime.now().date()
             past_date = today - relativedelta(years=5)
-            query_set = Appointment.objects.filter(
+            query_set = appointment_queryset(Appointment.objects.all()).filter(
                 lab_appointment=lab,
                 date__gte=past_date,
                 date__lte=today,
@@ -573,6 +725,7 @@ class RequestsView(ListAPIView):
     serializer_class = RequestViewSerializer
     ordering = ['-id']
     pagination_class = CustomPagination
+    cursor_ordering = ('-id',)
     filter_backends = (filters.SearchFilter, filters.OrderingFilter)
 
     def get_queryset(self, *args, **kwargs):
@@ -584,7 +737,8 @@ class RequestsView(ListAPIView):
         if param.get('lab_appointment') is not None:
             lab = param.get('lab_appointment')
 
-            query_set = Appointment.objects.filter(lab_appointment=lab, status=0)
+            query_set = Appointment.objects.select_related('patient', 'service_appointment').prefetch_related(
+                *APPOINTMENT_VIEW_PREFETCH).filter(lab_appointment=lab, status=0)
 
             return query_set
 
@@ -604,7 +758,7 @@ class PatientsView(ListAPIView):
         if param is not None:
             lab = Lab.objects.get(pk=param)
             appointments = Appointment.objects.filter(lab_appointment=lab)
-            query_set = User.objects.filter(patient__in=appointments)
+            query_set = User.objects.select_related('city').filter(patient__in=appointments)
 
             return query_set
 
@@ -618,7 +772,7 @@ class WeRecommendView(ListAPIView):
     filter_backends = (filters.SearchFilter, filters.OrderingFilter)
 
     def get_queryset(self):
-        labs = Lab.objects.order_by('-average_rating')[:6]
+        labs = Lab.objects.select_related('city').order_by('-average_rating')[:6]
         return labs
 
 
@@ -631,7 +785,7 @@ class ProfileView(GenericAPIView):
             param = self.request.query_params.get('pk', default=None)
             if param is None:
                 return Response('Please add primary key.')
-            user = User.objects.get(pk=param)
+            user = User.objects.select_related('city').get(pk=param)
         except User.DoesNotExist:
             return Response({'Failure': 'User does not exist.'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -663,7 +817,7 @@ class RatingAddView(CreateAPIView):
             new_average_rating = UserRating.objects.filter(lab=lab).aggregate(average_rating=Avg('rating'))[
                 'average_rating']
             lab.average_rating = new_average_rating if new_average_rating is not None else 0.0
-            lab.save()
+            lab.save(update_fields=['average_rating'])
 
             return Response("Rating added successfully.", status=status.HTTP_201_CREATED)
         except Lab.DoesNotExist:
@@ -684,17 +838,20 @@ class ResultAddView(CreateAPIView):
 
             serializer = ResultSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            serializer.save()
 
-            result = Result.objects.last()
-            result.appointment = app
-            result.save(update_fields=['appointment'])
+            with transaction.atomic():
+                serializer.save()
+
+                result = Result.objects.last()
+                result.appointment = app
+                result.save(update_fields=['appointment'])
+
+                record_event('result.added', {'appointment_id': app.id})
 
         except Appointment.DoesNotExist:
             return Response({'Failure': 'Appointment you are trying to add result for does not exist.'},
                             status=status.HTTP_404_NOT_FOUND)
 
-        upload_pdf(appointment_id=param)
         return Response("Result added successfully.", status=status.HTTP_200_OK)
 
 
@@ -718,9 +875,10 @@ class AppointmentUpdateView(GenericAPIView):
         else:
             serializer = AppointmentSerializer(instance=appointment, data=request.data)
             serializer.is_valid(raise_exception=True)
-            serializer.save()
 
-            request_updated(appointment_id=param)
+            with transaction.atomic():
+                serializer.save()
+                record_event('appointment.updated', {'appointment_id': appointment.id})
 
             return Response(data={"Appointment updated successfully."}, content_type="application/json",
                             status=status.HTTP_202_ACCEPTED)
@@ -744,10 +902,11 @@ class NotificationConfirmView(CreateAPIView):
 
         notification.is_confirmed = True
         notification.notification_appointment.status = Appointment.STATUS_CONFIRMED
-        notification.notification_appointment.save(update_fields=['status'])
-        notification.save(update_fields=['is_confirmed'])
 
-        send_appointment_message(appointment_id=notification.notification_appointment.id)
+        with transaction.atomic():
+            notification.notification_appointment.save(update_fields=['status'])
+            notification.save(update_fields=['is_confirmed'])
+            record_event('appointment.confirmed', {'appointment_id': notification.notification_appointment.id})
 
         return Response('Notification confirmed successfully.', status=status.HTTP_200_OK)
 
@@ -769,9 +928,10 @@ class AppointmentCancelView(UpdateAPIView):
                             status=status.HTTP_404_NOT_FOUND)
 
         appointment.status = Appointment.STATUS_CANCELED
-        appointment.save(update_fields=['status'])
 
-        send_appointment_canceled_message(appointment_id=param)
+        with transaction.atomic():
+            appointment.save(update_fields=['status'])
+            record_event('appointment.canceled', {'appointment_id': appointment.id})
 
         return Response('Appointment canceled successfully.', status=status.HTTP_200_OK)
 
@@ -780,10 +940,11 @@ class CanceledAppointmentsView(ListAPIView):
     permission_classes = [AllowAny]
     serializer_class = AppointmentSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('-date', '-id')
     search_fields = ['patient']
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     ordering_fields = ['-date']
 
     def get_queryset(self, *args, **kwargs):
-        query_set = Appointment.objects.filter(status=Appointment.STATUS_CANCELED).order_by('-date')
+        query_set = appointment_queryset(Appointment.objects.all()).filter(status=Appointment.STATUS_CANCELED).order_by('-date')
         return query_set
@@ -106,6 +106,12 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_IMPORTS = [
     'bhealthapp.tasks',
 ]
+CELERY_BEAT_SCHEDULE = {
+    'prune-processed-messages': {
+        'task': 'bhealthapp.tasks.prune_processed_messages',
+        'schedule': 3600.0,
+    },
+}
 
 import dj_database_url
 
@@ -325,6 +331,9 @@ REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
 
+# Paginated lists and admin changelists count rows exactly up to this many and use the planner's estimate above.
+PAGINATION_EXACT_COUNT_THRESHOLD = int(os.environ.get('PAGINATION_EXACT_COUNT_THRESHOLD', 100000))
+
 # JWT configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -373,4 +382,78 @@ RABBITMQ_PORT = os.environ.get('RABBITMQ_PORT', 5672)
 RABBITMQ_USER = os.environ.get('RABBITMQ_DEFAULT_USER', 'guest')
 RABBITMQ_PASSWORD = os.environ.get('RABBITMQ_DEFAULT_PASS', 'guest')
 RABBITMQ_VHOST = os.environ.get('RABBITMQ_VHOST', '/')
-RABBITMQ_EXCHANGE = os.environ.get('RABBITMQ_EXCHANGE', 'my_exchange')
+RABBITMQ_EXCHANGE = os.environ.get('RABBITMQ_EXCHANGE', 'bhealth.events')
+# amqp for RabbitMQ, memory for the in-process broker used by tests and benchmarks.
+RABBITMQ_TRANSPORT = os.environ.get('RABBITMQ_TRANSPORT', 'amqp')
+RABBITMQ_PUBLISHER_CONFIRMS = os.environ.get('RABBITMQ_PUBLISHER_CONFIRMS', 'False') == 'True'
+# Codec for new message envelopes, json or msgpack. Consumers read both.
+MESSAGE_CODEC = os.environ.get('MESSAGE_CODEC', 'json')
+
+# Background publisher, overflow is one of block, drop or spill.
+PUBLISH_QUEUE_SIZE = int(os.environ.get('PUBLISH_QUEUE_SIZE', 10000))
+PUBLISH_OVERFLOW = os.environ.get('PUBLISH_OVERFLOW', 'spill')
+PUBLISH_BLOCK_TIMEOUT_MS = int(os.environ.get('PUBLISH_BLOCK_TIMEOUT_MS', 50))
+PUBLISH_SHUTDOWN_TIMEOUT = float(os.environ.get('PUBLISH_SHUTDOWN_TIMEOUT', 5))
+# The relay leaves outbox rows younger than this to the background publisher.
+OUTBOX_RELAY_DELAY_SECONDS = float(os.environ.get('OUTBOX_RELAY_DELAY_SECONDS', 10))
+# Publishers hold back non-critical events from a queue once it is this deep, until it drains to the
+# low watermark. Depths are cached for BACKPRESSURE_DEPTH_TTL_SECONDS, a high watermark of 0 disables it.
+BACKPRESSURE_HIGH_WATERMARK = int(os.environ.get('BACKPRESSURE_HIGH_WATERMARK', 50000))
+BACKPRESSURE_LOW_WATERMARK = int(os.environ.get('BACKPRESSURE_LOW_WATERMARK', 10000))
+BACKPRESSURE_DEPTH_TTL_SECONDS = float(os.environ.get('BACKPRESSURE_DEPTH_TTL_SECONDS', 5))
+# Per-event overrides of what throttling does to an event, e.g. "appointment.updated=shed,result.added=publish".
+PUBLISH_EVENT_POLICIES = dict(item.split('=') for item in os.environ.get('PUBLISH_EVENT_POLICIES', '').split(',') if item)
+# Port relay_outbox exposes its spool and throttling metrics on, unset disables it.
+PUBLISHER_METRICS_PORT = int(os.environ['PUBLISHER_METRICS_PORT']) if os.environ.get('PUBLISHER_METRICS_PORT') else None
+
+# Lab opening hours in TIME_ZONE and the weekdays labs work, Monday being 0.
+LAB_OPENING_HOUR = int(os.environ.get('LAB_OPENING_HOUR', 8))
+LAB_CLOSING_HOUR = int(os.environ.get('LAB_CLOSING_HOUR', 16))
+LAB_WORKING_DAYS = [int(day) for day in os.environ.get('LAB_WORKING_DAYS', '0,1,2,3,4').split(',') if day]
+# Free slots start every AVAILABILITY_SLOT_MINUTES. The busy intervals of a lab-day are cached for
+# AVAILABILITY_CACHE_SECONDS under the version of the lab, which every change to its appointments bumps.
+AVAILABILITY_SLOT_MINUTES = int(os.environ.get('AVAILABILITY_SLOT_MINUTES', 15))
+AVAILABILITY_CACHE_SECONDS = int(os.environ.get('AVAILABILITY_CACHE_SECONDS', 300))
+AVAILABILITY_MAX_DAYS = int(os.environ.get('AVAILABILITY_MAX_DAYS', 31))
+
+# Text search configuration of the lab search documents, changing it needs a rebuild_lab_search. The default
+# bhealth_search folds diacritics. Typo matches need a trigram word similarity of LAB_SEARCH_SIMILARITY, 0 to 1.
+LAB_SEARCH_CONFIG = os.environ.get('LAB_SEARCH_CONFIG', 'bhealth_search')
+LAB_SEARCH_SIMILARITY = float(os.environ.get('LAB_SEARCH_SIMILARITY', 0.5))
+
+# Search as you type: at most AUTOCOMPLETE_MAX_RESULTS suggestions, from an index each process checks for catalog
+# changes every AUTOCOMPLETE_CHECK_SECONDS and rebuilds after AUTOCOMPLETE_MAX_AGE seconds to follow appointment counts.
+AUTOCOMPLETE_MAX_RESULTS = int(os.environ.get('AUTOCOMPLETE_MAX_RESULTS', 10))
+AUTOCOMPLETE_CHECK_SECONDS = float(os.environ.get('AUTOCOMPLETE_CHECK_SECONDS', 5))
+AUTOCOMPLETE_MAX_AGE = float(os.environ.get('AUTOCOMPLETE_MAX_AGE', 900))
+
+# Local spool for messages published while the broker is unreachable.
+SPOOL_DIR = os.environ.get('SPOOL_DIR', join(os.path.dirname(BASE_DIR), 'spool'))
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))
+SPOOL_FSYNC = os.environ.get('SPOOL_FSYNC', 'True') == 'True'
+SPOOL_RETRY_SECONDS = float(os.environ.get('SPOOL_RETRY_SECONDS', 5))
+
+# Consumer
+CONSUMER_PREFETCH_COUNT = int(os.environ.get('CONSUMER_PREFETCH_COUNT', 10))
+# Worker threads per queue, 0 handles messages inline on the connection thread.
+CONSUMER_CONCURRENCY = int(os.environ.get('CONSUMER_CONCURRENCY', 0))
+# Per-queue overrides, e.g. "results=4,requests=2".
+CONSUMER_QUEUE_CONCURRENCY = {
+    queue: int(workers)
+    for queue, workers in (
+        item.split('=') for item in os.environ.get('CONSUMER_QUEUE_CONCURRENCY', '').split(',') if item
+    )
+}
+# Write notifications in batches of up to this many messages, 0 or 1 disables batching.
+CONSUMER_BATCH_SIZE = int(os.environ.get('CONSUMER_BATCH_SIZE', 0))
+CONSUMER_BATCH_TIMEOUT_MS = int(os.environ.get('CONSUMER_BATCH_TIMEOUT_MS', 200))
+# Delay before each retry of a failed message, after CONSUMER_MAX_ATTEMPTS it is parked.
+CONSUMER_RETRY_DELAYS_MS = [int(delay) for delay in os.environ.get('CONSUMER_RETRY_DELAYS_MS', '1000,10000,60000').split(',') if delay]
+CONSUMER_MAX_ATTEMPTS = int(os.environ.get('CONSUMER_MAX_ATTEMPTS', 4))
+# Seconds between queue depth polls, and the first port of the per-process metrics endpoint, unset disables it.
+CONSUMER_DEPTH_POLL_SECONDS = float(os.environ.get('CONSUMER_DEPTH_POLL_SECONDS', 15))
+CONSUMER_METRICS_PORT = int(os.environ['CONSUMER_METRICS_PORT']) if os.environ.get('CONSUMER_METRICS_PORT') else None
+# Recently handled message ids kept in memory, and how long their rows are kept for dedupe.
+CONSUMER_DEDUPE_CACHE_SIZE = int(os.environ.get('CONSUMER_DEDUPE_CACHE_SIZE', 100000))
+CONSUMER_DEDUPE_RETENTION_HOURS = int(os.environ.get('CONSUMER_DEDUPE_RETENTION_HOURS', 72))
+CONSUMER_DEDUPE_PRUNE_CHUNK = int(os.environ.get('CONSUMER_DEDUPE_PRUNE_CHUNK', 5000))
@@ -17,7 +17,8 @@ from bhealthapp.views import UserCreate, LabView, LabListView, LabServiceListVie
     PastAppointmentsUserView, ProfileView, PatientsView, ResultView, RequestsView, LabAddView, \
     LabRemoveView, UserLogin, LabCreate, RatingAddView, ResultAddView, UserUpdateView, LabUpdateView, \
     AppointmentAddView, AppointmentView, NotificationListView, AppointmentUpdateView, NotificationConfirmView, \
-    AppointmentCancelView, DownloadResult, CanceledAppointmentsView, WeRecommendView
+    AppointmentCancelView, DownloadResult, CanceledAppointmentsView, WeRecommendView, AvailabilityView, \
+    EarliestSlotView, AutocompleteView
 
 schema_view = get_schema_view(
     openapi.Info(title="Pastebin API", default_version='v1'),
@@ -38,11 +39,14 @@ urlpatterns = [
                   url(r'api/v1/register_lab', LabCreate.as_view(), name='lab_account_create'),
                   url(r'api/v1/login', UserLogin.as_view(), name='login'),
                   url(r'^api/v1/labs', LabListView.as_view(), name='labs'),
+                  url(r'^api/v1/autocomplete', AutocompleteView.as_view(), name='autocomplete'),
                   url(r'^api/v1/notifications', NotificationListView.as_view(), name='notifications'),
                   url(r'^api/v1/confirm_notification', NotificationConfirmView.as_view(), name='confirm_notification'),
                   url(r'^api/v1/lab_services', LabServiceListView.as_view(), name='lab_services'),
                   url(r'^api/v1/edit_profile_user', UserUpdateView.as_view(), name='edit_profile_user'),
                   url(r'^api/v1/edit_profile_lab', LabUpdateView.as_view(), name='edit_profile_lab'),
+                  url(r'^api/v1/availability', AvailabilityView.as_view(), name='availability'),
+                  url(r'^api/v1/earliest_slot', EarliestSlotView.as_view(), name='earliest_slot'),
                   url(r'^api/v1/add_appointment', AppointmentAddView.as_view(), name='add_appointment'),
                   url(r'^api/v1/update_appointment', AppointmentUpdateView.as_view(), name='update_appointment'),
                   url(r'^api/v1/cancel_appointment', AppointmentCancelView.as_view(), name='cancel_appointment'),
@@ -11,3 +11,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "src.config.local")
 
 application = get_wsgi_application()
+
+# Build the autocomplete index in the background before the worker's first lookup.
+from bhealthapp.autocomplete import warm_up  # noqa: E402
+
+warm_up()